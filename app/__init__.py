@@ -3,7 +3,6 @@ This file makes the app directory a Python package.
 """
 
 from flask import Flask
-from flask_session import Session
 from flask_apscheduler import APScheduler
 import os
 from dotenv import load_dotenv
@@ -30,12 +29,25 @@ app = Flask(__name__)
 
 # Configure Flask app
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
-app.config['SESSION_TYPE'] = 'filesystem'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
 
+# Store sessions in the database behind an in-memory cache
+from app.sessions import DatabaseSessionInterface, schedule_session_sweep
+app.session_interface = DatabaseSessionInterface()
+
 # Initialize Flask extensions
-Session(app)
 scheduler = APScheduler()
+scheduler.init_app(app)
 
 # Import routes after app is created
-from app import routes 
\ No newline at end of file
+from app import routes
+from app import admin
+
+# Register background jobs (started by run.py)
+from app.token_refresh import schedule_token_refresh
+from app.decoder_pool import schedule_decoder_health_check
+from app.job_queue import schedule_job_queue_sweep
+schedule_token_refresh(scheduler)
+schedule_session_sweep(scheduler)
+schedule_decoder_health_check(scheduler)
+schedule_job_queue_sweep(scheduler)
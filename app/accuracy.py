@@ -0,0 +1,96 @@
+"""
+Word error rate against a reference set, used to vet model variants.
+
+A reference set is a directory of audio files, each with a sibling .txt file
+holding its expected transcript (e.g. note1.ogg + note1.txt).
+"""
+
+import os
+import re
+import time
+
+from app.audio import SAMPLE_RATE, decode_audio, sniff_audio_format
+
+AUDIO_EXTENSIONS = ('.ogg', '.opus', '.mp3', '.m4a', '.mp4', '.wav', '.webm', '.flac', '.amr', '.aac')
+
+def normalize_words(text):
+    """Lowercased words without punctuation"""
+    return re.findall(r"\w+", text.lower())
+
+def edit_distance(reference, hypothesis):
+    """Word-level Levenshtein distance"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word)
+            ))
+        previous = current
+    return previous[-1]
+
+def word_error_rate(reference, hypothesis):
+    ref_words = normalize_words(reference)
+    return edit_distance(ref_words, normalize_words(hypothesis)) / max(1, len(ref_words))
+
+def load_reference_set(directory):
+    """[(name, pcm, reference_text)] for every audio file with a transcript"""
+    items = []
+    for filename in sorted(os.listdir(directory)):
+        stem, extension = os.path.splitext(filename)
+        transcript_path = os.path.join(directory, f"{stem}.txt")
+        if extension.lower() not in AUDIO_EXTENSIONS or not os.path.isfile(transcript_path):
+            continue
+        with open(os.path.join(directory, filename), 'rb') as f:
+            content = f.read()
+        with open(transcript_path) as f:
+            reference = f.read().strip()
+        items.append((filename, decode_audio(content, sniff_audio_format(content[:64])), reference))
+    return items
+
+def evaluate(model, references, **options):
+    """Corpus WER and speed of a loaded model over a reference set"""
+    edits = words = 0
+    seconds = audio_seconds = 0.0
+    for _, audio, reference in references:
+        start = time.perf_counter()
+        hypothesis = model.transcribe(audio, fp16=False, **options)['text']
+        seconds += time.perf_counter() - start
+        audio_seconds += len(audio) / SAMPLE_RATE
+        ref_words = normalize_words(reference)
+        edits += edit_distance(ref_words, normalize_words(hypothesis))
+        words += len(ref_words)
+    return {
+        'wer': edits / max(1, words),
+        'seconds': seconds,
+        'real_time_factor': seconds / audio_seconds if audio_seconds else None
+    }
+
+def check_quantized(name, directory, max_wer_delta):
+    """Compare the int8 model with fp32 on a reference set and record the verdict"""
+    from app.model_store import (
+        expected_sha256, load_model, load_quantized_model, save_quantization_report
+    )
+
+    references = load_reference_set(directory)
+    if not references:
+        raise ValueError(f"No audio files with .txt transcripts in {directory}")
+
+    fp32 = evaluate(load_model(name), references)
+    int8 = evaluate(load_quantized_model(name), references)
+    report = {
+        'model': name,
+        'source_sha256': expected_sha256(name),
+        'reference_dir': os.path.abspath(directory),
+        'clips': len(references),
+        'wer_fp32': fp32['wer'],
+        'wer_int8': int8['wer'],
+        'wer_delta': int8['wer'] - fp32['wer'],
+        'max_wer_delta': max_wer_delta,
+        'speedup': fp32['seconds'] / int8['seconds'] if int8['seconds'] else None
+    }
+    report['passed'] = report['wer_delta'] <= max_wer_delta
+    save_quantization_report(name, report)
+    return report
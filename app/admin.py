@@ -0,0 +1,237 @@
+"""
+Token-protected admin API for live introspection and runtime tuning.
+
+    GET   /admin/status    queue depth, in-flight jobs, caches, pools, outbound
+    GET   /admin/jobs      jobs being processed, with stage and elapsed time
+    GET   /admin/metrics   counters and latency summaries
+    GET   /admin/settings  tunable settings
+    PATCH /admin/settings  change settings without a restart, e.g.
+                           {"transcription_workers": 4,
+                            "models": {"adaptive": false, "default_model": "small"},
+                            "job_intervals": {"refresh_tokens": 120}}
+
+Requests must send ADMIN_TOKEN as a bearer token; without ADMIN_TOKEN the
+API is disabled. A PATCH is validated as a whole before any of it is applied,
+so an invalid setting leaves every other one unchanged. Changes apply to this process only and last until it
+restarts, so put settings that should stick in the environment too.
+"""
+
+import hmac
+import os
+from functools import wraps
+
+from apscheduler.triggers.interval import IntervalTrigger
+from flask import jsonify, request
+
+from app import app, metrics, model_policy, routing, scheduler
+from app.decoder_pool import audio_ring, decoder_pool
+from app.fingerprint import fingerprint_index
+from app.http_client import attachment_client
+from app.inference_pool import inference_pool
+from app.job_queue import PROCESS_ROLE, queue_depth
+from app.location_cache import location_cache
+from app.model_store import loaded_models
+from app.outbound import outbound_sender
+from app.pipeline import transcription_scheduler
+from app.shutdown import is_draining
+from app.webhooks import webhook_batcher
+
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+
+def admin_required(view):
+    """Reject requests without the admin bearer token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({'error': 'Not found'}), 404
+        header = request.headers.get('Authorization', '')
+        token = header[len('Bearer '):] if header.startswith('Bearer ') else ''
+        if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+            return jsonify({'error': 'Unauthorized'}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def scheduled_jobs():
+    """Background jobs with their interval and next run"""
+    jobs = {}
+    for job in scheduler.get_jobs():
+        interval = getattr(job.trigger, 'interval', None)
+        next_run = getattr(job, 'next_run_time', None)
+        jobs[job.id] = {
+            'interval_seconds': interval.total_seconds() if interval else None,
+            'next_run': next_run.isoformat() if next_run else None
+        }
+    return jobs
+
+def per_location(convert):
+    """Check for {location_id: value}, converting each value"""
+    def check(values):
+        if not isinstance(values, dict):
+            raise ValueError("expected an object of location id to value")
+        return {location_id: convert(value) for location_id, value in values.items()}
+    return check
+
+def check_job_intervals(intervals):
+    if not isinstance(intervals, dict):
+        raise ValueError("expected an object of job id to seconds")
+    checked = {}
+    for job_id, seconds in intervals.items():
+        seconds = float(seconds)
+        if seconds <= 0:
+            raise ValueError(f"Interval of '{job_id}' must be positive")
+        if scheduler.get_job(job_id) is None:
+            raise ValueError(f"Unknown job '{job_id}'")
+        checked[job_id] = seconds
+    return checked
+
+def set_job_intervals(intervals):
+    """Reschedule interval jobs, {job_id: seconds}"""
+    for job_id, seconds in intervals.items():
+        jitter = getattr(scheduler.get_job(job_id).trigger, 'jitter', None)
+        scheduler.scheduler.reschedule_job(job_id, trigger=IntervalTrigger(seconds=seconds, jitter=jitter))
+
+def set_location_quotas(quotas):
+    for location_id, max_concurrency in quotas.items():
+        transcription_scheduler.set_quota(location_id, max_concurrency)
+
+def set_location_weights(weights):
+    for location_id, weight in weights.items():
+        transcription_scheduler.set_weight(location_id, weight)
+
+def set_webhook_batch_window(window_ms):
+    webhook_batcher.window = max(0.0, window_ms) / 1000.0
+
+def set_webhook_batch_max(max_size):
+    webhook_batcher.max_size = max(1, max_size)
+
+def set_outbound_batch_size(batch_size):
+    outbound_sender.batch_size = max(1, batch_size)
+
+def check_decoder_pool_size(size):
+    if decoder_pool is None:
+        raise ValueError("Decoder pool is disabled (DECODER_POOL_SIZE=0)")
+    return int(size)
+
+def set_decoder_pool_size(size):
+    decoder_pool.resize(size)
+
+def check_download_timeouts(timeouts):
+    if not isinstance(timeouts, dict):
+        raise ValueError("expected an object of timeout name to seconds")
+    unknown = set(timeouts) - {'connect', 'read', 'total'}
+    if unknown:
+        raise ValueError(f"Unknown timeout(s): {', '.join(sorted(unknown))}")
+    return {name: float(value) for name, value in timeouts.items()}
+
+def set_download_timeouts(timeouts):
+    attachment_client.set_timeouts(**timeouts)
+
+def check_models(changes):
+    if not isinstance(changes, dict):
+        raise ValueError("expected an object of model settings")
+    return model_policy.check_configuration(**changes)
+
+def set_models(changes):
+    model_policy.configure(**changes)
+
+# Setting name -> (function checking and normalising a new value, function applying it)
+SETTERS = {
+    'transcription_workers': (int, transcription_scheduler.set_workers),
+    'location_max_concurrency': (int, transcription_scheduler.set_location_concurrency),
+    'location_quotas': (per_location(int), set_location_quotas),
+    'location_weights': (per_location(float), set_location_weights),
+    'webhook_batch_window_ms': (float, set_webhook_batch_window),
+    'webhook_batch_max': (int, set_webhook_batch_max),
+    'outbound_batch_size': (int, set_outbound_batch_size),
+    'decoder_pool_size': (check_decoder_pool_size, set_decoder_pool_size),
+    'download_timeouts': (check_download_timeouts, set_download_timeouts),
+    'models': (check_models, set_models),
+    'job_intervals': (check_job_intervals, set_job_intervals)
+}
+
+def current_settings():
+    return {
+        'transcription_workers': transcription_scheduler.workers,
+        'location_max_concurrency': transcription_scheduler.location_concurrency,
+        'location_quotas': dict(transcription_scheduler.quotas),
+        'location_weights': dict(transcription_scheduler.weights),
+        'webhook_batch_window_ms': webhook_batcher.window * 1000.0,
+        'webhook_batch_max': webhook_batcher.max_size,
+        'outbound_batch_size': outbound_sender.batch_size,
+        'decoder_pool_size': decoder_pool.size if decoder_pool is not None else None,
+        'download_timeouts': attachment_client.timeouts(),
+        'models': model_policy.settings(),
+        'job_intervals': {job_id: job['interval_seconds'] for job_id, job in scheduled_jobs().items()}
+    }
+
+@app.route('/admin/status')
+@admin_required
+def admin_status():
+    """Live state of queues, jobs, caches and pools"""
+    try:
+        durable_depth = queue_depth()
+    except Exception as e:
+        print(f"Error reading job queue depth: {str(e)}")
+        durable_depth = None
+    return jsonify({
+        'role': PROCESS_ROLE,
+        'draining': is_draining(),
+        'scheduler': transcription_scheduler.stats(),
+        'running_jobs': transcription_scheduler.running_jobs(),
+        'job_queue': {'queued': durable_depth},
+        'caches': {
+            'locations': location_cache.stats()
+        },
+        'pools': {
+            'inference': inference_pool.stats() if inference_pool is not None else None,
+            'decoder': decoder_pool.stats() if decoder_pool is not None else None,
+            'shared_audio': audio_ring.stats() if audio_ring is not None else None,
+            'loaded_models': loaded_models()
+        },
+        'download_breakers': attachment_client.stats(),
+        'outbound': outbound_sender.stats(),
+        'routing': routing.stats(),
+        'fingerprints': fingerprint_index.stats(),
+        'scheduled_jobs': scheduled_jobs()
+    })
+
+@app.route('/admin/jobs')
+@admin_required
+def admin_jobs():
+    """Jobs in progress on this process"""
+    return jsonify({'running': transcription_scheduler.running_jobs()})
+
+@app.route('/admin/metrics')
+@admin_required
+def admin_metrics():
+    return jsonify(metrics.snapshot())
+
+@app.route('/admin/settings', methods=['GET', 'PATCH'])
+@admin_required
+def admin_settings():
+    """Show or change runtime settings"""
+    if request.method == 'GET':
+        return jsonify(current_settings())
+
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict) or not changes:
+        return jsonify({'error': 'Expected a JSON object of settings'}), 400
+    unknown = sorted(set(changes) - set(SETTERS))
+    if unknown:
+        return jsonify({'error': f"Unknown setting(s): {', '.join(unknown)}"}), 400
+
+    # Check the whole request first so it applies completely or not at all
+    checked = {}
+    for name, value in changes.items():
+        check, _ = SETTERS[name]
+        try:
+            checked[name] = check(value)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f"Invalid {name}: {str(e)}", 'settings': current_settings()}), 400
+
+    for name, value in checked.items():
+        _, apply = SETTERS[name]
+        apply(value)
+        print(f"Admin changed {name} to {value}")
+        metrics.incr(f'admin.settings_changed.{name}')
+    return jsonify(current_settings())
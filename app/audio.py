@@ -0,0 +1,148 @@
+"""
+Audio container detection and decoding to Whisper's input format.
+"""
+
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+
+# Bytes needed to identify every supported container
+SNIFF_BYTES = 64
+
+def sniff_audio_format(head):
+    """Identify an audio container from its first bytes
+
+    Returns one of 'opus', 'ogg', 'mp3', 'aac', 'm4a', 'mp4', 'wav', 'webm',
+    'flac', 'amr', or None if the bytes do not look like audio.
+    """
+    if len(head) < 12:
+        return None
+    if head.startswith(b'OggS'):
+        # The first page of an Ogg Opus stream carries the OpusHead packet
+        return 'opus' if b'OpusHead' in head[:SNIFF_BYTES] else 'ogg'
+    if head.startswith(b'RIFF') and head[8:12] == b'WAVE':
+        return 'wav'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        return 'm4a' if brand in (b'M4A ', b'M4B ') else 'mp4'
+    if head.startswith(b'\x1a\x45\xdf\xa3'):
+        return 'webm'
+    if head.startswith(b'fLaC'):
+        return 'flac'
+    if head.startswith(b'#!AMR'):
+        return 'amr'
+    if head.startswith(b'ID3'):
+        return 'mp3'
+    if head[0] == 0xFF:
+        # ADTS AAC has layer bits 00, MPEG audio frames use 01-11
+        if head[1] & 0xF6 == 0xF0:
+            return 'aac'
+        if head[1] & 0xE0 == 0xE0:
+            return 'mp3'
+    return None
+
+# Decoding: everything is returned as 16 kHz mono float32 PCM, as whisper expects
+SAMPLE_RATE = 16000
+# Largest Opus frame is 120 ms
+OPUS_MAX_FRAME = SAMPLE_RATE * 120 // 1000
+# Containers that ffmpeg cannot always demux from a pipe (moov atom at the end)
+SEEKABLE_FORMATS = ('mp4', 'm4a')
+
+try:
+    import opuslib
+except Exception:  # ImportError, or OSError when libopus is missing
+    opuslib = None
+
+class AudioDecodeError(Exception):
+    """Raised when audio bytes cannot be decoded"""
+
+def iter_ogg_packets(data):
+    """Yield the packets of the first logical stream in an Ogg file"""
+    view = memoryview(data)
+    offset = 0
+    serial = None
+    packet = bytearray()
+    while offset + 27 <= len(view):
+        if view[offset:offset + 4] != b'OggS':
+            raise AudioDecodeError(f"Bad Ogg page at byte {offset}")
+        page_serial = int.from_bytes(view[offset + 14:offset + 18], 'little')
+        segments = view[offset + 26]
+        lacing = view[offset + 27:offset + 27 + segments]
+        body = offset + 27 + segments
+        if serial is None:
+            serial = page_serial
+        if page_serial == serial:
+            position = body
+            for size in lacing:
+                packet += view[position:position + size]
+                position += size
+                # A lacing value below 255 terminates the packet
+                if size < 255:
+                    yield bytes(packet)
+                    packet = bytearray()
+        offset = body + sum(lacing)
+
+def decode_opus(data):
+    """Decode Ogg Opus in-process straight to 16 kHz mono, without ffmpeg"""
+    if opuslib is None:
+        raise AudioDecodeError("opuslib is not available")
+
+    packets = iter_ogg_packets(data)
+    head = next(packets, b'')
+    if not head.startswith(b'OpusHead') or len(head) < 19:
+        raise AudioDecodeError("Missing OpusHead")
+    if head[18] != 0:
+        raise AudioDecodeError("Multichannel Opus mapping is not supported natively")
+    # Pre-skip is expressed at 48 kHz
+    pre_skip = int.from_bytes(head[10:12], 'little') * SAMPLE_RATE // 48000
+    next(packets, None)  # OpusTags
+
+    # libopus resamples and downmixes internally when asked for 16 kHz mono
+    decoder = opuslib.Decoder(SAMPLE_RATE, 1)
+    pcm = bytearray()
+    for packet in packets:
+        if packet:
+            pcm += decoder.decode(packet, OPUS_MAX_FRAME)
+
+    samples = np.frombuffer(bytes(pcm), dtype=np.int16)[pre_skip:]
+    return samples.astype(np.float32) / 32768.0
+
+def decode_with_ffmpeg(content, audio_format=None):
+    """Decode any container with an ffmpeg subprocess, piping bytes in and PCM out"""
+    cmd = ['ffmpeg', '-nostdin', '-threads', '0', '-loglevel', 'error']
+    temp_path = None
+    if audio_format in SEEKABLE_FORMATS:
+        with tempfile.NamedTemporaryFile(suffix=f'.{audio_format}', delete=False) as temp_file:
+            temp_file.write(content)
+            temp_path = temp_file.name
+        cmd += ['-i', temp_path]
+        stdin = None
+    else:
+        cmd += ['-i', 'pipe:0']
+        stdin = content
+    cmd += ['-f', 's16le', '-ac', '1', '-acodec', 'pcm_s16le', '-ar', str(SAMPLE_RATE), '-']
+
+    try:
+        result = subprocess.run(cmd, input=stdin, capture_output=True, check=True)
+    except subprocess.CalledProcessError as e:
+        raise AudioDecodeError(f"ffmpeg failed: {e.stderr.decode(errors='replace').strip()}") from e
+    finally:
+        if temp_path:
+            os.unlink(temp_path)
+    return np.frombuffer(result.stdout, np.int16).astype(np.float32) / 32768.0
+
+def decode_audio(content, audio_format=None):
+    """Decode attachment bytes to 16 kHz mono float32 PCM
+
+    Ogg Opus (WhatsApp voice notes) takes the in-process libopus path when
+    opuslib is installed; everything else, and any native failure, goes
+    through ffmpeg.
+    """
+    if audio_format == 'opus' and opuslib is not None:
+        try:
+            return decode_opus(content)
+        except Exception as e:
+            print(f"Native Opus decode failed, falling back to ffmpeg: {str(e)}")
+    return decode_with_ffmpeg(content, audio_format)
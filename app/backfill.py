@@ -0,0 +1,328 @@
+"""
+Backfill transcriptions for historical GoHighLevel conversations.
+
+Pages through a location's conversations (oldest activity first) and their
+messages, queues audio attachments into the transcription scheduler with a
+bounded number of outstanding jobs, and checkpoints to the database once every
+job of a conversation has succeeded, so an interrupted run resumes where it
+stopped without losing or repeating work. Progress is a (lastMessageDate, id)
+keyset, so conversations sharing a date are neither skipped nor repeated. A
+failed job is retried BACKFILL_JOB_RETRIES times; after that it is recorded in
+backfill_failures and the run moves on, so one expired attachment cannot stop
+a location's backfill for good (a --reset run tries it again). A job cancelled
+by a shutdown pauses the run at its conversation instead. Backfilled
+transcripts are stored only; nothing is posted back to old conversations.
+"""
+
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from sqlalchemy.dialects.postgresql import insert
+
+from app.database import BackfillCheckpoint, BackfillFailure, SessionLocal, get_utc_now, get_valid_token
+from app.ghl import API_BASE_URL, auth_headers, http_session
+from app.job_scheduler import TranscriptionJob
+from app.pipeline import transcription_scheduler
+from app.ratelimit import ghl_rate_limiter
+from app.transcripts import transcribed_message_ids
+
+# Backfill configuration
+BACKFILL_PAGE_SIZE = int(os.getenv('BACKFILL_PAGE_SIZE', 100))
+BACKFILL_MAX_PENDING = int(os.getenv('BACKFILL_MAX_PENDING', 8))
+BACKFILL_REPORT_INTERVAL = float(os.getenv('BACKFILL_REPORT_INTERVAL', 30))
+BACKFILL_JOB_RETRIES = int(os.getenv('BACKFILL_JOB_RETRIES', 2))
+DEFAULT_RETRY_AFTER = 10.0
+AUDIO_EXTENSIONS = ('.mp3', '.ogg', '.oga', '.opus', '.m4a', '.mp4', '.wav', '.webm', '.aac', '.amr')
+
+class BackfillError(Exception):
+    """The run was interrupted before a conversation; it resumes there"""
+
+def is_audio_url(url):
+    """Cheap check on the URL path extension"""
+    return urlparse(url).path.lower().endswith(AUDIO_EXTENSIONS)
+
+def retry_after_seconds(value, default=DEFAULT_RETRY_AFTER):
+    """Seconds to wait from a Retry-After header, in either delta-seconds or HTTP-date form"""
+    if not value:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return default
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def ghl_get(location_id, path, params):
+    """Rate-limited GET against the GoHighLevel API, honoring 429 Retry-After"""
+    while True:
+        access_token = get_valid_token(location_id)
+        if not access_token:
+            raise RuntimeError(f"No valid token for location {location_id}")
+        ghl_rate_limiter.acquire(location_id)
+        response = http_session.get(f"{API_BASE_URL}{path}", headers=auth_headers(access_token), params=params, timeout=30)
+        if response.status_code == 429:
+            retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+            print(f"Rate limited by GoHighLevel, sleeping {retry_after:.0f}s")
+            time.sleep(retry_after)
+            continue
+        response.raise_for_status()
+        return response.json()
+
+def record_failure(db, job, attempts):
+    """Remember an attachment the backfill gave up on, committing it"""
+    stmt = insert(BackfillFailure).values(
+        location_id=job.location_id, message_id=job.message_id, url=job.url,
+        conversation_id=job.conversation_id, attempts=attempts, error=job.error
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[BackfillFailure.location_id, BackfillFailure.message_id, BackfillFailure.url],
+        set_={'attempts': stmt.excluded.attempts, 'error': stmt.excluded.error, 'failed_at': get_utc_now()}
+    ))
+    db.commit()
+
+def conversation_key(conversation):
+    """Position of a conversation in the backfill order"""
+    return conversation.get('lastMessageDate') or 0, conversation['id']
+
+def iter_conversations(location_id, after=None):
+    """Yield (conversation, total) in conversation_key order, strictly after the key after
+
+    Conversations sharing a date are yielded together, sorted by id: a page
+    is requested from just before the last key's date, and when a full page
+    ends inside a date that date is left whole for the next page. Only a
+    single date with more conversations than fit in a page can be cut short.
+    """
+    start = None if after is None else after[0] - 1
+    while True:
+        params = {
+            'locationId': location_id,
+            'limit': BACKFILL_PAGE_SIZE,
+            'sortBy': 'last_message_date',
+            'sort': 'asc'
+        }
+        if start is not None:
+            params['startAfterDate'] = start
+        data = ghl_get(location_id, '/conversations/search', params)
+        page = data.get('conversations', [])
+        conversations = sorted(
+            (conversation for conversation in page if after is None or conversation_key(conversation) > after),
+            key=conversation_key
+        )
+        if len(page) < BACKFILL_PAGE_SIZE:
+            for conversation in conversations:
+                yield conversation, data.get('total')
+            return
+
+        dates = [conversation_key(conversation)[0] for conversation in page]
+        first_date, last_date = min(dates), max(dates)
+        ready = [c for c in conversations if conversation_key(c)[0] < last_date]
+        if not ready and first_date < last_date:
+            # The page was the already-yielded first date plus part of the last one
+            start = first_date
+            continue
+        if not ready:
+            print(f"More than {BACKFILL_PAGE_SIZE} conversations at {last_date}, some may be skipped")
+            ready, start = conversations, last_date
+        else:
+            start = conversation_key(ready[-1])[0] - 1
+        for conversation in ready:
+            yield conversation, data.get('total')
+        if ready:
+            after = conversation_key(ready[-1])
+
+def iter_messages(location_id, conversation_id):
+    """Yield every message of a conversation"""
+    last_message_id = None
+    while True:
+        params = {'limit': BACKFILL_PAGE_SIZE}
+        if last_message_id:
+            params['lastMessageId'] = last_message_id
+        page = ghl_get(location_id, f'/conversations/{conversation_id}/messages', params).get('messages', {})
+        for message in page.get('messages', []):
+            yield message
+        last_message_id = page.get('lastMessageId')
+        if not page.get('nextPage') or not last_message_id:
+            return
+
+class Backfill:
+    """One resumable backfill run for a location"""
+
+    def __init__(self, location_id, max_pending=BACKFILL_MAX_PENDING, scheduler=transcription_scheduler):
+        self.location_id = location_id
+        self.max_pending = max_pending
+        self.scheduler = scheduler
+        self.window = deque()
+        self.total = None
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.done_this_run = 0
+        self.jobs_completed = 0
+        self.jobs_failed = 0
+        self._db = None
+        self._checkpoint = None
+        # Failed attempts per (message id, url), and those given up on
+        self._attempts = {}
+        self._given_up = set()
+
+    def _load_checkpoint(self, db, reset):
+        checkpoint = db.get(BackfillCheckpoint, self.location_id)
+        if checkpoint is None:
+            checkpoint = BackfillCheckpoint(location_id=self.location_id, conversations_done=0,
+                                            messages_scanned=0, jobs_queued=0)
+            db.add(checkpoint)
+        elif reset:
+            checkpoint.start_after_date = None
+            checkpoint.last_conversation_id = None
+            checkpoint.conversations_done = 0
+            checkpoint.messages_scanned = 0
+            checkpoint.jobs_queued = 0
+        checkpoint.status = 'running'
+        db.commit()
+        return checkpoint
+
+    def _queue_conversation(self, conversation):
+        """Submit jobs for the conversation's untranscribed audio, returns (jobs, messages)"""
+        audio = []
+        scanned = 0
+        for message in iter_messages(self.location_id, conversation['id']):
+            scanned += 1
+            for url in message.get('attachments') or []:
+                if isinstance(url, str) and is_audio_url(url):
+                    audio.append((message, url))
+
+        already = transcribed_message_ids(self.location_id, {message['id'] for message, _ in audio})
+        jobs = []
+        for message, url in audio:
+            if message['id'] in already:
+                continue
+            self._wait_for_capacity(jobs)
+            jobs.append(self.scheduler.submit(TranscriptionJob(
+                url,
+                location_id=self.location_id,
+                conversation_id=conversation['id'],
+                contact_id=message.get('contactId') or conversation.get('contactId'),
+                message_id=message['id'],
+                message_type=message.get('messageType'),
+                deliver=False
+            )))
+        return jobs, scanned
+
+    def _outstanding(self, current):
+        queued = [job for _, jobs, _ in self.window for job in jobs] + current
+        return sum(1 for job in queued if not job.done.is_set())
+
+    def _wait_for_capacity(self, current):
+        while self._outstanding(current) >= self.max_pending:
+            self._advance()
+            time.sleep(0.5)
+
+    def _retry_failed(self, jobs):
+        """Resubmit failed jobs in place, recording those out of retries
+
+        Raises BackfillError for a cancelled job: the run is shutting down.
+        """
+        for i, job in enumerate(jobs):
+            if not job.done.is_set() or (job.error is None and not job.cancelled):
+                continue
+            if job.cancelled:
+                raise BackfillError(f"Job for message {job.message_id} was cancelled")
+            key = (job.message_id, job.url)
+            if key in self._given_up:
+                continue
+            self._attempts[key] = self._attempts.get(key, 0) + 1
+            if self._attempts[key] > BACKFILL_JOB_RETRIES:
+                print(f"Giving up on message {job.message_id} after {self._attempts[key]} attempt(s): {job.error}")
+                record_failure(self._db, job, self._attempts[key])
+                self._given_up.add(key)
+                self.jobs_failed += 1
+                continue
+            print(f"Retrying message {job.message_id} after failure: {job.error}")
+            jobs[i] = self.scheduler.submit(TranscriptionJob(
+                job.url,
+                location_id=job.location_id,
+                conversation_id=job.conversation_id,
+                contact_id=job.contact_id,
+                message_id=job.message_id,
+                message_type=job.message_type,
+                deliver=False
+            ))
+
+    def _advance(self):
+        """Checkpoint every leading conversation whose jobs have all succeeded or been given up"""
+        checkpoint = self._checkpoint
+        advanced = False
+        for _, jobs, _ in self.window:
+            self._retry_failed(jobs)
+        while self.window and all(job.done.is_set() for job in self.window[0][1]):
+            conversation, jobs, scanned = self.window.popleft()
+            checkpoint.start_after_date, checkpoint.last_conversation_id = conversation_key(conversation)
+            checkpoint.conversations_done += 1
+            checkpoint.messages_scanned += scanned
+            checkpoint.jobs_queued += len(jobs)
+            self.done_this_run += 1
+            self.jobs_completed += len(jobs)
+            advanced = True
+        if advanced:
+            self._db.commit()
+        self._report(checkpoint)
+
+    def _report(self, checkpoint, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < BACKFILL_REPORT_INTERVAL:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.done_this_run / elapsed
+        eta = None
+        if self.total and rate > 0:
+            eta = max(0, self.total - checkpoint.conversations_done) / rate
+        print(
+            f"[backfill {self.location_id}] conversations {checkpoint.conversations_done}/{self.total or '?'}"
+            f" | messages {checkpoint.messages_scanned} | audio jobs {checkpoint.jobs_queued}"
+            f" ({self.jobs_failed} given up)"
+            f" | {rate * 60:.1f} conv/min, {self.jobs_completed / elapsed * 60:.1f} jobs/min"
+            f" | ETA {f'{eta / 60:.1f} min' if eta is not None else 'unknown'}"
+        )
+
+    def run(self, reset=False):
+        self._db = SessionLocal()
+        try:
+            self._checkpoint = self._load_checkpoint(self._db, reset)
+            after = None
+            if self._checkpoint.start_after_date is not None:
+                after = (self._checkpoint.start_after_date, self._checkpoint.last_conversation_id or '')
+            print(f"Starting backfill for {self.location_id}"
+                  + (f", resuming after conversation {after[1]}" if after else ""))
+
+            for conversation, total in iter_conversations(self.location_id, after):
+                self.total = total
+                jobs, scanned = self._queue_conversation(conversation)
+                self.window.append((conversation, jobs, scanned))
+                self._advance()
+
+            # Drain outstanding jobs before marking the run complete
+            while self.window:
+                self._advance()
+                time.sleep(0.5)
+
+            self._checkpoint.status = 'done'
+            self._checkpoint.updated_at = get_utc_now()
+            self._db.commit()
+            self._report(self._checkpoint, force=True)
+            print(f"Backfill for {self.location_id} completed")
+        except BaseException:
+            self._db.rollback()
+            self._checkpoint.status = 'paused'
+            self._db.commit()
+            raise
+        finally:
+            self._db.close()
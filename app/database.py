@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, event
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Text, Float, DateTime, Boolean, Computed, Index, LargeBinary, ForeignKey, event
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime, timezone, timedelta
@@ -55,6 +56,167 @@ class Token(Base):
             return True
         return get_utc_now() >= self.expires_at
 
+class TokenRefreshLease(Base):
+    """Node currently refreshing a location's token, until expires_at"""
+    __tablename__ = "token_refresh_leases"
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    location_id = Column(String, primary_key=True)
+    holder = Column(String, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+class WebSession(Base):
+    """Server-side Flask session"""
+    __tablename__ = "sessions"
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    sid = Column(String, primary_key=True)
+    data = Column(Text, nullable=False)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+class Transcription(Base):
+    """Persisted transcription of an audio attachment"""
+    __tablename__ = "transcriptions"
+    __table_args__ = (
+        Index('ix_transcriptions_location_created', 'location_id', 'created_at', 'id'),
+        Index('ix_transcriptions_location_contact_created', 'location_id', 'contact_id', 'created_at', 'id'),
+        Index('ix_transcriptions_audio_hash', 'location_id', 'audio_hash'),
+        Index('ix_transcriptions_message', 'location_id', 'message_id'),
+        Index('ix_transcriptions_search', 'search_vector', postgresql_using='gin'),
+        {'schema': SCHEMA_NAME}
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    location_id = Column(String)
+    contact_id = Column(String)
+    conversation_id = Column(String)
+    message_id = Column(String)
+    attachment_url = Column(String)
+    audio_hash = Column(String(64))
+    text = Column(Text, nullable=False)
+    language = Column(String(16))
+    duration_seconds = Column(Float)
+    model = Column(String(32))
+    download_ms = Column(Integer)
+    transcribe_ms = Column(Integer)
+    created_at = Column(DateTime(timezone=True), default=get_utc_now, nullable=False)
+    search_vector = Column(TSVECTOR, Computed("to_tsvector('simple', coalesce(text, ''))", persisted=True))
+
+class AudioFingerprint(Base):
+    """Acoustic fingerprint of transcribed audio, for near-duplicate reuse"""
+    __tablename__ = "audio_fingerprints"
+    __table_args__ = (
+        Index('ix_audio_fingerprints_location_created', 'location_id', 'created_at'),
+        {'schema': SCHEMA_NAME}
+    )
+
+    transcription_id = Column(BigInteger, ForeignKey(f'{SCHEMA_NAME}.transcriptions.id', ondelete='CASCADE'), primary_key=True)
+    location_id = Column(String)
+    duration_seconds = Column(Float, nullable=False)
+    fingerprint = Column(LargeBinary, nullable=False)
+    # Packed bit per sub-fingerprint: both frames above the silence floor
+    voiced = Column(LargeBinary)
+    created_at = Column(DateTime(timezone=True), default=get_utc_now, nullable=False)
+
+class BackfillCheckpoint(Base):
+    """Resumable progress of a historical backfill for one location"""
+    __tablename__ = "backfill_checkpoints"
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    location_id = Column(String, primary_key=True)
+    start_after_date = Column(BigInteger)
+    last_conversation_id = Column(String)
+    conversations_done = Column(Integer, default=0, nullable=False)
+    messages_scanned = Column(Integer, default=0, nullable=False)
+    jobs_queued = Column(Integer, default=0, nullable=False)
+    status = Column(String(16), default='running', nullable=False)
+    updated_at = Column(DateTime(timezone=True), default=get_utc_now, onupdate=get_utc_now)
+
+class BackfillFailure(Base):
+    """Historical attachment the backfill gave up on after its retries"""
+    __tablename__ = "backfill_failures"
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    location_id = Column(String, primary_key=True)
+    message_id = Column(String, primary_key=True)
+    url = Column(Text, primary_key=True)
+    conversation_id = Column(String)
+    attempts = Column(Integer, nullable=False)
+    error = Column(Text)
+    failed_at = Column(DateTime(timezone=True), default=get_utc_now, nullable=False)
+
+class QueuedJob(Base):
+    """Durable transcription job shared between web and worker nodes"""
+    __tablename__ = "transcription_jobs"
+    __table_args__ = (
+        Index('ix_transcription_jobs_status', 'status', 'id'),
+        {'schema': SCHEMA_NAME}
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    dedup_key = Column(String(40), unique=True)
+    location_id = Column(String)
+    conversation_id = Column(String)
+    contact_id = Column(String)
+    message_id = Column(String)
+    message_type = Column(String)
+    url = Column(Text, nullable=False)
+    estimated_seconds = Column(Float)
+    deliver = Column(Boolean, default=True, nullable=False)
+    status = Column(String(16), default='queued', nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    worker_id = Column(String)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=get_utc_now, nullable=False)
+    started_at = Column(DateTime(timezone=True))
+    # Renewed by the running worker; the lease expires when it goes stale
+    heartbeat_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+class OutboundUpdate(Base):
+    """Pending GoHighLevel write (contact field, inbound message) awaiting delivery"""
+    __tablename__ = "outbound_updates"
+    __table_args__ = (
+        Index('ix_outbound_updates_due', 'next_attempt_at', 'id'),
+        # Finds older updates of the same location when claiming
+        Index('ix_outbound_updates_location', 'location_id', 'id'),
+        {'schema': SCHEMA_NAME}
+    )
+
+    id = Column(BigInteger, primary_key=True)
+    location_id = Column(String)
+    kind = Column(String(32), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime(timezone=True), default=get_utc_now, nullable=False)
+    locked_until = Column(DateTime(timezone=True))
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=get_utc_now, nullable=False)
+
+class OutboundDeadLetter(Base):
+    """GoHighLevel write that exhausted its retries or was rejected"""
+    __tablename__ = "outbound_dead_letters"
+    __table_args__ = {'schema': SCHEMA_NAME}
+
+    # Same id as the outbound_updates row it came from
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
+    location_id = Column(String)
+    kind = Column(String(32), nullable=False)
+    payload = Column(JSONB, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    failed_at = Column(DateTime(timezone=True), default=get_utc_now, nullable=False)
+
+def get_token_location():
+    """Location of the most recent active token in database"""
+    db = SessionLocal()
+    try:
+        token = db.query(Token).filter(Token.is_active == True).order_by(Token.created_at.desc()).first()
+        return token.location_id if token else None
+    finally:
+        db.close()
+
 def get_db():
     """Get database session"""
     db = SessionLocal()
@@ -73,16 +235,18 @@ def save_token(token_info, location_id=None):
         db = SessionLocal()
         print("Database session created")
         
-        token = Token(
-            access_token=token_info['access_token'],
-            refresh_token=token_info.get('refresh_token'),
-            location_id=location_id,
-            expires_at=get_utc_now() + timedelta(seconds=token_info.get('expires_in', 3600)),
-            is_active=True
-        )
-        print("Token object created")
-        
-        db.add(token)
+        if location_id:
+            # Retire the location's previous tokens in the same transaction
+            token = store_refreshed_token(db, token_info, location_id)
+        else:
+            token = Token(
+                access_token=token_info['access_token'],
+                refresh_token=token_info.get('refresh_token'),
+                location_id=location_id,
+                expires_at=get_utc_now() + timedelta(seconds=token_info.get('expires_in', 3600)),
+                is_active=True
+            )
+            db.add(token)
         print("Token added to session")
         
         db.commit()
@@ -105,11 +269,14 @@ def save_token(token_info, location_id=None):
             db.close()
             print("Database session closed")
 
-def get_valid_token():
-    """Get a valid access token from database"""
+def get_valid_token(location_id=None):
+    """Get a valid access token from database, optionally for one location"""
     try:
         db = SessionLocal()
-        token = db.query(Token).filter(Token.is_active == True).order_by(Token.created_at.desc()).first()
+        query = db.query(Token).filter(Token.is_active == True)
+        if location_id:
+            query = query.filter(Token.location_id == location_id)
+        token = query.order_by(Token.created_at.desc()).first()
         
         if not token:
             print("No active token found")
@@ -127,18 +294,38 @@ def get_valid_token():
         if 'db' in locals():
             db.close()
 
-def refresh_token(token_info):
+def get_location_token(db, location_id):
+    """Get the most recent active token for a location"""
+    return (
+        db.query(Token)
+        .filter(Token.is_active == True, Token.location_id == location_id)
+        .order_by(Token.created_at.desc())
+        .first()
+    )
+
+def store_refreshed_token(db, token_info, location_id):
+    """Add a refreshed token and deactivate the previous ones for its location, without committing"""
+    db.query(Token).filter(
+        Token.location_id == location_id,
+        Token.is_active == True
+    ).update({Token.is_active: False}, synchronize_session=False)
+
+    token = Token(
+        access_token=token_info['access_token'],
+        refresh_token=token_info.get('refresh_token'),
+        location_id=location_id,
+        expires_at=get_utc_now() + timedelta(seconds=token_info.get('expires_in', 3600)),
+        is_active=True
+    )
+    db.add(token)
+    return token
+
+def refresh_token(token_info, location_id=None):
     """Refresh token in database"""
     try:
         db = SessionLocal()
-        # Create new token instead of updating existing one
-        token = Token(
-            access_token=token_info['access_token'],
-            refresh_token=token_info.get('refresh_token'),
-            expires_at=get_utc_now() + timedelta(seconds=token_info.get('expires_in', 3600)),
-            is_active=True
-        )
-        db.add(token)
+        # Create new token and retire the previous ones for the same location
+        token = store_refreshed_token(db, token_info, location_id or token_info.get('locationId'))
         db.commit()
         db.refresh(token)
         return token
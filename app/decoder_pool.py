@@ -0,0 +1,276 @@
+"""
+Pool of long-lived audio decoder processes.
+
+Each worker is a persistent process that receives encoded bytes over a pipe
+and sends back 16 kHz mono float32 PCM. With PyAV installed, workers decode
+through libavcodec in-process, so bursts of short clips no longer pay an
+ffmpeg spawn and teardown per clip; without it they fall back to the ffmpeg
+subprocess path. Workers are health-checked with a ping, replaced when they
+die or time out, and recycled after DECODER_MAX_JOBS decodes. The number of
+concurrent decodes is bounded by the pool size, which defaults to the
+physical core count.
+
+When the shared audio ring is enabled (app.shared_audio), workers write PCM
+straight into a leased slot and answer with the sample count, so the
+samples never travel through the pipe.
+
+Workers run app/decoder_worker.py as a script, so they never import the app
+package (Flask, whisper, torch), and callers waiting for a worker are woken
+whenever one is returned, discarded or the pool is resized.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+from app import metrics
+from app.audio import AudioDecodeError, decode_audio, opuslib
+from app.decoder_worker import av
+from app.inference_pool import inference_pool, physical_cores
+from app.shared_audio import create_default_ring
+
+DECODER_POOL_SIZE = os.getenv('DECODER_POOL_SIZE', 'auto' if av is not None else '0')
+DECODER_MAX_JOBS = int(os.getenv('DECODER_MAX_JOBS', 500))
+DECODER_TIMEOUT = float(os.getenv('DECODER_TIMEOUT', 60))
+DECODER_PING_TIMEOUT = float(os.getenv('DECODER_PING_TIMEOUT', 2))
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decoder_worker.py')
+
+class DecoderWorker:
+    """Handle on one decoder process and its connection"""
+
+    def __init__(self):
+        parent_sock, child_sock = socket.socketpair()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, str(child_sock.fileno())],
+                pass_fds=(child_sock.fileno(),)
+            )
+        except Exception:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.jobs = 0
+        self.started_at = time.monotonic()
+
+    def _call(self, message, timeout):
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"Decoder {self.process.pid} did not answer within {timeout}s")
+        return self.conn.recv()
+
+    def ping(self, timeout=DECODER_PING_TIMEOUT):
+        try:
+            return self.process.poll() is None and self._call(('ping',), timeout)[0] == 'pong'
+        except Exception:
+            return False
+
+    def decode(self, content, audio_format, target=None, timeout=DECODER_TIMEOUT):
+        self.jobs += 1
+        # Send the handle as a plain tuple so the worker never unpickles app classes
+        target = tuple(target) if target is not None else None
+        status, payload = self._call(('decode', content, audio_format, target), timeout)
+        if status == 'error':
+            raise AudioDecodeError(payload)
+        return payload
+
+    def close(self):
+        try:
+            self.conn.close()
+        finally:
+            try:
+                self.process.wait(1)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+class DecoderPool:
+    """Fixed-size pool of decoder workers, checked out one decode at a time"""
+
+    def __init__(self, size, max_jobs=DECODER_MAX_JOBS, worker_factory=DecoderWorker):
+        self.size = size
+        self.max_jobs = max_jobs
+        self.worker_factory = worker_factory
+        # Idle workers, most recently used last
+        self._idle = []
+        self._cond = threading.Condition()
+        self._created = 0
+        self._busy = 0
+        self.recycled = 0
+        self.replaced = 0
+
+    def _checkout(self):
+        """An idle worker, a new one while under the size, or wait for either"""
+        with self._cond:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._created < self.size:
+                    self._created += 1
+                    break
+                self._cond.wait()
+        try:
+            return self.worker_factory()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _checkin(self, worker):
+        with self._cond:
+            self._idle.append(worker)
+            self._cond.notify()
+
+    def _discard(self, worker):
+        worker.close()
+        with self._cond:
+            self._created -= 1
+            # A waiter may now start a replacement
+            self._cond.notify()
+
+    def decode(self, content, audio_format=None, target=None):
+        """Decode bytes in a pooled worker, returns float32 PCM
+
+        With a target AudioHandle, PCM that fits is written into it and the
+        sample count is returned instead.
+        """
+        worker = self._checkout()
+        with self._cond:
+            self._busy += 1
+        healthy = True
+        try:
+            with metrics.timed('decoder_pool.decode_seconds'):
+                return worker.decode(content, audio_format, target)
+        except AudioDecodeError:
+            raise
+        except Exception as e:
+            # Timeout or broken pipe: the worker is in an unknown state
+            healthy = False
+            metrics.incr('decoder_pool.worker_failures')
+            raise AudioDecodeError(f"Decoder worker failed: {str(e)}") from e
+        finally:
+            with self._cond:
+                self._busy -= 1
+            if not healthy:
+                self.replaced += 1
+                self._discard(worker)
+            elif worker.jobs >= self.max_jobs:
+                self.recycled += 1
+                self._discard(worker)
+            elif self._created > self.size:
+                # Pool was shrunk
+                self._discard(worker)
+            else:
+                self._checkin(worker)
+
+    def _take_idle(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            return idle
+
+    def resize(self, size):
+        """Change the worker limit; surplus workers are closed as they become idle"""
+        with self._cond:
+            self.size = max(1, int(size))
+            surplus = []
+            while self._created - len(surplus) > self.size and self._idle:
+                surplus.append(self._idle.pop(0))
+            # Growing lets waiters start new workers
+            self._cond.notify_all()
+        for worker in surplus:
+            self._discard(worker)
+
+    def health_check(self):
+        """Ping idle workers and drop any that do not answer"""
+        for worker in self._take_idle():
+            if worker.ping():
+                self._checkin(worker)
+            else:
+                self.replaced += 1
+                metrics.incr('decoder_pool.worker_failures')
+                self._discard(worker)
+
+    def shutdown(self):
+        for worker in self._take_idle():
+            self._discard(worker)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self.size,
+                'workers': self._created,
+                'busy': self._busy,
+                'idle': len(self._idle),
+                'recycled': self.recycled,
+                'replaced': self.replaced
+            }
+
+def create_default_pool():
+    """Pool configured from the environment, or None to decode in-process"""
+    if DECODER_POOL_SIZE in ('', '0'):
+        return None
+    size = len(physical_cores()) if DECODER_POOL_SIZE == 'auto' else int(DECODER_POOL_SIZE)
+    return DecoderPool(max(1, size))
+
+decoder_pool = create_default_pool()
+audio_ring = create_default_ring(decoder_pool is not None or inference_pool is not None)
+
+def decode(content, audio_format=None):
+    """Decode attachment bytes, through the pool when one is configured
+
+    Ogg Opus stays on the in-process libopus path, which is cheaper than a
+    round trip to a worker.
+    """
+    if decoder_pool is None or (audio_format == 'opus' and opuslib is not None):
+        return decode_audio(content, audio_format)
+    return decoder_pool.decode(content, audio_format)
+
+def decode_shared(content, audio_format=None):
+    """Decode into a shared audio slot when the ring is enabled
+
+    Returns a SharedAudio the caller must release, or a plain array when the
+    ring is off, busy or the clip does not fit in a slot.
+    """
+    if audio_ring is None:
+        return decode(content, audio_format)
+    if decoder_pool is None or (audio_format == 'opus' and opuslib is not None):
+        pcm = decode_audio(content, audio_format)
+        if inference_pool is None:
+            return pcm
+        # One copy here saves pickling it to the inference worker
+        shared = audio_ring.put(pcm)
+        return pcm if shared is None else shared
+
+    shared = audio_ring.lease()
+    if shared is None:
+        return decoder_pool.decode(content, audio_format)
+    try:
+        result = decoder_pool.decode(content, audio_format, target=shared.handle)
+    except Exception:
+        shared.release()
+        raise
+    if isinstance(result, int):
+        shared.truncate(result)
+        return shared
+    shared.release()
+    return result
+
+def schedule_decoder_health_check(scheduler):
+    """Register the decoder pool health check on an APScheduler instance"""
+    if decoder_pool is None:
+        return
+    scheduler.add_job(
+        id='decoder_health_check',
+        func=decoder_pool.health_check,
+        trigger='interval',
+        seconds=int(os.getenv('DECODER_HEALTH_CHECK_INTERVAL', 30)),
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
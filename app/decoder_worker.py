@@ -0,0 +1,102 @@
+"""
+Decoder worker process started by app.decoder_pool.
+
+The pool runs this file as a script (python app/decoder_worker.py FD), not as
+a module of the app package: importing anything under app. would run
+app/__init__.py and load Flask, the routes, whisper and torch into every
+decoder. As a script it imports numpy, PyAV and the sibling audio module,
+which has no app imports, and nothing else.
+
+Requests arrive on a multiprocessing Connection over an inherited socket:
+
+    ('ping',)                                 -> ('pong', pid)
+    ('decode', content, format, target)       -> ('ok', pcm) | ('shared', samples) | ('error', text)
+
+target is None or the (path, offset, length) of a shared audio slot (see
+app.shared_audio) to write the float32 PCM into. Messages carry only builtin
+types and numpy arrays, so unpickling them never imports the app package.
+"""
+
+import io
+import mmap
+import os
+import sys
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+if __package__:
+    from app.audio import SAMPLE_RATE, decode_audio, opuslib
+else:
+    # Run as a script: app/ is sys.path[0], import the sibling module directly
+    from audio import SAMPLE_RATE, decode_audio, opuslib
+
+try:
+    import av
+except ImportError:
+    av = None
+
+ITEM_SIZE = np.dtype(np.float32).itemsize
+
+def decode_with_av(content):
+    """Decode any container with libav inside the current process"""
+    resampler = av.AudioResampler(format='s16', layout='mono', rate=SAMPLE_RATE)
+    chunks = []
+    with av.open(io.BytesIO(content), mode='r') as container:
+        stream = next(s for s in container.streams if s.type == 'audio')
+        for frame in container.decode(stream):
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray().reshape(-1))
+        # Flush samples buffered in the resampler
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray().reshape(-1))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks).astype(np.float32) / 32768.0
+
+# Shared audio slot files mapped by this worker, by path
+_slots = {}
+
+def write_shared(target, pcm):
+    """Copy PCM into a shared audio slot; False if it does not fit"""
+    path, offset, length = target
+    if len(pcm) > length:
+        return False
+    mapped = _slots.get(path)
+    if mapped is None:
+        fd = os.open(path, os.O_RDWR)
+        try:
+            mapped = _slots[path] = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+    np.frombuffer(mapped, dtype=np.float32, count=len(pcm), offset=offset * ITEM_SIZE)[:] = pcm
+    return True
+
+def serve(conn):
+    """Answer pings and decode requests until the connection closes"""
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'ping':
+            conn.send(('pong', os.getpid()))
+            continue
+        _, content, audio_format, target = message
+        try:
+            if av is not None and not (audio_format == 'opus' and opuslib is not None):
+                pcm = decode_with_av(content)
+            else:
+                pcm = decode_audio(content, audio_format)
+            if target is not None and write_shared(target, pcm):
+                conn.send(('shared', len(pcm)))
+            else:
+                conn.send(('ok', pcm))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {str(e)}"))
+
+def main():
+    serve(Connection(int(sys.argv[1])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+Typed GoHighLevel webhook events.
+
+Request bodies are parsed with orjson when it is installed (the standard json
+module otherwise) and validated once into small __slots__ objects. The
+string-or-dict attachment shapes GoHighLevel sends are normalized here into
+Attachment objects, so nothing downstream re-checks raw payload shapes.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+class EventValidationError(ValueError):
+    """Raised when a webhook payload does not match any known event shape"""
+
+def loads(body):
+    """Parse a JSON request body (bytes or str)"""
+    try:
+        if orjson is not None:
+            return orjson.loads(body)
+        return json.loads(body)
+    except ValueError as e:
+        raise EventValidationError(f"Invalid JSON: {str(e)}") from e
+
+def _optional_str(data, key):
+    value = data.get(key)
+    if value is None or isinstance(value, str):
+        return value or None
+    raise EventValidationError(f"{key} must be a string")
+
+def _required_str(data, key):
+    value = _optional_str(data, key)
+    if not value:
+        raise EventValidationError(f"No {key} provided")
+    return value
+
+def _optional_number(data, *keys):
+    for key in keys:
+        value = data.get(key)
+        if value is None:
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            raise EventValidationError(f"{key} must be a number") from None
+    return None
+
+class Attachment:
+    """One message attachment; GoHighLevel sends either a URL or an object"""
+
+    __slots__ = ('url', 'size', 'duration', 'content_type')
+
+    def __init__(self, url, size=None, duration=None, content_type=None):
+        self.url = url
+        self.size = size
+        self.duration = duration
+        self.content_type = content_type
+
+    @classmethod
+    def parse(cls, raw):
+        """Attachment from a raw payload item, or None if it carries no URL"""
+        if isinstance(raw, str):
+            return cls(raw) if raw else None
+        if not isinstance(raw, dict):
+            raise EventValidationError("Attachments must be URLs or objects")
+        url = raw.get('url')
+        if not url or not isinstance(url, str):
+            return None
+        return cls(
+            url,
+            size=_optional_number(raw, 'size', 'contentLength'),
+            duration=_optional_number(raw, 'duration'),
+            content_type=_optional_str(raw, 'contentType') or _optional_str(raw, 'mimeType')
+        )
+
+    def __repr__(self):
+        return f"Attachment({self.url!r}, size={self.size}, duration={self.duration})"
+
+class InstallEvent:
+    """App installed on a location"""
+
+    __slots__ = ('location_id', 'company_id')
+
+    type = 'INSTALL'
+
+    def __init__(self, location_id, company_id=None):
+        self.location_id = location_id
+        self.company_id = company_id
+
+    @classmethod
+    def parse(cls, data):
+        return cls(_required_str(data, 'locationId'), _optional_str(data, 'companyId'))
+
+class MessageEvent:
+    """Conversation message with optional attachments"""
+
+    __slots__ = (
+        'type', 'location_id', 'conversation_id', 'contact_id', 'message_id',
+        'message_type', 'direction', 'body', 'attachments'
+    )
+
+    default_direction = None
+
+    def __init__(self, type, location_id, conversation_id, contact_id, message_id,
+                 message_type, direction, body, attachments):
+        self.type = type
+        self.location_id = location_id
+        self.conversation_id = conversation_id
+        self.contact_id = contact_id
+        self.message_id = message_id
+        self.message_type = message_type
+        self.direction = direction
+        self.body = body
+        self.attachments = attachments
+
+    @classmethod
+    def parse(cls, data):
+        raw_attachments = data.get('attachments')
+        if raw_attachments is None:
+            raw_attachments = []
+        elif not isinstance(raw_attachments, list):
+            raise EventValidationError("attachments must be a list")
+        attachments = []
+        for raw in raw_attachments:
+            attachment = Attachment.parse(raw)
+            if attachment is None:
+                print(f"No URL found in attachment: {raw}")
+            else:
+                attachments.append(attachment)
+
+        return cls(
+            data.get('type'),
+            _optional_str(data, 'locationId'),
+            _required_str(data, 'conversationId'),
+            _optional_str(data, 'contactId'),
+            _optional_str(data, 'messageId'),
+            _required_str(data, 'messageType'),
+            _optional_str(data, 'direction') or cls.default_direction,
+            data.get('body'),
+            attachments
+        )
+
+class InboundMessageEvent(MessageEvent):
+    __slots__ = ()
+    default_direction = 'inbound'
+
+class OutboundMessageEvent(MessageEvent):
+    __slots__ = ()
+    default_direction = 'outbound'
+
+EVENT_TYPES = {
+    'INSTALL': InstallEvent,
+    'InboundMessage': InboundMessageEvent,
+    'OutboundMessage': OutboundMessageEvent
+}
+
+def parse_event(data):
+    """Validate one decoded payload into an event object
+
+    Unknown types are accepted as generic message events when they carry the
+    message fields, as the webhook always did.
+    """
+    if not isinstance(data, dict):
+        raise EventValidationError("Event must be a JSON object")
+    event_type = _optional_str(data, 'type')
+    if event_type == 'INSTALL' and not data.get('locationId'):
+        # An INSTALL without a location is treated like any other message
+        event_type = None
+    return EVENT_TYPES.get(event_type, MessageEvent).parse(data)
+
+def parse_events(items):
+    """Validate a list of payloads; returns events and EventValidationErrors in order"""
+    if not isinstance(items, list):
+        raise EventValidationError("Expected a JSON array of events")
+    parsed = []
+    for item in items:
+        try:
+            parsed.append(parse_event(item))
+        except EventValidationError as e:
+            parsed.append(e)
+    return parsed
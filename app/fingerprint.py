@@ -0,0 +1,235 @@
+"""
+Acoustic fingerprints for near-duplicate voice notes.
+
+Forwarded voice notes are often re-encoded by the channel, so their bytes
+(and audio_hash) differ while the speech is the same. The fingerprint is
+computed on decoded 16 kHz PCM, Haitsma-Kalker style: over 128 ms frames
+taken every 32 ms, the energies of 33 log-spaced bands between 300 and
+3000 Hz are reduced to 32 bits per hop, each the sign of the change of
+adjacent-band energy differences from one frame to the next. These bits
+survive re-encoding and gain changes. Frames are transformed in blocks of
+FINGERPRINT_BLOCK_FRAMES, so memory stays flat however long the clip is.
+
+Bits of silent frames are noise (or, for digital silence, all equal), so
+each sub-fingerprint also records whether its frames are above
+FINGERPRINT_SILENCE_DBFS. Two fingerprints are compared by bit agreement
+over the frames voiced in both, at the best alignment within a small time
+shift; an alignment only counts when those frames cover at least
+FINGERPRINT_MIN_VOICED_SECONDS and most of the frames voiced in either clip.
+Fingerprints are kept in audio_fingerprints and in a per-location in-memory
+index of recent entries, for at most FINGERPRINT_INDEX_LOCATIONS recently
+used locations; a match above FINGERPRINT_THRESHOLD reuses the
+stored transcript instead of running Whisper.
+"""
+
+import os
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+import numpy as np
+
+from app import metrics
+from app.audio import SAMPLE_RATE
+from app.database import AudioFingerprint, SessionLocal
+
+FINGERPRINT_ENABLED = os.getenv('FINGERPRINT_ENABLED', '1').lower() in ('1', 'true', 'yes')
+FINGERPRINT_THRESHOLD = float(os.getenv('FINGERPRINT_THRESHOLD', 0.8))
+FINGERPRINT_MIN_SECONDS = float(os.getenv('FINGERPRINT_MIN_SECONDS', 2))
+# Recent fingerprints kept in memory per location
+FINGERPRINT_INDEX_SIZE = int(os.getenv('FINGERPRINT_INDEX_SIZE', 2000))
+# Locations indexed in memory; the least recently used is dropped and reloaded on demand
+FINGERPRINT_INDEX_LOCATIONS = int(os.getenv('FINGERPRINT_INDEX_LOCATIONS', 200))
+# Relative duration difference tolerated between near-duplicates
+FINGERPRINT_DURATION_TOLERANCE = float(os.getenv('FINGERPRINT_DURATION_TOLERANCE', 0.05))
+# Frames quieter than this (RMS, dB below full scale) are not compared
+FINGERPRINT_SILENCE_DBFS = float(os.getenv('FINGERPRINT_SILENCE_DBFS', -50))
+# Sound two clips must share, and the share of either clip's sound it must
+# cover, before they can match
+FINGERPRINT_MIN_VOICED_SECONDS = float(os.getenv('FINGERPRINT_MIN_VOICED_SECONDS', 1))
+FINGERPRINT_MIN_VOICED_SHARE = float(os.getenv('FINGERPRINT_MIN_VOICED_SHARE', 0.8))
+FINGERPRINT_BLOCK_FRAMES = int(os.getenv('FINGERPRINT_BLOCK_FRAMES', 256))
+
+FRAME_SIZE = 2048
+HOP_SIZE = 512
+# Alignment search, in frames (±0.5 s): re-encoding can add or trim padding
+MAX_SHIFT = 16
+MIN_VOICED_FRAMES = max(1, int(FINGERPRINT_MIN_VOICED_SECONDS * SAMPLE_RATE / HOP_SIZE))
+_BAND_EDGES = np.geomspace(300, 3000, 34)
+_FREQS = np.fft.rfftfreq(FRAME_SIZE, 1 / SAMPLE_RATE)
+_BAND_BINS = np.searchsorted(_FREQS, _BAND_EDGES)
+_WINDOW = np.hanning(FRAME_SIZE).astype(np.float32)
+# Windowed mean square of a full-scale signal is scaled by this
+_WINDOW_POWER = float(np.mean(_WINDOW.astype(np.float64) ** 2))
+_SILENCE_POWER = 10 ** (FINGERPRINT_SILENCE_DBFS / 10)
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+class Fingerprint(namedtuple('Fingerprint', 'bits voiced')):
+    """uint32 sub-fingerprint per hop, and whether both of its frames carry sound"""
+    __slots__ = ()
+
+    def pack_voiced(self):
+        return np.packbits(self.voiced).tobytes()
+
+    @classmethod
+    def from_bytes(cls, bits, voiced=None):
+        """Stored form; rows from before voicing was recorded count as voiced throughout"""
+        bits = np.frombuffer(bits, dtype='<u4')
+        if voiced is None:
+            return cls(bits, np.ones(len(bits), dtype=bool))
+        return cls(bits, np.unpackbits(np.frombuffer(voiced, dtype=np.uint8), count=len(bits)).astype(bool))
+
+def _band_energies(audio, count):
+    """Band energies and mean power of count frames of audio, both float64"""
+    frames = np.lib.stride_tricks.sliding_window_view(audio, FRAME_SIZE)[::HOP_SIZE][:count] * _WINDOW
+    power = np.abs(np.fft.rfft(frames, axis=1)) ** 2
+    band_power = power[:, _BAND_BINS[0]:_BAND_BINS[-1]]
+    energies = np.add.reduceat(band_power, _BAND_BINS[:-1] - _BAND_BINS[0], axis=1)
+    frame_power = np.mean(frames.astype(np.float64) ** 2, axis=1) / _WINDOW_POWER
+    return energies, frame_power
+
+def compute_fingerprint(audio):
+    """Fingerprint of 16 kHz mono float32 PCM"""
+    if len(audio) < FRAME_SIZE + 2 * HOP_SIZE:
+        return Fingerprint(np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool))
+    count = (len(audio) - FRAME_SIZE) // HOP_SIZE + 1
+    energies = np.empty((count, len(_BAND_BINS) - 1))
+    frame_power = np.empty(count)
+    for start in range(0, count, FINGERPRINT_BLOCK_FRAMES):
+        block = min(FINGERPRINT_BLOCK_FRAMES, count - start)
+        offset = start * HOP_SIZE
+        energies[start:start + block], frame_power[start:start + block] = _band_energies(
+            audio[offset:offset + (block - 1) * HOP_SIZE + FRAME_SIZE], block
+        )
+
+    band_diff = energies[:, :-1] - energies[:, 1:]
+    bits = (band_diff[1:] - band_diff[:-1]) > 0
+    loud = frame_power >= _SILENCE_POWER
+    return Fingerprint(
+        np.packbits(bits, axis=1, bitorder='little').view('<u4').ravel(),
+        loud[1:] & loud[:-1]
+    )
+
+def similarity(a, b, max_shift=MAX_SHIFT):
+    """Best fraction of agreeing bits between two fingerprints over small shifts
+
+    Only sub-fingerprints voiced in both are compared; 0.0 when no alignment
+    shares enough sound (see the module docstring).
+    """
+    best = 0.0
+    min_overlap = max(1, min(len(a.bits), len(b.bits)) // 2)
+    for shift in range(-max_shift, max_shift + 1):
+        x, vx = (a.bits[shift:], a.voiced[shift:]) if shift > 0 else (a.bits, a.voiced)
+        y, vy = (b.bits[-shift:], b.voiced[-shift:]) if shift < 0 else (b.bits, b.voiced)
+        n = min(len(x), len(y))
+        if n < min_overlap:
+            continue
+        both = vx[:n] & vy[:n]
+        voiced = int(both.sum())
+        either = int((vx[:n] | vy[:n]).sum())
+        if voiced < MIN_VOICED_FRAMES or voiced < FINGERPRINT_MIN_VOICED_SHARE * either:
+            continue
+        errors = int(_POPCOUNT[(x[:n][both] ^ y[:n][both]).view(np.uint8)].sum(dtype=np.int64))
+        best = max(best, 1.0 - errors / (32.0 * voiced))
+    return best
+
+class FingerprintIndex:
+    """Per-location recent fingerprints, loaded lazily from the database"""
+
+    def __init__(self, size=FINGERPRINT_INDEX_SIZE, locations=FINGERPRINT_INDEX_LOCATIONS):
+        self.size = size
+        self.locations = locations
+        # Least recently used location first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _location_entries(self, location_id):
+        with self._lock:
+            entries = self._entries.get(location_id)
+            if entries is not None:
+                self._entries.move_to_end(location_id)
+                return entries
+
+        db = SessionLocal()
+        try:
+            rows = (
+                db.query(AudioFingerprint)
+                .filter(AudioFingerprint.location_id == location_id)
+                .order_by(AudioFingerprint.created_at.desc())
+                .limit(self.size)
+                .all()
+            )
+        finally:
+            db.close()
+        loaded = deque(
+            ((row.transcription_id, row.duration_seconds, Fingerprint.from_bytes(row.fingerprint, row.voiced))
+             for row in reversed(rows)),
+            maxlen=self.size
+        )
+        with self._lock:
+            entries = self._entries.setdefault(location_id, loaded)
+            self._entries.move_to_end(location_id)
+            while len(self._entries) > max(1, self.locations):
+                self._entries.popitem(last=False)
+            return entries
+
+    def lookup(self, location_id, fingerprint, duration):
+        """(transcription_id, similarity) of the best near-duplicate, or None"""
+        if duration < FINGERPRINT_MIN_SECONDS or not len(fingerprint.bits):
+            return None
+        metrics.incr('fingerprint.lookups')
+        entries = self._location_entries(location_id)
+        with self._lock:
+            candidates = [
+                (transcription_id, stored) for transcription_id, stored_duration, stored in entries
+                if abs(stored_duration - duration) <= FINGERPRINT_DURATION_TOLERANCE * duration
+            ]
+
+        best = None
+        with metrics.timed('fingerprint.lookup_seconds'):
+            for transcription_id, stored in reversed(candidates):
+                score = similarity(fingerprint, stored)
+                if score >= FINGERPRINT_THRESHOLD and (best is None or score > best[1]):
+                    best = (transcription_id, score)
+        if best:
+            metrics.incr('fingerprint.hits')
+        return best
+
+    def add(self, location_id, transcription_id, fingerprint, duration):
+        """Store a transcribed clip's fingerprint"""
+        if duration < FINGERPRINT_MIN_SECONDS or not len(fingerprint.bits):
+            return
+        # Loaded before the insert commits, so the new row is appended once, not loaded too
+        entries = self._location_entries(location_id)
+        db = SessionLocal()
+        try:
+            db.add(AudioFingerprint(
+                transcription_id=transcription_id,
+                location_id=location_id,
+                duration_seconds=duration,
+                fingerprint=fingerprint.bits.astype('<u4').tobytes(),
+                voiced=fingerprint.pack_voiced()
+            ))
+            db.commit()
+        except Exception as e:
+            print(f"Error saving fingerprint: {str(e)}")
+            db.rollback()
+            return
+        finally:
+            db.close()
+        with self._lock:
+            entries.append((transcription_id, duration, fingerprint))
+
+    def stats(self):
+        lookups = metrics.counter('fingerprint.lookups')
+        hits = metrics.counter('fingerprint.hits')
+        with self._lock:
+            indexed = sum(len(entries) for entries in self._entries.values())
+        return {
+            'lookups': lookups,
+            'hits': hits,
+            'hit_rate': hits / lookups if lookups else None,
+            'indexed': indexed,
+            'locations': len(self._entries)
+        }
+
+fingerprint_index = FingerprintIndex()
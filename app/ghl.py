@@ -0,0 +1,47 @@
+"""
+GoHighLevel API configuration and shared helpers.
+"""
+
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+# GoHighLevel API configuration
+API_BASE_URL = 'https://services.leadconnectorhq.com'
+API_VERSION = '2021-07-28'
+GHL_AUTH_URL = 'https://marketplace.gohighlevel.com/oauth/chooselocation'
+GHL_TOKEN_URL = 'https://services.leadconnectorhq.com/oauth/token'
+
+# Load environment variables
+load_dotenv()
+
+# Get environment variables
+GHL_CLIENT_ID = os.getenv('GHL_CLIENT_ID')
+GHL_CLIENT_SECRET = os.getenv('GHL_CLIENT_SECRET')
+GHL_REDIRECT_URI = os.getenv('GHL_REDIRECT_URI')
+
+# Pooled keep-alive connections shared by every GoHighLevel call in this process
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=int(os.getenv('GHL_POOL_SIZE', 16))))
+
+def auth_headers(access_token):
+    """Standard headers for authenticated GoHighLevel API calls"""
+    return {
+        "Authorization": f"Bearer {access_token}",
+        "Accept": "application/json",
+        "Version": API_VERSION
+    }
+
+def exchange_refresh_token(refresh_token):
+    """Exchange a refresh token for a new token pair using the refresh grant"""
+    token_data = {
+        "client_id": GHL_CLIENT_ID,
+        "client_secret": GHL_CLIENT_SECRET,
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        "user_type": "Location"
+    }
+    response = http_session.post(GHL_TOKEN_URL, data=token_data, timeout=30)
+    response.raise_for_status()
+    return response.json()
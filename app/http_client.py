@@ -0,0 +1,290 @@
+"""
+Attachment downloads with per-host circuit breakers and hedged requests.
+
+All downloads share one pooled httpx client with separate connect and read
+timeouts. Each host has a circuit breaker: after consecutive failures it opens
+and requests fail fast until a cool-down elapses, then a single probe decides
+whether to close it again. When a download is slower than the host's recent
+p95 latency a second, hedged request is started and whichever finishes first
+wins, so one slow CDN node does not set the pipeline's tail latency. Latency
+is tracked per MB (files under HEDGE_MIN_MB count as that size), so a large
+recording is compared with what its size should take and does not always
+trigger a hedge. The losing request is cancelled at its next chunk.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlparse
+
+import httpx
+
+from app import metrics
+from app.audio import SNIFF_BYTES, sniff_audio_format
+
+# Download configuration
+ATTACHMENT_CONNECT_TIMEOUT = float(os.getenv('ATTACHMENT_CONNECT_TIMEOUT', 3))
+ATTACHMENT_READ_TIMEOUT = float(os.getenv('ATTACHMENT_READ_TIMEOUT', 15))
+ATTACHMENT_TOTAL_TIMEOUT = float(os.getenv('ATTACHMENT_TOTAL_TIMEOUT', 60))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 5))
+BREAKER_RESET_SECONDS = float(os.getenv('BREAKER_RESET_SECONDS', 30))
+HEDGE_ENABLED = os.getenv('HEDGE_ENABLED', '1').lower() in ('1', 'true', 'yes')
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', 20))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 0.25))
+HEDGE_MAX_WORKERS = int(os.getenv('HEDGE_MAX_WORKERS', 16))
+HEDGE_MIN_MB = float(os.getenv('HEDGE_MIN_MB', 0.25))
+MAX_ATTACHMENT_BYTES = int(os.getenv('MAX_ATTACHMENT_BYTES', 100 * 1024 * 1024))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+class DownloadError(Exception):
+    """Raised when an attachment cannot be downloaded"""
+
+class RejectedAttachmentError(DownloadError):
+    """Raised for responses that are not acceptable audio; not a host failure"""
+
+class CircuitOpenError(DownloadError):
+    """Raised without touching the network while a host's breaker is open"""
+
+class DownloadCancelled(DownloadError):
+    """Raised in the losing request of a hedged pair"""
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a half-open probe"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a request may be sent now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+class AttachmentClient:
+    """Shared, breaker-guarded and hedged HTTP client for attachment hosts"""
+
+    def __init__(self):
+        self.client = httpx.Client(
+            timeout=httpx.Timeout(ATTACHMENT_READ_TIMEOUT, connect=ATTACHMENT_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            follow_redirects=True,
+            headers={'User-Agent': USER_AGENT}
+        )
+        self.total_timeout = ATTACHMENT_TOTAL_TIMEOUT
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix='hedge')
+
+    def set_timeouts(self, connect=None, read=None, total=None):
+        """Change download timeouts (seconds) for requests started from now on"""
+        current = self.client.timeout
+        self.client.timeout = httpx.Timeout(
+            read if read is not None else current.read,
+            connect=connect if connect is not None else current.connect
+        )
+        if total is not None:
+            self.total_timeout = float(total)
+
+    def timeouts(self):
+        return {
+            'connect': self.client.timeout.connect,
+            'read': self.client.timeout.read,
+            'total': self.total_timeout
+        }
+
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker()
+            return breaker
+
+    def _fetch_once(self, url, cancel=None, on_headers=None):
+        """Single streaming GET returning (content, audio_format)
+
+        The container is sniffed from the first bytes so non-audio bodies are
+        abandoned early, and the length is checked against Content-Length
+        while streaming instead of with a separate HEAD request. Setting the
+        cancel event abandons the download at the next chunk; on_headers is
+        called with the Content-Length (or None) once headers arrive.
+        """
+        deadline = time.monotonic() + self.total_timeout
+        with self.client.stream('GET', url) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('content-type', '').lower()
+            expected = response.headers.get('content-length')
+            expected = int(expected) if expected and expected.isdigit() else None
+            if expected is not None and expected > MAX_ATTACHMENT_BYTES:
+                raise RejectedAttachmentError(f"Attachment too large: {expected} bytes")
+            if on_headers is not None:
+                on_headers(expected)
+
+            buffer = bytearray()
+            audio_format = None
+            for chunk in response.iter_bytes(DOWNLOAD_CHUNK_SIZE):
+                if cancel is not None and cancel.is_set():
+                    raise DownloadCancelled(f"Download of {url} cancelled")
+                buffer += chunk
+                if len(buffer) > MAX_ATTACHMENT_BYTES:
+                    raise RejectedAttachmentError(f"Attachment larger than {MAX_ATTACHMENT_BYTES} bytes")
+                if expected is not None and len(buffer) > expected:
+                    raise DownloadError(f"Received more than Content-Length ({expected} bytes)")
+                if time.monotonic() > deadline:
+                    raise DownloadError(f"Download of {url} exceeded {self.total_timeout}s")
+                if audio_format is None and len(buffer) >= SNIFF_BYTES:
+                    audio_format = self._identify(buffer, content_type)
+
+        if audio_format is None:
+            audio_format = self._identify(buffer, content_type)
+        if expected is not None and len(buffer) != expected:
+            raise DownloadError(f"Truncated download: {len(buffer)} of {expected} bytes")
+        return bytes(buffer), audio_format
+
+    @staticmethod
+    def _identify(buffer, content_type):
+        """Sniffed format, falling back to the declared type; raises for non-audio"""
+        audio_format = sniff_audio_format(bytes(buffer[:SNIFF_BYTES]))
+        if audio_format:
+            return audio_format
+        if 'audio' in content_type or 'video' in content_type or 'octet-stream' in content_type:
+            return 'unknown'
+        raise RejectedAttachmentError(f"Not an audio attachment (content-type '{content_type}')")
+
+    def _hedge_delay(self, host, size=None):
+        """Host's recent p95 time for a download of size bytes, or None while there is too little data"""
+        if not HEDGE_ENABLED or metrics.counter(f'download.ok.{host}') < HEDGE_MIN_SAMPLES:
+            return None
+        p95 = metrics.percentile(f'download.seconds_per_mb.{host}', 0.95)
+        if p95 is None:
+            return None
+        return max(HEDGE_MIN_DELAY, p95 * max((size or 0) / 1e6, HEDGE_MIN_MB))
+
+    def _fetch_hedged(self, url, host):
+        """Fetch, hedging once the first request is slower than its size warrants"""
+        cancel = threading.Event()
+        wake = threading.Event()
+        size = {}
+
+        def on_headers(expected):
+            size['bytes'] = expected
+            wake.set()
+
+        start = time.monotonic()
+        first = self._hedge_executor.submit(self._fetch_once, url, cancel, on_headers)
+        first.add_done_callback(lambda future: wake.set())
+        # Until headers arrive the file is assumed to be small; the deadline
+        # moves out once Content-Length shows it is larger
+        while not first.done():
+            remaining = start + self._hedge_delay(host, size.get('bytes')) - time.monotonic()
+            if remaining <= 0:
+                break
+            wake.wait(remaining)
+            wake.clear()
+        if first.done():
+            return first.result()
+
+        metrics.incr(f'download.hedged.{host}')
+        second = self._hedge_executor.submit(self._fetch_once, url, cancel)
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        error = e
+                        continue
+                    if future is second:
+                        metrics.incr(f'download.hedge_won.{host}')
+                    return result
+            raise error
+        finally:
+            # Free the loser's thread and connection instead of letting it run to the total timeout
+            cancel.set()
+
+    def download(self, url):
+        """Download an attachment, returns (content, audio_format)
+
+        Raises CircuitOpenError immediately if the host's breaker is open and
+        DownloadError on any other failure.
+        """
+        host = urlparse(url).hostname or ''
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            metrics.incr(f'download.fast_fail.{host}')
+            raise CircuitOpenError(f"Circuit open for host {host}")
+
+        start = time.monotonic()
+        try:
+            if self._hedge_delay(host) is None:
+                result = self._fetch_once(url)
+            else:
+                result = self._fetch_hedged(url, host)
+        except RejectedAttachmentError:
+            breaker.record_success()
+            metrics.incr(f'download.rejected.{host}')
+            raise
+        except httpx.HTTPStatusError as e:
+            # 4xx is a problem with this URL, not with the host
+            if e.response.status_code < 500:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+            metrics.incr(f'download.error.{host}')
+            raise DownloadError(f"HTTP {e.response.status_code} downloading {url}") from e
+        except Exception as e:
+            breaker.record_failure()
+            metrics.incr(f'download.error.{host}')
+            raise DownloadError(f"Error downloading {url}: {str(e)}") from e
+
+        breaker.record_success()
+        elapsed = time.monotonic() - start
+        metrics.incr(f'download.ok.{host}')
+        metrics.observe(f'download.seconds.{host}', elapsed)
+        metrics.observe(f'download.seconds_per_mb.{host}', elapsed / max(len(result[0]) / 1e6, HEDGE_MIN_MB))
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {host: {'state': b.state, 'failures': b.failures} for host, b in self._breakers.items()}
+
+    def close(self):
+        self._hedge_executor.shutdown(wait=False)
+        self.client.close()
+
+attachment_client = AttachmentClient()
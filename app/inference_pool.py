@@ -0,0 +1,275 @@
+"""
+Pool of pinned, model-holding Whisper inference processes.
+
+Each worker process loads the model once, runs torch with a fixed number of
+intra-op threads and is pinned to its own set of physical cores, so that
+workers x threads never oversubscribes the host and the Python decoding loop
+of one transcription does not serialize the others on the GIL.
+
+INFERENCE_WORKERS=0 (default) keeps inference in-process; 'auto' sizes the
+pool from the physical core count; INFERENCE_THREADS overrides threads per
+worker. Workers run app/inference_worker.py as a script, so they never import
+the app package (Flask, the routes, the database engine, the decoder pool).
+A clip gets INFERENCE_TIMEOUT plus INFERENCE_TIMEOUT_RATIO seconds per second
+of audio; a worker that does not answer in time is killed and replaced on its
+cpu set, and the clip fails. A worker that dies mid-clip (e.g. killed for
+memory) is replaced the same way and the clip is retried up to
+INFERENCE_RETRIES times.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Connection
+
+from app import metrics
+from app.audio import SAMPLE_RATE
+from app.model_store import ModelStoreError
+from app.shared_audio import SharedAudio
+
+INFERENCE_WORKERS = os.getenv('INFERENCE_WORKERS', '0')
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', 0))
+INFERENCE_PIN_CPUS = os.getenv('INFERENCE_PIN_CPUS', '1').lower() in ('1', 'true', 'yes')
+INFERENCE_RETRIES = int(os.getenv('INFERENCE_RETRIES', 1))
+# Covers a first model load; long clips get more on top
+INFERENCE_TIMEOUT = float(os.getenv('INFERENCE_TIMEOUT', 300))
+INFERENCE_TIMEOUT_RATIO = float(os.getenv('INFERENCE_TIMEOUT_RATIO', 2))
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'inference_worker.py')
+
+class InferenceError(RuntimeError):
+    """A clip failed in an inference worker, or the worker hung or died"""
+
+def available_cpus():
+    """Logical CPUs this process may run on"""
+    try:
+        return sorted(os.sched_getaffinity(0))
+    except AttributeError:
+        return list(range(os.cpu_count() or 1))
+
+def physical_cores():
+    """One logical CPU per physical core (hyperthread siblings removed)"""
+    cpus = available_cpus()
+    seen = set()
+    primary = []
+    for cpu in cpus:
+        path = f'/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list'
+        try:
+            with open(path) as f:
+                siblings = f.read().strip()
+        except OSError:
+            siblings = str(cpu)
+        if siblings not in seen:
+            seen.add(siblings)
+            primary.append(cpu)
+    return primary
+
+def plan_pool(workers=None, threads=None, cores=None):
+    """Split physical cores into (workers, threads per worker, cpu sets)"""
+    cores = cores if cores is not None else physical_cores()
+    n = len(cores)
+    if not workers:
+        # Favour a few workers with several threads each: whisper's
+        # decoder loop is latency bound while the encoder scales with threads
+        workers = max(1, n // max(1, threads or 2))
+    workers = max(1, min(int(workers), n))
+    threads = max(1, int(threads) if threads else n // workers)
+    cpu_sets = [cores[i * threads:(i + 1) * threads] or cores[-threads:] for i in range(workers)]
+    return workers, threads, cpu_sets
+
+class InferenceWorker:
+    """Handle on one inference process and its connection"""
+
+    def __init__(self, threads, cpus, pin=True):
+        parent_sock, child_sock = socket.socketpair()
+        env = dict(os.environ, OMP_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, str(child_sock.fileno()), str(threads),
+                 ','.join(str(cpu) for cpu in cpus) if pin else ''],
+                pass_fds=(child_sock.fileno(),),
+                env=env
+            )
+        except Exception:
+            parent_sock.close()
+            raise
+        finally:
+            child_sock.close()
+        self.conn = Connection(parent_sock.detach())
+        self.cpus = cpus
+        self.jobs = 0
+
+    def _call(self, message, timeout):
+        self.conn.send(message)
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"Inference worker {self.process.pid} did not answer within {timeout:.0f}s")
+        return self.conn.recv()
+
+    def ping(self, timeout=5):
+        try:
+            return self.process.poll() is None and self._call(('ping',), timeout)[0] == 'pong'
+        except Exception:
+            return False
+
+    def transcribe(self, audio, model_name, options, timeout):
+        self.jobs += 1
+        # Send a shared handle as a plain tuple so the worker never unpickles app classes
+        payload = tuple(audio.handle) if isinstance(audio, SharedAudio) else audio
+        status, result = self._call(('transcribe', payload, model_name, options), timeout)
+        if status == 'model_error':
+            raise ModelStoreError(result)
+        if status == 'error':
+            raise InferenceError(result)
+        return result
+
+    def close(self):
+        try:
+            self.conn.close()
+        finally:
+            try:
+                self.process.wait(1)
+            except subprocess.TimeoutExpired:
+                # Busy or hung: it would only notice the closed connection after the clip
+                self.process.kill()
+                self.process.wait()
+
+class InferencePool:
+    """One pinned, model-holding worker per cpu set, checked out one clip at a time"""
+
+    def __init__(self, workers=None, threads=None, pin=INFERENCE_PIN_CPUS, timeout=INFERENCE_TIMEOUT,
+                 worker_factory=InferenceWorker):
+        self.workers, self.threads, self.cpu_sets = plan_pool(workers, threads)
+        self.pin = pin
+        self.timeout = timeout
+        self.worker_factory = worker_factory
+        # Idle workers, most recently used last, and cpu sets without a worker
+        self._idle = []
+        self._vacant = list(self.cpu_sets)
+        self._cond = threading.Condition()
+        self._busy = 0
+        self._closed = False
+        self._submitter = None
+        self.replaced = 0
+        self.timeouts = 0
+
+    def _checkout(self):
+        """An idle worker, a new one on a vacant cpu set, or wait for either"""
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise InferenceError("Inference pool is shut down")
+                if self._idle:
+                    worker = self._idle.pop()
+                    self._busy += 1
+                    return worker
+                if self._vacant:
+                    cpus = self._vacant.pop(0)
+                    self._busy += 1
+                    break
+                self._cond.wait()
+        try:
+            return self.worker_factory(self.threads, cpus, self.pin)
+        except Exception:
+            with self._cond:
+                self._busy -= 1
+                self._vacant.append(cpus)
+                self._cond.notify()
+            raise
+
+    def _checkin(self, worker):
+        with self._cond:
+            self._busy -= 1
+            if not self._closed:
+                self._idle.append(worker)
+                self._cond.notify()
+                return
+        self._close(worker)
+
+    def _discard(self, worker):
+        with self._cond:
+            self._busy -= 1
+        self._close(worker)
+
+    def _close(self, worker):
+        worker.close()
+        with self._cond:
+            self._vacant.append(worker.cpus)
+            # A waiter may now start a replacement
+            self._cond.notify()
+
+    def clip_timeout(self, audio):
+        """Seconds a worker gets for a clip before it is considered hung"""
+        return self.timeout + len(audio) / SAMPLE_RATE * INFERENCE_TIMEOUT_RATIO
+
+    def transcribe(self, audio, model_name, **options):
+        """Transcribe a float32 16 kHz array or SharedAudio in a worker process"""
+        timeout = self.clip_timeout(audio)
+        for attempt in range(INFERENCE_RETRIES + 1):
+            worker = self._checkout()
+            healthy = True
+            try:
+                return worker.transcribe(audio, model_name, options, timeout)
+            except (ModelStoreError, InferenceError):
+                raise
+            except TimeoutError as e:
+                healthy = False
+                self.timeouts += 1
+                metrics.incr('inference.worker_timeouts')
+                print(f"{str(e)}, restarting it")
+                raise InferenceError(str(e)) from e
+            except Exception as e:
+                # Died mid-clip or the pipe broke: the worker is in an unknown state
+                healthy = False
+                metrics.incr('inference.worker_failures')
+                print(f"Inference worker died, restarting it: {type(e).__name__}: {str(e)}")
+                if attempt == INFERENCE_RETRIES:
+                    raise InferenceError(f"Inference worker died: {str(e)}") from e
+            finally:
+                if healthy:
+                    self._checkin(worker)
+                else:
+                    self.replaced += 1
+                    self._discard(worker)
+
+    def submit(self, audio, model_name, **options):
+        """Transcribe in the background, returns a Future; keep shared audio leased until it is done"""
+        with self._cond:
+            if self._submitter is None:
+                self._submitter = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='inference')
+            submitter = self._submitter
+        return submitter.submit(self.transcribe, audio, model_name, **options)
+
+    def shutdown(self, wait=True):
+        """Close idle workers now and busy ones when their clip ends"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            submitter, self._submitter = self._submitter, None
+            self._cond.notify_all()
+        if submitter is not None:
+            submitter.shutdown(wait=wait, cancel_futures=not wait)
+        for worker in idle:
+            self._close(worker)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'threads_per_worker': self.threads,
+                'cpu_sets': self.cpu_sets,
+                'running': self.workers - len(self._vacant),
+                'busy': self._busy,
+                'replaced': self.replaced,
+                'timeouts': self.timeouts
+            }
+
+def create_default_pool():
+    """Pool configured from the environment, or None for in-process inference"""
+    if INFERENCE_WORKERS in ('', '0'):
+        return None
+    workers = None if INFERENCE_WORKERS == 'auto' else int(INFERENCE_WORKERS)
+    return InferencePool(workers, INFERENCE_THREADS or None)
+
+inference_pool = create_default_pool()
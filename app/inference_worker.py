@@ -0,0 +1,106 @@
+"""
+Inference worker process started by app.inference_pool.
+
+The pool runs this file as a script (python app/inference_worker.py FD
+THREADS CPUS), like app/decoder_worker.py: importing anything under app.
+would run app/__init__.py and load Flask, the routes, the database engine,
+the decoder pool and the audio ring into every inference worker. As a
+script it imports numpy, torch and whisper through the sibling model_store
+module, which has no app imports, and nothing else.
+
+Requests arrive on a multiprocessing Connection over an inherited socket:
+
+    ('ping',)                                 -> ('pong', pid)
+    ('transcribe', audio, model, options)     -> ('ok', result) | ('model_error', text) | ('error', text)
+
+audio is a float32 array or the (path, offset, length) of a shared audio slot
+(see app.shared_audio) to read in place. result holds only text, language
+and segment times, so unpickling it never needs whisper in the caller.
+"""
+
+import mmap
+import os
+import sys
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+if __package__:
+    from app.model_store import ModelStoreError, get_model
+else:
+    # Run as a script: app/ is sys.path[0], import the sibling module directly
+    from model_store import ModelStoreError, get_model
+
+ITEM_SIZE = np.dtype(np.float32).itemsize
+
+# Shared audio slot files mapped by this worker, by path
+_slots = {}
+
+def read_shared(handle):
+    """Float32 view of a shared audio slot window, without copying"""
+    path, offset, length = handle
+    mapped = _slots.get(path)
+    if mapped is None:
+        fd = os.open(path, os.O_RDWR)
+        try:
+            mapped = _slots[path] = mmap.mmap(fd, 0)
+        finally:
+            os.close(fd)
+    return np.frombuffer(mapped, dtype=np.float32, count=length, offset=offset * ITEM_SIZE)
+
+def configure(threads, cpus):
+    """Pin to a cpu set and size torch threads"""
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except (AttributeError, OSError) as e:
+            print(f"Could not pin inference worker to {cpus}: {str(e)}")
+
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    print(f"Inference worker {os.getpid()} ready: {threads} thread(s), cpus {cpus or 'unpinned'}")
+
+def transcribe(audio, model_name, options):
+    """Transcribe with this worker's LRU-cached model"""
+    if isinstance(audio, tuple):
+        audio = read_shared(audio)
+    result = get_model(model_name).transcribe(audio, **options)
+    return {
+        'text': result['text'],
+        'language': result.get('language'),
+        'segments': [
+            {'start': float(segment['start']), 'end': float(segment['end']), 'text': segment['text']}
+            for segment in result.get('segments', [])
+        ]
+    }
+
+def serve(conn):
+    """Answer pings and transcription requests until the connection closes"""
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        if message[0] == 'ping':
+            conn.send(('pong', os.getpid()))
+            continue
+        _, audio, model_name, options = message
+        try:
+            conn.send(('ok', transcribe(audio, model_name, options)))
+        except ModelStoreError as e:
+            conn.send(('model_error', str(e)))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {str(e)}"))
+
+def main():
+    threads = int(sys.argv[2])
+    cpus = [int(cpu) for cpu in sys.argv[3].split(',') if cpu]
+    configure(threads, cpus)
+    serve(Connection(int(sys.argv[1])))
+
+if __name__ == '__main__':
+    main()
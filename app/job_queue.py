@@ -0,0 +1,432 @@
+"""
+Durable Postgres job queue for split web/worker deployments.
+
+PROCESS_ROLE selects how a process handles transcription jobs:
+
+    all     webhooks record jobs as running on this process and run them on
+            the in-process scheduler (run.py, default); a job whose process
+            dies before finishing it is claimed again like any other
+    web     webhooks are validated, deduplicated and inserted into
+            transcription_jobs in one statement; nothing is transcribed
+    worker  jobs are claimed with FOR UPDATE SKIP LOCKED and run on the local
+            scheduler; an INSERT trigger NOTIFYs idle workers so they wake up
+            without polling
+
+Web and worker nodes share nothing but the database, so either role can be
+scaled out on its own. While a job is queued locally or running, its process
+renews the row's heartbeat every JOB_HEARTBEAT_SECONDS; a job whose worker
+disappears is claimed again once its heartbeat is JOB_LEASE_SECONDS old, up
+to JOB_MAX_ATTEMPTS times, however long the job itself takes.
+"""
+
+import hashlib
+import os
+import select
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from sqlalchemy import func, select as sql_select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from app import metrics
+from app.database import QueuedJob, SessionLocal, engine, get_utc_now
+from app.job_scheduler import TranscriptionJob
+
+PROCESS_ROLE = os.getenv('PROCESS_ROLE', 'all')
+NOTIFY_CHANNEL = 'transcription_jobs'
+QUEUE_POLL_SECONDS = float(os.getenv('QUEUE_POLL_SECONDS', 5))
+QUEUE_PREFETCH = int(os.getenv('QUEUE_PREFETCH', 2))
+# A running job whose heartbeat is older than the lease is claimed again
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 300))
+JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', 60))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETENTION_HOURS = int(os.getenv('JOB_RETENTION_HOURS', 48))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+def dedup_key(job):
+    """Stable key of one attachment of one message"""
+    raw = f"{job.location_id}|{job.message_id or job.conversation_id}|{job.url}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def enqueue_jobs(jobs, claim=False):
+    """Insert new jobs durably, skipping known ones; returns the inserted jobs
+
+    Deduplication and enqueueing are one INSERT ... ON CONFLICT DO NOTHING
+    RETURNING, and the table's trigger notifies workers in the same commit.
+    With claim, rows are inserted already running on this worker, which must
+    then run and complete them. Errors propagate so the webhook fails and
+    GoHighLevel redelivers.
+    """
+    keyed = {}
+    for job in jobs:
+        keyed.setdefault(dedup_key(job), job)
+    if not keyed:
+        return []
+
+    rows = [
+        {
+            'dedup_key': key,
+            'location_id': job.location_id,
+            'conversation_id': job.conversation_id,
+            'contact_id': job.contact_id,
+            'message_id': job.message_id,
+            'message_type': job.message_type,
+            'url': job.url,
+            'estimated_seconds': job.estimated_seconds,
+            'deliver': job.deliver
+        }
+        for key, job in keyed.items()
+    ]
+    if claim:
+        now = get_utc_now()
+        for row in rows:
+            row.update(status='running', worker_id=WORKER_ID, started_at=now, heartbeat_at=now, attempts=1)
+    stmt = (
+        insert(QueuedJob)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=['dedup_key'])
+        .returning(QueuedJob.id, QueuedJob.dedup_key)
+    )
+    db = SessionLocal()
+    try:
+        inserted = []
+        for queue_id, key in db.execute(stmt):
+            job = keyed[key]
+            job.queue_id = queue_id
+            inserted.append(job)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    metrics.incr('queue.enqueued', len(inserted))
+    return inserted
+
+def lease_expired(now):
+    """Running jobs whose worker stopped renewing them"""
+    # Rows from before heartbeats fall back to their start time
+    last_seen = func.coalesce(QueuedJob.heartbeat_at, QueuedJob.started_at)
+    return (QueuedJob.status == 'running') & (last_seen < now - timedelta(seconds=JOB_LEASE_SECONDS))
+
+def claim_jobs(limit, worker_id=WORKER_ID):
+    """Atomically take up to limit queued (or lease-expired) jobs for this worker"""
+    now = get_utc_now()
+    candidates = (
+        sql_select(QueuedJob.id)
+        .where(
+            (QueuedJob.status == 'queued') | lease_expired(now),
+            QueuedJob.attempts < JOB_MAX_ATTEMPTS
+        )
+        .order_by(QueuedJob.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(QueuedJob)
+        .where(QueuedJob.id.in_(candidates.scalar_subquery()))
+        .values(status='running', worker_id=worker_id, started_at=now, heartbeat_at=now,
+                attempts=QueuedJob.attempts + 1)
+        .returning(QueuedJob)
+    )
+    db = SessionLocal()
+    try:
+        rows = db.execute(stmt).scalars().all()
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    jobs = []
+    for row in sorted(rows, key=lambda r: r.id):
+        job = TranscriptionJob(
+            row.url,
+            location_id=row.location_id,
+            conversation_id=row.conversation_id,
+            contact_id=row.contact_id,
+            message_id=row.message_id,
+            message_type=row.message_type,
+            estimated_seconds=row.estimated_seconds,
+            deliver=row.deliver
+        )
+        job.queue_id = row.id
+        jobs.append(job)
+    metrics.incr('queue.claimed', len(jobs))
+    return jobs
+
+def renew_leases(jobs, worker_id=WORKER_ID):
+    """Heartbeat this worker's unfinished jobs in one statement
+
+    Returns the queue ids still held, or None if the database could not be
+    reached (the next beat retries, well within the lease).
+    """
+    ids = [job.queue_id for job in jobs if job.queue_id]
+    if not ids:
+        return set()
+    db = SessionLocal()
+    try:
+        renewed = set(db.execute(
+            update(QueuedJob)
+            .where(QueuedJob.id.in_(ids), QueuedJob.status == 'running', QueuedJob.worker_id == worker_id)
+            .values(heartbeat_at=get_utc_now())
+            .returning(QueuedJob.id)
+        ).scalars())
+        db.commit()
+    except Exception as e:
+        print(f"Error renewing {len(ids)} job lease(s): {str(e)}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+    return renewed
+
+def complete_jobs(jobs):
+    """Record finished jobs in one transaction"""
+    now = get_utc_now()
+    done = [job.queue_id for job in jobs if not job.error]
+    db = SessionLocal()
+    try:
+        if done:
+            db.execute(
+                update(QueuedJob)
+                .where(QueuedJob.id.in_(done))
+                .values(status='done', finished_at=now, error=None)
+            )
+        for job in jobs:
+            if job.error:
+                db.execute(
+                    update(QueuedJob)
+                    .where(QueuedJob.id == job.queue_id)
+                    .values(status='failed', finished_at=now, error=job.error[:2000])
+                )
+        db.commit()
+    except Exception as e:
+        print(f"Error recording {len(jobs)} finished job(s): {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def checkpoint_jobs(jobs):
+    """Hand unfinished jobs back to the durable queue for the next worker
+
+    Jobs claimed from the queue are released (their interrupted attempt does
+    not count); jobs that only lived in this process are inserted.
+    """
+    claimed = [job.queue_id for job in jobs if job.queue_id]
+    local = [job for job in jobs if not job.queue_id]
+    released = 0
+    if claimed:
+        db = SessionLocal()
+        try:
+            released = db.execute(
+                update(QueuedJob)
+                .where(
+                    QueuedJob.id.in_(claimed),
+                    QueuedJob.status == 'running',
+                    QueuedJob.worker_id == WORKER_ID
+                )
+                .values(
+                    status='queued',
+                    worker_id=None,
+                    started_at=None,
+                    heartbeat_at=None,
+                    attempts=func.greatest(QueuedJob.attempts - 1, 0)
+                )
+            ).rowcount
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    inserted = enqueue_jobs(local) if local else []
+    metrics.incr('queue.checkpointed', released + len(inserted))
+    return released + len(inserted)
+
+def queue_depth():
+    """Jobs waiting in the durable queue"""
+    db = SessionLocal()
+    try:
+        return db.query(QueuedJob).filter(QueuedJob.status == 'queued').count()
+    finally:
+        db.close()
+
+class QueueWorker:
+    """Feeds a local JobScheduler from the durable queue"""
+
+    def __init__(self, scheduler, prefetch=QUEUE_PREFETCH):
+        self.scheduler = scheduler
+        self.prefetch = prefetch
+        self.outstanding = []
+        self._outstanding_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._conn = None
+        self._thread = None
+        self._last_heartbeat = time.monotonic()
+
+    @property
+    def capacity(self):
+        # Keep a few jobs per worker thread locally so fair queuing has a choice;
+        # follows the scheduler's worker count when it is changed at runtime
+        return max(1, self.scheduler.workers * self.prefetch)
+
+    def _listen(self):
+        """Raw autocommit connection LISTENing for new-job notifications"""
+        conn = engine.raw_connection()
+        # Never hand a LISTENing connection back to the pool
+        conn.detach()
+        conn.driver_connection.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f'LISTEN {NOTIFY_CHANNEL}')
+        return conn
+
+    def _wait(self, timeout):
+        """Sleep until a notification arrives or the timeout elapses"""
+        driver = self._conn.driver_connection
+        if select.select([driver], [], [], timeout)[0]:
+            driver.poll()
+            driver.notifies.clear()
+
+    def adopt(self, jobs):
+        """Track jobs claimed elsewhere (enqueue_jobs(claim=True)) so they are completed"""
+        with self._outstanding_lock:
+            self.outstanding.extend(jobs)
+
+    def _reap(self):
+        finished, pending = [], []
+        with self._outstanding_lock:
+            for job in self.outstanding:
+                (finished if job.done.is_set() else pending).append(job)
+            self.outstanding = pending
+        # Cancelled jobs are checkpointed by the drain, not completed
+        finished = [job for job in finished if not job.cancelled]
+        if finished:
+            complete_jobs(finished)
+
+    def _heartbeat(self):
+        """Renew the leases of outstanding jobs once every JOB_HEARTBEAT_SECONDS"""
+        now = time.monotonic()
+        if now - self._last_heartbeat < JOB_HEARTBEAT_SECONDS:
+            return
+        self._last_heartbeat = now
+        with self._outstanding_lock:
+            pending = [job for job in self.outstanding if job.queue_id and not job.done.is_set()]
+        held = renew_leases(pending)
+        if held is None:
+            return
+        # Claimed again elsewhere after a stale heartbeat: stop unless already delivering
+        lost = [job for job in pending if job.queue_id not in held and job.cancel()]
+        if lost:
+            metrics.incr('queue.leases_lost', len(lost))
+            print(f"Lost the lease of {len(lost)} job(s), cancelling them here")
+
+    def run_once(self):
+        """Record finished jobs, renew running ones and claim new ones up to local capacity"""
+        self._reap()
+        self._heartbeat()
+        free = self.capacity - len(self.outstanding)
+        if free <= 0:
+            return 0
+        jobs = claim_jobs(free)
+        self.adopt(jobs)
+        for job in jobs:
+            self.scheduler.submit(job)
+        return len(jobs)
+
+    def run(self):
+        """Claim and run jobs until stop() is called"""
+        print(f"Queue worker {WORKER_ID} started, capacity {self.capacity}")
+        while not self._stop.is_set():
+            try:
+                if self._conn is None:
+                    self._conn = self._listen()
+                claimed = self.run_once()
+                # Poll quickly while local jobs are finishing, otherwise wait for NOTIFY
+                if claimed:
+                    continue
+                self._wait(1.0 if self.outstanding else QUEUE_POLL_SECONDS)
+            except Exception as e:
+                print(f"Queue worker error: {str(e)}")
+                self._close()
+                self._stop.wait(QUEUE_POLL_SECONDS)
+        self._close()
+
+    def _close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+            self._conn = None
+
+    def start(self):
+        """Run in a background thread (for processes that also serve requests)"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='queue-worker', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop claiming jobs; waits for the background thread if there is one"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def finish(self):
+        """Record jobs that finished since the last claim"""
+        self._reap()
+
+    def stats(self):
+        return {
+            'worker_id': WORKER_ID,
+            'capacity': self.capacity,
+            'prefetch': self.prefetch,
+            'outstanding': len(self.outstanding)
+        }
+
+def sweep_job_queue():
+    """Scheduled job: fail exhausted jobs and drop old finished ones"""
+    now = get_utc_now()
+    db = SessionLocal()
+    try:
+        exhausted = (
+            db.query(QueuedJob)
+            .filter(
+                lease_expired(now),
+                QueuedJob.attempts >= JOB_MAX_ATTEMPTS
+            )
+            .update({'status': 'failed', 'finished_at': now, 'error': 'Lease expired'}, synchronize_session=False)
+        )
+        deleted = (
+            db.query(QueuedJob)
+            .filter(
+                QueuedJob.status.in_(('done', 'failed')),
+                QueuedJob.finished_at < now - timedelta(hours=JOB_RETENTION_HOURS)
+            )
+            .delete(synchronize_session=False)
+        )
+        db.commit()
+    except Exception as e:
+        print(f"Error sweeping job queue: {str(e)}")
+        db.rollback()
+        return
+    finally:
+        db.close()
+    if exhausted or deleted:
+        print(f"Job queue sweep: {exhausted} exhausted, {deleted} old job(s) deleted")
+
+def schedule_job_queue_sweep(scheduler):
+    """Register the job queue sweep on an APScheduler instance"""
+    scheduler.add_job(
+        id='sweep_job_queue',
+        func=sweep_job_queue,
+        trigger='interval',
+        minutes=int(os.getenv('JOB_QUEUE_SWEEP_INTERVAL_MINUTES', 10)),
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
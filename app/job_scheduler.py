@@ -0,0 +1,364 @@
+"""
+Transcription job scheduling with per-location fair sharing.
+
+Jobs are split into two priority lanes by their estimated audio length. Short
+voice notes are always dispatched before long recordings, long recordings are
+capped to a share of the workers so they can never occupy all of them, and a
+long job that has waited too long is promoted. Inside each lane, locations
+share workers by weighted fair queuing (start-time fair queuing on estimated
+seconds of audio) and no location may exceed its in-flight quota, so one
+location bulk-importing recordings cannot starve the others.
+"""
+
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from app import metrics
+
+# Scheduler configuration
+TRANSCRIPTION_WORKERS = int(os.getenv('TRANSCRIPTION_WORKERS', 2))
+LOCATION_MAX_CONCURRENCY = int(os.getenv('LOCATION_MAX_CONCURRENCY', 1))
+SHORT_CLIP_SECONDS = float(os.getenv('SHORT_CLIP_SECONDS', 60))
+LONG_LANE_MAX_SHARE = float(os.getenv('LONG_LANE_MAX_SHARE', 0.5))
+LONG_LANE_MAX_WAIT = float(os.getenv('LONG_LANE_MAX_WAIT', 300))
+# Conservative bitrate used to turn a byte size into seconds of audio
+ESTIMATE_BYTES_PER_SECOND = int(os.getenv('ESTIMATE_BYTES_PER_SECOND', 4000))
+DEFAULT_ESTIMATED_SECONDS = float(os.getenv('DEFAULT_ESTIMATED_SECONDS', 30))
+# Per-location fair-share weights and concurrency quotas, as JSON objects
+LOCATION_WEIGHTS = json.loads(os.getenv('LOCATION_WEIGHTS', '{}'))
+LOCATION_QUOTAS = json.loads(os.getenv('LOCATION_QUOTAS', '{}'))
+
+SHORT_LANE = 'short'
+LONG_LANE = 'long'
+
+_job_ids = itertools.count(1)
+
+class JobCancelled(Exception):
+    """Raised inside a job cancelled by a drain before it produced any output"""
+
+def estimate_seconds(duration=None, size_bytes=None):
+    """Estimate clip length from a known duration or byte size"""
+    if duration:
+        return float(duration)
+    if size_bytes:
+        return max(1.0, int(size_bytes) / ESTIMATE_BYTES_PER_SECOND)
+    return DEFAULT_ESTIMATED_SECONDS
+
+class TranscriptionJob:
+    """One attachment to download, transcribe and deliver"""
+
+    def __init__(self, url, location_id=None, conversation_id=None, contact_id=None,
+                 message_id=None, message_type=None, estimated_seconds=None, deliver=True):
+        self.id = next(_job_ids)
+        self.url = url
+        self.location_id = location_id
+        self.conversation_id = conversation_id
+        self.contact_id = contact_id
+        self.message_id = message_id
+        self.message_type = message_type
+        # Whether to post the result back to the conversation and contact
+        self.deliver = deliver
+        self.estimated_seconds = estimated_seconds or DEFAULT_ESTIMATED_SECONDS
+        self.lane = SHORT_LANE if self.estimated_seconds <= SHORT_CLIP_SECONDS else LONG_LANE
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        # Pipeline progress, for introspection
+        self.stage = 'queued'
+        self.model = None
+        self.start_tag = 0.0
+        self.finish_tag = 0.0
+        self.done = threading.Event()
+        # Failure reason once done, and the durable queue row when claimed from Postgres
+        self.error = None
+        self.queue_id = None
+        # A job is cancelled (and may be retried elsewhere) or committed to
+        # producing output (transcript rows, posts), never both
+        self.cancelled = False
+        self.committed = False
+        self._commit_lock = threading.Lock()
+
+    def cancel(self):
+        """Cancel unless output was already produced; True if cancelled"""
+        with self._commit_lock:
+            if not self.committed:
+                self.cancelled = True
+            return self.cancelled
+
+    def commit(self):
+        """Mark the job as producing output; raises JobCancelled if it was cancelled"""
+        with self._commit_lock:
+            if self.cancelled:
+                raise JobCancelled(f"{self} was cancelled")
+            self.committed = True
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(f"{self} was cancelled")
+
+    def __repr__(self):
+        return f"<TranscriptionJob {self.id} {self.location_id} {self.lane} ~{self.estimated_seconds:.0f}s>"
+
+class FairQueue:
+    """Start-time fair queuing across locations"""
+
+    def __init__(self):
+        self.queues = {}
+        self.last_finish = {}
+        self.virtual_time = 0.0
+        self.size = 0
+
+    def push(self, job, weight):
+        start = max(self.virtual_time, self.last_finish.get(job.location_id, 0.0))
+        job.start_tag = start
+        job.finish_tag = start + job.estimated_seconds / weight
+        self.last_finish[job.location_id] = job.finish_tag
+        self.queues.setdefault(job.location_id, deque()).append(job)
+        self.size += 1
+
+    def peek(self, eligible):
+        """Job with the smallest finish tag among eligible locations"""
+        best = None
+        for location_id, queue in self.queues.items():
+            if queue and eligible(location_id) and (best is None or queue[0].finish_tag < best.finish_tag):
+                best = queue[0]
+        return best
+
+    def remove(self, job):
+        queue = self.queues[job.location_id]
+        queue.popleft()
+        self.virtual_time = max(self.virtual_time, job.start_tag)
+        if not queue:
+            del self.queues[job.location_id]
+            # Idle locations restart from the current virtual time
+            if self.last_finish.get(job.location_id, 0.0) <= self.virtual_time:
+                self.last_finish.pop(job.location_id, None)
+        self.size -= 1
+
+    def take_all(self):
+        """Remove and return every queued job"""
+        jobs = [job for queue in self.queues.values() for job in queue]
+        self.queues.clear()
+        self.last_finish.clear()
+        self.size = 0
+        return jobs
+
+    def oldest_wait(self, now):
+        waits = [now - queue[0].enqueued_at for queue in self.queues.values() if queue]
+        return max(waits) if waits else 0.0
+
+class JobScheduler:
+    """Worker threads pulling jobs by lane priority and fair share"""
+
+    def __init__(self, handler, workers=TRANSCRIPTION_WORKERS, location_concurrency=LOCATION_MAX_CONCURRENCY):
+        self.handler = handler
+        self.workers = workers
+        self.location_concurrency = location_concurrency
+        self.weights = {location_id: max(0.01, float(w)) for location_id, w in LOCATION_WEIGHTS.items()}
+        self.quotas = {location_id: max(1, int(q)) for location_id, q in LOCATION_QUOTAS.items()}
+        self.lanes = {SHORT_LANE: FairQueue(), LONG_LANE: FairQueue()}
+        self.in_flight = {}
+        self.in_flight_by_lane = {SHORT_LANE: 0, LONG_LANE: 0}
+        self.running = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._thread_ids = itertools.count()
+        self._stopping = False
+
+    def set_weight(self, location_id, weight):
+        with self._cond:
+            self.weights[location_id] = max(0.01, float(weight))
+
+    def set_quota(self, location_id, max_concurrency):
+        with self._cond:
+            self.quotas[location_id] = max(1, int(max_concurrency))
+            self._cond.notify_all()
+
+    def set_location_concurrency(self, max_concurrency):
+        """Default in-flight quota for locations without their own"""
+        with self._cond:
+            self.location_concurrency = max(1, int(max_concurrency))
+            self._cond.notify_all()
+
+    def set_workers(self, workers):
+        """Resize the worker threads; surplus threads exit after their current job"""
+        with self._cond:
+            self.workers = max(1, int(workers))
+            if self._threads and not self._stopping:
+                while len(self._threads) < self.workers:
+                    self._spawn()
+            self._cond.notify_all()
+
+    def _spawn(self):
+        thread = threading.Thread(
+            target=self._worker, name=f'transcription-worker-{next(self._thread_ids)}', daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for _ in range(self.workers):
+                self._spawn()
+        print(f"Transcription scheduler started with {self.workers} worker(s)")
+
+    def submit(self, job):
+        """Queue a job, starting the workers on first use"""
+        if not self._threads and not self._stopping:
+            self.start()
+        with self._cond:
+            self.lanes[job.lane].push(job, self.weights.get(job.location_id, 1.0))
+            self._cond.notify()
+        metrics.incr(f'jobs.submitted.{job.lane}')
+        return job
+
+    def depth(self):
+        with self._cond:
+            return sum(lane.size for lane in self.lanes.values())
+
+    def _eligible(self, location_id):
+        quota = self.quotas.get(location_id, self.location_concurrency)
+        return self.in_flight.get(location_id, 0) < quota
+
+    def _pick(self):
+        now = time.monotonic()
+        long_limit = max(1, int(self.workers * LONG_LANE_MAX_SHARE))
+        long_allowed = self.in_flight_by_lane[LONG_LANE] < long_limit
+        long_job = self.lanes[LONG_LANE].peek(self._eligible) if long_allowed else None
+
+        # Promote long recordings that have waited too long
+        if long_job is not None and now - long_job.enqueued_at > LONG_LANE_MAX_WAIT:
+            return long_job
+        short_job = self.lanes[SHORT_LANE].peek(self._eligible)
+        return short_job or long_job
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                current = threading.current_thread()
+                if len(self._threads) > self.workers and current in self._threads:
+                    self._threads.remove(current)
+                    return None
+                job = self._pick()
+                if job is not None:
+                    self.lanes[job.lane].remove(job)
+                    self.in_flight[job.location_id] = self.in_flight.get(job.location_id, 0) + 1
+                    self.in_flight_by_lane[job.lane] += 1
+                    job.started_at = time.monotonic()
+                    self.running[job.id] = job
+                    return job
+                self._cond.wait()
+
+    def _release(self, job):
+        with self._cond:
+            remaining = self.in_flight.get(job.location_id, 1) - 1
+            if remaining:
+                self.in_flight[job.location_id] = remaining
+            else:
+                self.in_flight.pop(job.location_id, None)
+            self.in_flight_by_lane[job.lane] -= 1
+            self.running.pop(job.id, None)
+            self._cond.notify_all()
+        job.done.set()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            metrics.observe(f'jobs.wait_seconds.{job.lane}', job.started_at - job.enqueued_at)
+            try:
+                self.handler(job)
+                metrics.incr(f'jobs.completed.{job.lane}')
+            except JobCancelled:
+                metrics.incr(f'jobs.cancelled.{job.lane}')
+                print(f"Stopped cancelled {job}")
+            except Exception as e:
+                metrics.incr(f'jobs.failed.{job.lane}')
+                job.error = str(e)
+                print(f"Error processing {job}: {str(e)}")
+                import traceback
+                print(f"Traceback: {traceback.format_exc()}")
+            finally:
+                metrics.observe(f'jobs.latency_seconds.{job.lane}', time.monotonic() - job.enqueued_at)
+                self._release(job)
+
+    def stop(self, timeout=None):
+        """Stop workers after their current job"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(timeout)
+
+    def drain(self, timeout=None):
+        """Start no new jobs and wait up to timeout for running ones
+
+        Returns the jobs left undone: those still queued, and those still
+        running at the deadline that could be cancelled because they had not
+        produced any output yet. A cancelled job's thread may still be busy,
+        but it will not save or post anything, so the job can safely run
+        again elsewhere. Jobs already saving or posting are left to finish.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads, self._threads = self._threads, []
+        for thread in threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        with self._cond:
+            running = list(self.running.values())
+            undone = []
+            for lane in self.lanes.values():
+                undone.extend(lane.take_all())
+        cancelled = [job for job in running if job.cancel()]
+        if len(cancelled) < len(running):
+            print(f"{len(running) - len(cancelled)} job(s) still delivering at the drain deadline")
+        undone.extend(cancelled)
+        metrics.incr('jobs.undone_at_drain', len(undone))
+        return undone
+
+    def stats(self):
+        now = time.monotonic()
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'queued': {name: lane.size for name, lane in self.lanes.items()},
+                'oldest_wait_seconds': {name: lane.oldest_wait(now) for name, lane in self.lanes.items()},
+                'in_flight': dict(self.in_flight),
+                'in_flight_by_lane': dict(self.in_flight_by_lane),
+                'location_concurrency': self.location_concurrency,
+                'quotas': dict(self.quotas),
+                'weights': dict(self.weights)
+            }
+
+    def running_jobs(self):
+        """Jobs being processed now, with their stage and elapsed time"""
+        now = time.monotonic()
+        with self._cond:
+            running = list(self.running.values())
+        return [
+            {
+                'id': job.id,
+                'queue_id': job.queue_id,
+                'location_id': job.location_id,
+                'message_id': job.message_id,
+                'lane': job.lane,
+                'stage': job.stage,
+                'model': job.model,
+                'estimated_seconds': job.estimated_seconds,
+                'waited_seconds': job.started_at - job.enqueued_at,
+                'elapsed_seconds': now - job.started_at
+            }
+            for job in sorted(running, key=lambda job: job.started_at)
+        ]
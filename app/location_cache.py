@@ -0,0 +1,125 @@
+"""
+Location metadata cache with stale-while-revalidate refresh.
+
+Dashboard renders read from memory once a location has been fetched.
+Entries older than LOCATION_CACHE_TTL are still served while a background
+thread refetches them, and a failed refetch keeps the stale copy, so a
+GoHighLevel outage shows the last known data instead of an empty list. Only
+the first read of a location waits for the fetch (up to
+LOCATION_FETCH_TIMEOUT), so a cold cache does not render an empty dashboard.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from app import metrics
+from app.database import SessionLocal, get_location_token
+from app.ghl import API_BASE_URL, auth_headers, http_session
+
+# Location cache configuration
+LOCATION_CACHE_TTL = int(os.getenv('LOCATION_CACHE_TTL', 300))
+LOCATION_CACHE_MAX_STALE = int(os.getenv('LOCATION_CACHE_MAX_STALE', 7 * 24 * 3600))
+LOCATION_FETCH_TIMEOUT = float(os.getenv('LOCATION_FETCH_TIMEOUT', 10))
+
+def fetch_location(location_id):
+    """Fetch location details from GoHighLevel using the location's own token"""
+    db = SessionLocal()
+    try:
+        token = get_location_token(db, location_id)
+        access_token = token.access_token if token and not token.is_expired() else None
+    finally:
+        db.close()
+
+    if not access_token:
+        raise RuntimeError(f"No valid token for location {location_id}")
+
+    url = f"{API_BASE_URL}/locations/{location_id}"
+    response = http_session.get(url, headers=auth_headers(access_token), timeout=LOCATION_FETCH_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    if 'location' not in data:
+        raise RuntimeError("No location data in response")
+    return data['location']
+
+class LocationCache:
+    """In-memory location cache refreshed in the background"""
+
+    def __init__(self, fetch, ttl, max_stale, cold_timeout=LOCATION_FETCH_TIMEOUT):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.cold_timeout = cold_timeout
+        self._entries = {}
+        # location_id -> future of the refresh in progress
+        self._refreshing = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='location-cache')
+
+    def get(self, location_id):
+        """Return cached location data
+
+        A cold miss waits for the first fetch (concurrent readers share it)
+        and returns None if it fails or times out. Entries older than the TTL
+        are returned at once while a refresh runs in the background.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(location_id)
+
+        if entry is None:
+            metrics.incr('location_cache.miss')
+            try:
+                self.warm(location_id).result(timeout=self.cold_timeout)
+            except FutureTimeoutError:
+                metrics.incr('location_cache.cold_timeout')
+            with self._lock:
+                entry = self._entries.get(location_id)
+            return entry[0] if entry is not None else None
+
+        location, fetched_at = entry
+        age = now - fetched_at
+        if age > self.ttl:
+            metrics.incr('location_cache.stale')
+            self.warm(location_id)
+            if age > self.max_stale:
+                return None
+        else:
+            metrics.incr('location_cache.hit')
+        return location
+
+    def warm(self, location_id):
+        """Schedule a background refresh unless one is already running; returns its future"""
+        with self._lock:
+            future = self._refreshing.get(location_id)
+            if future is None:
+                future = self._refreshing[location_id] = self._executor.submit(self._refresh, location_id)
+            return future
+
+    def _refresh(self, location_id):
+        try:
+            with metrics.timed('location_cache.fetch_seconds'):
+                location = self.fetch(location_id)
+            with self._lock:
+                self._entries[location_id] = (location, time.monotonic())
+            metrics.incr('location_cache.refresh_ok')
+        except Exception as e:
+            # Keep serving the stale entry, if any
+            metrics.incr('location_cache.refresh_error')
+            print(f"Error refreshing location {location_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._refreshing.pop(location_id, None)
+
+    def invalidate(self, location_id):
+        with self._lock:
+            self._entries.pop(location_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'refreshing': len(self._refreshing)}
+
+location_cache = LocationCache(fetch_location, LOCATION_CACHE_TTL, LOCATION_CACHE_MAX_STALE)
@@ -0,0 +1,70 @@
+"""
+Minimal in-process metrics: counters and latency windows.
+"""
+
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+# Number of recent observations kept per timing for percentile estimates
+WINDOW_SIZE = 2048
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = defaultdict(lambda: deque(maxlen=WINDOW_SIZE))
+
+def incr(name, value=1):
+    """Increment a counter"""
+    with _lock:
+        _counters[name] += value
+
+def observe(name, value):
+    """Record one observation (seconds for timings) for a named window"""
+    with _lock:
+        _timings[name].append(value)
+
+@contextmanager
+def timed(name):
+    """Context manager recording the elapsed wall time under name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+def _quantile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def percentile(name, q):
+    """Return the q-quantile (0..1) of the recent window, or None if empty"""
+    with _lock:
+        values = list(_timings.get(name, ()))
+    return _quantile(values, q)
+
+def counter(name):
+    """Current value of a counter"""
+    with _lock:
+        return _counters.get(name, 0)
+
+def snapshot():
+    """Copy of all counters and timing summaries"""
+    with _lock:
+        counters = dict(_counters)
+        timings = {name: list(values) for name, values in _timings.items()}
+    return {
+        'counters': counters,
+        'timings': {
+            name: {
+                'count': len(values),
+                'p50': _quantile(values, 0.5),
+                'p95': _quantile(values, 0.95),
+                'max': max(values) if values else None
+            }
+            for name, values in timings.items()
+        }
+    }
@@ -0,0 +1,113 @@
+"""
+Adaptive per-job Whisper model selection.
+
+Each job gets the most accurate model in MODEL_TIERS whose estimated
+completion time still meets the location's latency SLO. The estimate is the
+time the job already waited, plus the backlog ahead of it spread over the
+scheduler's workers, plus the clip itself, all scaled by the model's
+real-time factor (inference seconds per audio second). Real-time factors
+start from rough CPU defaults and are replaced by the observed median once
+a model has served enough jobs. Under a deep backlog short clips therefore
+drop to tiny, and an idle queue lets them use small. The tiers, SLOs and the
+fixed model used when ADAPTIVE_MODELS is off can be changed at runtime with
+configure() (see the admin API).
+"""
+
+import json
+import os
+
+from app import metrics
+from app.model_store import DEFAULT_MODEL, available_models
+
+ADAPTIVE_MODELS = os.getenv('ADAPTIVE_MODELS', '1').lower() in ('1', 'true', 'yes')
+# Smallest (fastest) to largest (most accurate)
+MODEL_TIERS = [name.strip() for name in os.getenv('MODEL_TIERS', 'tiny,base,small').split(',') if name.strip()]
+MODEL_SLO_SECONDS = float(os.getenv('MODEL_SLO_SECONDS', 60))
+LOCATION_SLOS = json.loads(os.getenv('LOCATION_SLOS', '{}'))
+# Observations needed before a model's measured real-time factor is trusted
+RTF_MIN_SAMPLES = int(os.getenv('MODEL_RTF_MIN_SAMPLES', 10))
+DEFAULT_RTF = {'tiny': 0.04, 'base': 0.08, 'small': 0.25, 'medium': 0.7, 'large': 1.5}
+
+def current_default_model():
+    """Model used when no other is chosen, as last set by configure()
+
+    Read this at call time: importing DEFAULT_MODEL copies the startup value.
+    """
+    return DEFAULT_MODEL
+
+def real_time_factor(model):
+    """Inference seconds per second of audio for a model on this host"""
+    observed = metrics.percentile(f'inference.rtf.{model}', 0.5)
+    if observed is not None and metrics.counter(f'models.served.{model}') >= RTF_MIN_SAMPLES:
+        return observed
+    return DEFAULT_RTF.get(model.split('.')[0], 0.5)
+
+def slo_seconds(location_id):
+    return float(LOCATION_SLOS.get(location_id, MODEL_SLO_SECONDS))
+
+def choose_model(duration, location_id=None, waited=0.0, queue_depth=0, workers=1, mean_clip_seconds=None):
+    """Most accurate model expected to finish this clip within the location's SLO"""
+    if not ADAPTIVE_MODELS or not MODEL_TIERS:
+        return DEFAULT_MODEL
+
+    slo = slo_seconds(location_id)
+    backlog_audio = queue_depth * (mean_clip_seconds or duration) / max(1, workers)
+    for model in reversed(MODEL_TIERS):
+        expected = waited + (backlog_audio + duration) * real_time_factor(model)
+        if expected <= slo:
+            return model
+    return MODEL_TIERS[0]
+
+def settings():
+    return {
+        'adaptive': ADAPTIVE_MODELS,
+        'tiers': list(MODEL_TIERS),
+        'default_model': DEFAULT_MODEL,
+        'slo_seconds': MODEL_SLO_SECONDS,
+        'location_slos': dict(LOCATION_SLOS)
+    }
+
+def check_configuration(adaptive=None, tiers=None, default_model=None, slo_seconds=None, location_slos=None):
+    """Validated configure() arguments, normalised; raises ValueError without changing anything"""
+    known = set(available_models())
+    changes = {}
+    if adaptive is not None:
+        changes['adaptive'] = bool(adaptive)
+    if tiers is not None:
+        if not isinstance(tiers, list) or not tiers:
+            raise ValueError("tiers must be a non-empty list of model names")
+        unknown = [name for name in tiers if name not in known]
+        if unknown:
+            raise ValueError(f"Unknown model(s): {', '.join(map(str, unknown))}")
+        changes['tiers'] = list(tiers)
+    if default_model is not None:
+        if default_model not in known:
+            raise ValueError(f"Unknown model '{default_model}'")
+        changes['default_model'] = default_model
+    if slo_seconds is not None:
+        if float(slo_seconds) <= 0:
+            raise ValueError("slo_seconds must be positive")
+        changes['slo_seconds'] = float(slo_seconds)
+    if location_slos is not None:
+        if not isinstance(location_slos, dict):
+            raise ValueError("location_slos must be an object of location id to seconds")
+        changes['location_slos'] = {location_id: float(seconds) for location_id, seconds in location_slos.items()}
+    return changes
+
+def configure(adaptive=None, tiers=None, default_model=None, slo_seconds=None, location_slos=None):
+    """Change model selection at runtime; raises ValueError for unknown models"""
+    global ADAPTIVE_MODELS, MODEL_TIERS, DEFAULT_MODEL, MODEL_SLO_SECONDS, LOCATION_SLOS
+    changes = check_configuration(adaptive, tiers, default_model, slo_seconds, location_slos)
+    ADAPTIVE_MODELS = changes.get('adaptive', ADAPTIVE_MODELS)
+    MODEL_TIERS = changes.get('tiers', MODEL_TIERS)
+    DEFAULT_MODEL = changes.get('default_model', DEFAULT_MODEL)
+    MODEL_SLO_SECONDS = changes.get('slo_seconds', MODEL_SLO_SECONDS)
+    LOCATION_SLOS = changes.get('location_slos', LOCATION_SLOS)
+    return settings()
+
+def record_inference(model, audio_seconds, inference_seconds):
+    """Metrics for which model served a job and how fast it ran"""
+    metrics.incr(f'models.served.{model}')
+    metrics.observe(f'inference.seconds.{model}', inference_seconds)
+    if audio_seconds > 0:
+        metrics.observe(f'inference.rtf.{model}', inference_seconds / audio_seconds)
@@ -0,0 +1,390 @@
+"""
+Managed store for Whisper model artifacts.
+
+Weights live in WHISPER_MODEL_DIR instead of the per-user cache, are verified
+against the SHA256 embedded in the upstream URL, and are loaded with
+memory-mapping so boot time is bounded by disk rather than by the network.
+Upstream checkpoints are fp16, which CPU kernels cannot use, so CPU loads
+map an fp32 copy written next to the verified checkpoint on first use;
+converting at load time would copy every mapped tensor into anonymous memory.
+Set WHISPER_OFFLINE=1 to make any missing artifact a hard error.
+
+WHISPER_QUANTIZE=int8 serves CPU models with dynamically quantized int8
+linear layers. The quantized weights are cached next to the fp32 ones as a
+plain state dict, loaded with weights_only and poured into an int8 skeleton
+that is never initialized or quantized itself, so nothing in the (writable)
+store is ever unpickled as code and a cached load costs little more than
+reading it. The quantized model is only used once `manage_models.py quantize` has checked its word error rate against
+a reference set (unless WHISPER_QUANTIZE_REQUIRE_VERIFIED=0).
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+
+import requests
+import whisper
+from whisper.model import ModelDimensions, Whisper
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Model store configuration
+MODEL_DIR = os.getenv('WHISPER_MODEL_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models'))
+DEFAULT_MODEL = os.getenv('WHISPER_MODEL', 'base')
+OFFLINE = os.getenv('WHISPER_OFFLINE', '0').lower() in ('1', 'true', 'yes')
+MAX_LOADED_MODELS = int(os.getenv('WHISPER_MAX_LOADED_MODELS', 2))
+QUANTIZE = os.getenv('WHISPER_QUANTIZE', '').lower() in ('int8', '1', 'true', 'yes')
+QUANTIZE_REQUIRE_VERIFIED = os.getenv('WHISPER_QUANTIZE_REQUIRE_VERIFIED', '1').lower() in ('1', 'true', 'yes')
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Loaded models, least recently used first
+_models = OrderedDict()
+_models_lock = threading.Lock()
+_load_locks = {}
+
+class ModelStoreError(RuntimeError):
+    """Raised when a model artifact is missing, corrupt or unknown"""
+
+def available_models():
+    """Return the names of all models known to whisper"""
+    return list(whisper._MODELS.keys())
+
+def _model_url(name):
+    if name not in whisper._MODELS:
+        raise ModelStoreError(f"Unknown model '{name}'. Available: {', '.join(available_models())}")
+    return whisper._MODELS[name]
+
+def model_path(name):
+    """Path of a model artifact inside the store"""
+    return os.path.join(MODEL_DIR, os.path.basename(_model_url(name)))
+
+def expected_sha256(name):
+    """Checksum published by upstream as part of the download URL"""
+    return _model_url(name).split('/')[-2]
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _marker_path(path):
+    return f"{path}.verified"
+
+def _file_identity(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def _mark_verified(name, path):
+    """Remember that this exact file passed its checksum"""
+    marker = dict(_file_identity(path), sha256=expected_sha256(name))
+    try:
+        with open(_marker_path(path), 'w') as f:
+            json.dump(marker, f)
+    except OSError as e:
+        print(f"Could not write checksum marker for '{name}': {str(e)}")
+
+def _marker_matches(name, path):
+    try:
+        with open(_marker_path(path)) as f:
+            return json.load(f) == dict(_file_identity(path), sha256=expected_sha256(name))
+    except (OSError, ValueError):
+        return False
+
+def verify_model(name, full=False):
+    """Check that a stored artifact exists and matches its checksum
+
+    Unless full is set, the SHA256 is only recomputed when the file changed
+    since it was last verified (size or mtime differ from the marker next to it).
+    """
+    path = model_path(name)
+    if not os.path.isfile(path):
+        return False
+    if not full and _marker_matches(name, path):
+        return True
+    if _file_sha256(path) != expected_sha256(name):
+        return False
+    _mark_verified(name, path)
+    return True
+
+def prefetch_model(name, force=False):
+    """Download a model into the store and verify it, returns its path"""
+    path = model_path(name)
+    if not force and verify_model(name):
+        print(f"Model '{name}' already present and verified: {path}")
+        return path
+
+    if OFFLINE:
+        raise ModelStoreError(f"Model '{name}' is not in {MODEL_DIR} and WHISPER_OFFLINE is set")
+
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    url = _model_url(name)
+    tmp_path = f"{path}.part"
+    digest = hashlib.sha256()
+
+    print(f"Downloading model '{name}' from {url}")
+    try:
+        with requests.get(url, stream=True, timeout=(10, 60)) as response:
+            response.raise_for_status()
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    digest.update(chunk)
+
+        if digest.hexdigest() != expected_sha256(name):
+            raise ModelStoreError(f"Checksum mismatch for model '{name}'")
+
+        # Atomic rename so a concurrent loader never sees a partial file
+        os.replace(tmp_path, path)
+        _mark_verified(name, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    print(f"Model '{name}' stored at {path}")
+    return path
+
+def _load_checkpoint(path, device):
+    import torch
+
+    try:
+        # Memory-map the zip archive so tensors are paged in on demand
+        return torch.load(path, map_location=device, mmap=True, weights_only=True)
+    except (TypeError, RuntimeError, pickle.UnpicklingError):
+        # Older torch, or a legacy (non-zip) checkpoint that weights_only rejects
+        return torch.load(path, map_location=device)
+
+def fp32_path(name):
+    """Path of the fp32 copy of a model served on CPU"""
+    return os.path.join(MODEL_DIR, f"{name}.fp32.pt")
+
+def build_fp32_checkpoint(name):
+    """Write an fp32 copy of a verified checkpoint, returns its path"""
+    import torch
+
+    checkpoint = _load_checkpoint(model_path(name), 'cpu')
+    state = {
+        key: value.float() if value.is_floating_point() else value
+        for key, value in checkpoint['model_state_dict'].items()
+    }
+    target = fp32_path(name)
+    tmp_path = f"{target}.part"
+    try:
+        torch.save({'source_sha256': expected_sha256(name), 'dims': checkpoint['dims'], 'model_state_dict': state}, tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    print(f"Stored fp32 copy of model '{name}' at {target}")
+    return target
+
+def _load_fp32_checkpoint(name, path):
+    """Memory-mapped fp32 checkpoint for CPU, built from the verified one when missing or stale"""
+    import torch
+
+    target = fp32_path(name)
+    if os.path.isfile(target):
+        try:
+            checkpoint = torch.load(target, map_location='cpu', mmap=True, weights_only=True)
+        except Exception as e:
+            print(f"fp32 copy of '{name}' is unreadable, rebuilding: {str(e)}")
+            checkpoint = {}
+        if checkpoint.get('source_sha256') == expected_sha256(name):
+            return checkpoint
+    try:
+        return _load_checkpoint(build_fp32_checkpoint(name), 'cpu')
+    except OSError as e:
+        # Read-only store: fall back to converting in memory
+        print(f"Could not store an fp32 copy of '{name}': {str(e)}")
+        return _load_checkpoint(path, 'cpu')
+
+def load_model(name=None, device='cpu'):
+    """Load a model from the store, downloading it only when allowed"""
+    name = name or DEFAULT_MODEL
+    path = model_path(name)
+    if not verify_model(name):
+        if os.path.isfile(path):
+            print(f"Model '{name}' at {path} is missing its checksum, fetching it again")
+        # Raises ModelStoreError when offline
+        prefetch_model(name, force=True)
+
+    if device == 'cpu':
+        checkpoint = _load_fp32_checkpoint(name, path)
+    else:
+        checkpoint = _load_checkpoint(path, device)
+    model = Whisper(ModelDimensions(**checkpoint['dims']))
+    try:
+        # assign=True keeps the memory-mapped tensors instead of copying them
+        model.load_state_dict(checkpoint['model_state_dict'], assign=True)
+    except TypeError:
+        model.load_state_dict(checkpoint['model_state_dict'])
+
+    _set_alignment_heads(model, name)
+
+    if device == 'cpu':
+        # A no-op for the fp32 copy; only the read-only fallback is converted here
+        model = model.float()
+    return model.to(device)
+
+def _set_alignment_heads(model, name):
+    alignment_heads = whisper._ALIGNMENT_HEADS.get(name)
+    if alignment_heads is not None:
+        model.set_alignment_heads(alignment_heads)
+
+def quantized_path(name):
+    """Path of the cached int8 model"""
+    return os.path.join(MODEL_DIR, f"{name}.int8.pt")
+
+def quantization_report_path(name):
+    return os.path.join(MODEL_DIR, f"{name}.int8.json")
+
+def quantize_model(model):
+    """Dynamic int8 quantization of every linear layer, in place"""
+    import torch
+    from torch import nn
+
+    # The quantizer needs fp32 weights; GPU-loaded checkpoints are still fp16
+    model = model.float()
+    # whisper's Linear subclass only casts weights to the input dtype; the
+    # quantizer matches exact module types, so present its layers as nn.Linear
+    for module in model.modules():
+        if isinstance(module, nn.Linear):
+            module.__class__ = nn.Linear
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def quantized_skeleton(dims):
+    """Empty int8 Whisper laid out like quantize_model's output, to load a cached state dict into
+
+    Parameters are left uninitialized (load_state_dict overwrites every one)
+    and linear layers are replaced by empty int8 ones, so no fp32 weights are
+    filled in or quantized only to be thrown away.
+    """
+    import torch
+    from torch import nn
+    from torch.ao.nn.quantized.dynamic import Linear as QuantizedLinear
+    from torch.overrides import TorchFunctionMode
+
+    class SkipInit(TorchFunctionMode):
+        """Turn torch.nn.init calls into no-ops, in this thread only"""
+
+        def __torch_function__(self, func, types, args=(), kwargs=None):
+            if getattr(func, '__module__', None) == 'torch.nn.init':
+                return args[0] if args else kwargs['tensor']
+            return func(*args, **(kwargs or {}))
+
+    # Buffers (positional embedding, attention mask) are computed as usual
+    with SkipInit():
+        model = Whisper(ModelDimensions(**dims))
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, nn.Linear):
+                setattr(module, child_name, QuantizedLinear(
+                    child.in_features, child.out_features, bias_=child.bias is not None, dtype=torch.qint8
+                ))
+    return model
+
+def build_quantized_model(name):
+    """Quantize a stored model and write it to the int8 cache"""
+    import torch
+
+    print(f"Quantizing Whisper model '{name}' to int8")
+    model = quantize_model(load_model(name))
+    path = quantized_path(name)
+    tmp_path = f"{path}.part"
+    torch.save({
+        'source_sha256': expected_sha256(name),
+        'torch_version': str(torch.__version__),
+        'dims': asdict(model.dims),
+        'model_state_dict': model.state_dict()
+    }, tmp_path)
+    os.replace(tmp_path, path)
+    print(f"Int8 model '{name}' cached at {path}")
+    return model
+
+def load_quantized_model(name):
+    """Int8 model from the on-disk cache, rebuilding it when missing or stale"""
+    import torch
+
+    path = quantized_path(name)
+    if os.path.isfile(path):
+        try:
+            # Tensors and plain containers only, never a full unpickle
+            cached = torch.load(path, map_location='cpu', weights_only=True)
+        except Exception as e:
+            # Older torch, or a cache from before state dicts (whole pickled modules)
+            print(f"Int8 cache for '{name}' cannot be loaded safely: {str(e)}")
+            cached = {}
+        fresh = cached.get('source_sha256') == expected_sha256(name) and cached.get('torch_version') == str(torch.__version__)
+        if fresh and 'dims' in cached:
+            model = quantized_skeleton(cached['dims'])
+            model.load_state_dict(cached['model_state_dict'])
+            _set_alignment_heads(model, name)
+            return model
+        print(f"Int8 cache for '{name}' is stale, rebuilding")
+    return build_quantized_model(name)
+
+def quantization_report(name):
+    """Accuracy check results of the cached int8 model, or None"""
+    try:
+        with open(quantization_report_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_quantization_report(name, report):
+    with open(quantization_report_path(name), 'w') as f:
+        json.dump(report, f, indent=2)
+
+def _load_for_serving(name):
+    if QUANTIZE:
+        report = quantization_report(name)
+        verified = report and report.get('passed') and report.get('source_sha256') == expected_sha256(name)
+        if verified or not QUANTIZE_REQUIRE_VERIFIED:
+            return load_quantized_model(name)
+        print(f"Int8 '{name}' has not passed the accuracy check (manage_models.py quantize), using fp32")
+    return load_model(name)
+
+def get_model(name=None):
+    """Return a process-wide loaded model, loading it on first use
+
+    At most MAX_LOADED_MODELS stay in memory; loading another one evicts the
+    least recently used.
+    """
+    name = name or DEFAULT_MODEL
+    with _models_lock:
+        model = _models.get(name)
+        if model is not None:
+            _models.move_to_end(name)
+            return model
+        load_lock = _load_locks.setdefault(name, threading.Lock())
+
+    # Loading one model must not block lookups of the others
+    with load_lock:
+        with _models_lock:
+            model = _models.get(name)
+        if model is None:
+            print(f"Loading Whisper model '{name}' from {MODEL_DIR}")
+            model = _load_for_serving(name)
+        with _models_lock:
+            _models[name] = model
+            _models.move_to_end(name)
+            while len(_models) > max(1, MAX_LOADED_MODELS):
+                evicted, _ = _models.popitem(last=False)
+                print(f"Evicted Whisper model '{evicted}' from memory")
+    return model
+
+def loaded_models():
+    """Names of the models currently in memory, least recently used first"""
+    with _models_lock:
+        return list(_models)
+
+def unload_models():
+    """Drop all loaded models"""
+    with _models_lock:
+        _models.clear()
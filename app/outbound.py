@@ -0,0 +1,344 @@
+"""
+Durable write-behind queue for GoHighLevel updates.
+
+Contact field updates and inbound conversation messages are inserted into
+outbound_updates and acknowledged immediately; a sender thread delivers them
+in the background. Due updates are claimed with FOR UPDATE SKIP LOCKED (so
+several nodes can send), grouped per location and sent in order within each
+location through the shared GoHighLevel rate limiter. An update is only
+claimed while no older update of its location is backed off or leased, and
+claims are serialised by an advisory lock, so a location's updates are never
+split across nodes or overtaken by later ones while an earlier one waits.
+A location's group is sent under one lease, renewed between updates once less
+than OUTBOUND_SEND_SECONDS of it is left; if it cannot be renewed the group
+stops there and leaves the rest to the next claim. Transient failures
+(network errors, 429, 5xx) are retried with exponential backoff and jitter;
+rejected updates and those that exhaust OUTBOUND_MAX_ATTEMPTS are moved to
+outbound_dead_letters.
+
+Delivery functions are registered per kind with register_handler, so this
+module does not depend on what the updates contain.
+"""
+
+import hashlib
+import os
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import and_, or_, select, text, update
+from sqlalchemy.orm import aliased
+
+from app import metrics
+from app.database import OutboundDeadLetter, OutboundUpdate, SessionLocal, get_utc_now
+from app.ratelimit import ghl_rate_limiter
+
+OUTBOUND_WORKERS = int(os.getenv('OUTBOUND_WORKERS', 4))
+OUTBOUND_BATCH_SIZE = int(os.getenv('OUTBOUND_BATCH_SIZE', 100))
+OUTBOUND_POLL_SECONDS = float(os.getenv('OUTBOUND_POLL_SECONDS', 5))
+OUTBOUND_LEASE_SECONDS = int(os.getenv('OUTBOUND_LEASE_SECONDS', 120))
+# Longest a single delivery may take (handlers use 30 s request timeouts)
+OUTBOUND_SEND_SECONDS = int(os.getenv('OUTBOUND_SEND_SECONDS', 45))
+OUTBOUND_MAX_ATTEMPTS = int(os.getenv('OUTBOUND_MAX_ATTEMPTS', 8))
+OUTBOUND_BACKOFF_BASE = float(os.getenv('OUTBOUND_BACKOFF_BASE', 2))
+OUTBOUND_BACKOFF_MAX = float(os.getenv('OUTBOUND_BACKOFF_MAX', 600))
+# Delay for updates that found their location's rate limit exhausted
+OUTBOUND_RATE_DEFER = float(os.getenv('OUTBOUND_RATE_DEFER', 1))
+
+# Advisory lock held by the transaction claiming a batch
+CLAIM_LOCK_KEY = int.from_bytes(hashlib.sha1(b"outbound-claim").digest()[:8], 'big', signed=True)
+
+class DeliveryError(Exception):
+    """Raised by handlers; retryable=False sends the update straight to dead letters"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+def check_response(response):
+    """Raise DeliveryError for a non-2xx GoHighLevel response"""
+    if response.status_code < 300:
+        return
+    retryable = response.status_code == 429 or response.status_code >= 500
+    raise DeliveryError(f"HTTP {response.status_code}: {response.text[:500]}", retryable=retryable)
+
+_handlers = {}
+
+def register_handler(kind, handler):
+    """Register handler(location_id, payload) delivering updates of one kind"""
+    _handlers[kind] = handler
+
+def backoff_seconds(attempts):
+    """Exponential backoff with full jitter after the given number of attempts"""
+    return random.uniform(0, min(OUTBOUND_BACKOFF_MAX, OUTBOUND_BACKOFF_BASE ** attempts))
+
+def enqueue_update(location_id, kind, payload):
+    """Durably queue one update and wake the sender; returns its id"""
+    db = SessionLocal()
+    try:
+        item = OutboundUpdate(location_id=location_id, kind=kind, payload=payload)
+        db.add(item)
+        db.commit()
+        update_id = item.id
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    metrics.incr(f'outbound.enqueued.{kind}')
+    outbound_sender.wake()
+    return update_id
+
+def claim_updates(limit=OUTBOUND_BATCH_SIZE):
+    """Lease due updates to this process, oldest first
+
+    Updates queued behind an older update of the same location that is backed
+    off or leased (possibly by another node) are left alone, so per-location
+    order holds across retries and nodes.
+    """
+    now = get_utc_now()
+    earlier = aliased(OutboundUpdate)
+    blocked = (
+        select(earlier.id)
+        .where(
+            earlier.location_id == OutboundUpdate.location_id,
+            earlier.id < OutboundUpdate.id,
+            or_(
+                earlier.next_attempt_at > now,
+                and_(earlier.locked_until.isnot(None), earlier.locked_until >= now)
+            )
+        )
+        .exists()
+    )
+    candidates = (
+        select(OutboundUpdate.id)
+        .where(
+            OutboundUpdate.next_attempt_at <= now,
+            or_(OutboundUpdate.locked_until.is_(None), OutboundUpdate.locked_until < now),
+            ~blocked
+        )
+        .order_by(OutboundUpdate.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    stmt = (
+        update(OutboundUpdate)
+        .where(OutboundUpdate.id.in_(candidates.scalar_subquery()))
+        .values(locked_until=now + timedelta(seconds=OUTBOUND_LEASE_SECONDS))
+        .returning(OutboundUpdate)
+        .execution_options(synchronize_session=False)
+    )
+    db = SessionLocal()
+    try:
+        # SKIP LOCKED alone would let a second node take a location's later
+        # updates while the first still holds its earliest; claims are short,
+        # so they run one at a time and each sees the leases of the last
+        db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': CLAIM_LOCK_KEY})
+        items = db.execute(stmt).scalars().all()
+        db.commit()
+        db.expunge_all()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+    return sorted(items, key=lambda item: item.id)
+
+def renew_lease(items, locked_until):
+    """Extend the lease of claimed updates still held under locked_until
+
+    The lease's expiry doubles as its owner's token: another node that
+    claimed the updates after it lapsed set a different one. Returns the new
+    expiry, or None when the lease is lost or the database is unreachable.
+    """
+    renewed_until = get_utc_now() + timedelta(seconds=OUTBOUND_LEASE_SECONDS)
+    db = SessionLocal()
+    try:
+        renewed = db.query(OutboundUpdate).filter(
+            OutboundUpdate.id.in_([item.id for item in items]),
+            OutboundUpdate.locked_until == locked_until
+        ).update({'locked_until': renewed_until}, synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        print(f"Error renewing outbound lease: {str(e)}")
+        db.rollback()
+        return None
+    finally:
+        db.close()
+    return renewed_until if renewed == len(items) else None
+
+class OutboundSender:
+    """Background thread delivering queued updates per location"""
+
+    def __init__(self, workers=OUTBOUND_WORKERS, batch_size=OUTBOUND_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._executor = None
+        self._flush = False
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._flush = False
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='outbound')
+            self._thread = threading.Thread(
+                target=self._run, args=(self._executor,), name='outbound-sender', daemon=True
+            )
+            self._thread.start()
+        print(f"Outbound sender started with {self.workers} worker(s)")
+
+    def wake(self):
+        """Deliver new updates now instead of at the next poll, starting on first use"""
+        if self._thread is None:
+            self.start()
+        self._wake.set()
+
+    def _run(self, executor):
+        while True:
+            stopping = self._stop.is_set()
+            if stopping and not self._flush:
+                return
+            try:
+                sent = self.send_due(executor)
+            except Exception as e:
+                print(f"Outbound sender error: {str(e)}")
+                sent = 0
+            if not sent:
+                if stopping:
+                    return
+                self._wake.wait(OUTBOUND_POLL_SECONDS)
+                self._wake.clear()
+
+    def send_due(self, executor=None):
+        """Claim one batch of due updates and deliver it; returns the batch size"""
+        executor = executor or self._executor
+        items = claim_updates(self.batch_size)
+        if not items:
+            return 0
+        groups = OrderedDict()
+        for item in items:
+            groups.setdefault(item.location_id, []).append(item)
+        # Locations in parallel, each location's updates in order
+        list(executor.map(self._send_group, groups.values()))
+        return len(items)
+
+    def _send_group(self, items):
+        sent, retries, dead = [], [], []
+        deferred, deferred_until = [], None
+        locked_until = items[0].locked_until
+        for index, item in enumerate(items):
+            if locked_until - get_utc_now() < timedelta(seconds=OUTBOUND_SEND_SECONDS):
+                locked_until = renew_lease(items[index:], locked_until)
+                if locked_until is None:
+                    # Left leased as they are; whoever claims them next sends them
+                    metrics.incr('outbound.lease_lost', len(items) - index)
+                    print(f"Outbound lease for {item.location_id} lapsed, leaving {len(items) - index} update(s)")
+                    break
+            if not ghl_rate_limiter.try_acquire(item.location_id):
+                metrics.incr('outbound.rate_deferred', len(items) - index)
+                deferred = items[index:]
+                deferred_until = get_utc_now() + timedelta(seconds=OUTBOUND_RATE_DEFER)
+                break
+            try:
+                handler = _handlers.get(item.kind)
+                if handler is None:
+                    raise DeliveryError(f"No handler for outbound kind '{item.kind}'", retryable=False)
+                handler(item.location_id, item.payload)
+            except Exception as e:
+                retryable = getattr(e, 'retryable', True)
+                attempts = item.attempts + 1
+                error = f"{type(e).__name__}: {str(e)}"
+                if not retryable or attempts >= OUTBOUND_MAX_ATTEMPTS:
+                    dead.append((item, attempts, error))
+                    continue
+                retry_at = get_utc_now() + timedelta(seconds=backoff_seconds(attempts))
+                retries.append((item, attempts, retry_at, error))
+                # Keep the location's later updates behind the failed one
+                deferred = items[index + 1:]
+                deferred_until = retry_at
+                break
+            sent.append(item)
+        self._settle(sent, retries, dead, deferred, deferred_until)
+
+    def _settle(self, sent, retries, dead, deferred, deferred_until):
+        """Record the outcome of one location's group in a single transaction"""
+        now = get_utc_now()
+        db = SessionLocal()
+        try:
+            if sent:
+                db.query(OutboundUpdate).filter(
+                    OutboundUpdate.id.in_([item.id for item in sent])
+                ).delete(synchronize_session=False)
+            for item, attempts, retry_at, error in retries:
+                db.query(OutboundUpdate).filter(OutboundUpdate.id == item.id).update({
+                    'attempts': attempts, 'next_attempt_at': retry_at, 'locked_until': None, 'last_error': error
+                }, synchronize_session=False)
+            for item, attempts, error in dead:
+                db.add(OutboundDeadLetter(
+                    id=item.id, location_id=item.location_id, kind=item.kind, payload=item.payload,
+                    attempts=attempts, last_error=error, created_at=item.created_at
+                ))
+                db.query(OutboundUpdate).filter(OutboundUpdate.id == item.id).delete(synchronize_session=False)
+            if deferred:
+                db.query(OutboundUpdate).filter(
+                    OutboundUpdate.id.in_([item.id for item in deferred])
+                ).update({'next_attempt_at': deferred_until, 'locked_until': None}, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            # Leases expire, so unsettled updates are simply retried later
+            print(f"Error settling outbound updates: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+        for item in sent:
+            metrics.incr(f'outbound.sent.{item.kind}')
+            metrics.observe('outbound.delivery_seconds', (now - item.created_at).total_seconds())
+        for item, _, _, error in retries:
+            metrics.incr(f'outbound.retried.{item.kind}')
+            print(f"Outbound update {item.id} ({item.kind}) failed, will retry: {error}")
+        for item, _, error in dead:
+            metrics.incr(f'outbound.dead.{item.kind}')
+            print(f"Outbound update {item.id} ({item.kind}) dead-lettered: {error}")
+
+    def stop(self, timeout=None, flush=False):
+        """Stop the sender; with flush, first deliver whatever is due within the timeout"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+        if thread is None:
+            return
+        self._flush = flush
+        self._stop.set()
+        self._wake.set()
+        # The executor is still needed while a flush delivers. The thread
+        # holds its own reference, so if the join times out a late batch
+        # fails on the shut-down executor and is retried once its lease
+        # expires, instead of finding no executor at all
+        thread.join(timeout)
+        executor.shutdown(wait=False)
+
+    def stats(self):
+        db = SessionLocal()
+        try:
+            pending = db.query(OutboundUpdate).count()
+            dead = db.query(OutboundDeadLetter).count()
+        finally:
+            db.close()
+        return {
+            'running': self._thread is not None,
+            'workers': self.workers,
+            'batch_size': self.batch_size,
+            'pending': pending,
+            'dead_letters': dead
+        }
+
+outbound_sender = OutboundSender()
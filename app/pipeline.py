@@ -0,0 +1,461 @@
+"""
+Transcription pipeline: turns webhook attachments into jobs and processes them
+off the request thread (download, transcribe, store, update GoHighLevel).
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from app import metrics
+from app.audio import SAMPLE_RATE, AudioDecodeError
+from app.database import get_valid_token
+from app.decoder_pool import decode_shared
+from app.fingerprint import FINGERPRINT_ENABLED, compute_fingerprint, fingerprint_index
+from app.ghl import API_BASE_URL, auth_headers, http_session
+from app.job_scheduler import TRANSCRIPTION_WORKERS, JobScheduler, TranscriptionJob, estimate_seconds
+from app.http_client import DownloadError, attachment_client
+from app.inference_pool import inference_pool
+from app.model_policy import choose_model, current_default_model, record_inference
+from app.model_store import ModelStoreError, get_model
+from app.outbound import DeliveryError, check_response, enqueue_update, register_handler
+from app.shared_audio import release, samples, window
+from app.token_refresh import get_fresh_token
+from app.transcripts import audio_hash, find_by_audio_hash, get_transcription, save_transcription
+
+# Streaming configuration: clips longer than this are posted progressively
+STREAMING_MIN_SECONDS = float(os.getenv('STREAMING_MIN_SECONDS', 60))
+STREAM_FIRST_CHUNK_SECONDS = float(os.getenv('STREAM_FIRST_CHUNK_SECONDS', 15))
+STREAM_CHUNK_SECONDS = float(os.getenv('STREAM_CHUNK_SECONDS', 30))
+STREAM_POST_INTERVAL = float(os.getenv('STREAM_POST_INTERVAL', 15))
+# Tail of each window that is transcribed again as the head of the next one,
+# so a word cut by the window edge is never posted
+STREAM_OVERLAP_SECONDS = float(os.getenv('STREAM_OVERLAP_SECONDS', 5))
+
+TRANSCRIPT_HEADER = "🎯 Transcripción del audio"
+
+# Transcription custom field ids per location
+_field_ids = {}
+_field_ids_lock = threading.Lock()
+
+def ensure_transcription_field(location_id, access_token=None):
+    """Ensure the Transcription custom field exists, create it if it doesn't"""
+    with _field_ids_lock:
+        if location_id in _field_ids:
+            return _field_ids[location_id]
+
+    try:
+        # Use the location's token from database instead of the passed one
+        access_token = get_valid_token(location_id) or access_token
+        if not access_token:
+            print("No active token found")
+            return None
+
+        # First, check if the field exists
+        url = f"{API_BASE_URL}/locations/{location_id}/customFields"
+        headers = auth_headers(access_token)
+
+        print(f"\nChecking custom fields at: {url}")
+        response = http_session.get(url, headers=headers, timeout=30)
+        print(f"Response status: {response.status_code}")
+
+        if response.status_code != 200:
+            print(f"Error checking fields: {response.status_code} - {response.text}")
+            return None
+
+        fields = response.json().get('customFields', [])
+        # Look for our Transcription field
+        transcription_field = next((field for field in fields if field.get('name') == 'Transcription'), None)
+
+        if transcription_field:
+            print("Transcription field already exists")
+            field_id = transcription_field.get('id')
+        else:
+            # If we get here, the field doesn't exist, so let's create it
+            print("Creating Transcription field")
+            create_data = {
+                "name": "Transcription",
+                "dataType": "TEXT",
+                "model": "contact",
+                "placeholder": "Transcription of audio messages"
+            }
+            create_response = http_session.post(url, headers=headers, json=create_data, timeout=30)
+            if create_response.status_code != 200:
+                print(f"Error creating field: {create_response.status_code} - {create_response.text}")
+                return None
+            print("Successfully created Transcription field")
+            field_id = create_response.json().get('id')
+
+        if field_id:
+            with _field_ids_lock:
+                _field_ids[location_id] = field_id
+        return field_id
+
+    except Exception as e:
+        print(f"Error in ensure_transcription_field: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return None
+
+def update_contact_transcription(location_id, contact_id, text):
+    """Queue a write of a transcription into the contact's Transcription custom field"""
+    return enqueue_update(location_id, 'contact_field', {'contact_id': contact_id, 'text': text})
+
+def deliver_contact_field(location_id, payload):
+    """Outbound handler: PUT the transcription into the contact's custom field"""
+    access_token = get_fresh_token(location_id)
+    if not access_token:
+        raise DeliveryError("No valid token to update contact")
+
+    field_id = ensure_transcription_field(location_id, access_token)
+    if not field_id:
+        raise DeliveryError("Transcription field is not available")
+
+    contact_id = payload['contact_id']
+    update_url = f"{API_BASE_URL}/contacts/{contact_id}"
+    update_data = {
+        "customFields": [
+            {
+                "id": field_id,
+                "value": payload['text']
+            }
+        ]
+    }
+    check_response(http_session.put(update_url, headers=auth_headers(access_token), json=update_data, timeout=30))
+    print(f"Successfully updated contact {contact_id} with transcription")
+
+def build_jobs(attachments, conversation_id, message_type, location_id=None, contact_id=None, message_id=None):
+    """Create one job per normalized Attachment (see app.events)"""
+    return [
+        TranscriptionJob(
+            attachment.url,
+            location_id=location_id,
+            conversation_id=conversation_id,
+            contact_id=contact_id,
+            message_id=message_id,
+            message_type=message_type,
+            estimated_seconds=estimate_seconds(attachment.duration, attachment.size)
+        )
+        for attachment in attachments
+    ]
+
+def send_inbound_message(location_id, conversation_id, message, message_type, attachments=None):
+    """Queue an inbound message with transcription for GoHighLevel; returns the update id"""
+    payload = {
+        "type": message_type,
+        "message": message,
+        "conversationId": conversation_id,
+        "direction": "inbound",
+        "date": datetime.now(timezone.utc).isoformat()
+    }
+    if attachments:
+        payload["attachments"] = attachments
+    try:
+        return enqueue_update(location_id, 'inbound_message', payload)
+    except Exception as e:
+        print(f"Error queueing inbound message: {str(e)}")
+        return None
+
+def deliver_inbound_message(location_id, payload):
+    """Outbound handler: POST an inbound message to the conversation"""
+    access_token = get_fresh_token(location_id)
+    if not access_token:
+        raise DeliveryError("No valid token available")
+
+    url = f"{API_BASE_URL}/conversations/messages/inbound"
+    response = http_session.post(url, headers=auth_headers(access_token), json=payload, timeout=30)
+    check_response(response)
+    print(f"Sent inbound message to conversation {payload.get('conversationId')}")
+
+register_handler('contact_field', deliver_contact_field)
+register_handler('inbound_message', deliver_inbound_message)
+
+class TranscriptPoster:
+    """Posts a transcript to the conversation, progressively for long clips
+
+    Partial text is buffered and flushed at most once every
+    STREAM_POST_INTERVAL seconds, except for the very first chunk which is
+    posted immediately to minimize time-to-first-text.
+    """
+
+    def __init__(self, job, interval=STREAM_POST_INTERVAL):
+        self.job = job
+        self.interval = interval
+        self.pending = []
+        self.parts_posted = 0
+        self.last_post = None
+
+    def _post(self, text, final):
+        self.job.commit()
+        if self.parts_posted == 0 and final:
+            header = f"{TRANSCRIPT_HEADER}:"
+        else:
+            suffix = "final" if final else "en curso"
+            header = f"{TRANSCRIPT_HEADER} (parte {self.parts_posted + 1}, {suffix}):"
+        send_inbound_message(self.job.location_id, self.job.conversation_id, f"{header}\n\n{text}", self.job.message_type)
+        self.parts_posted += 1
+        self.last_post = time.monotonic()
+        if self.parts_posted == 1:
+            metrics.observe('stream.time_to_first_text_seconds', self.last_post - self.job.enqueued_at)
+
+    def add(self, text):
+        """Buffer a partial transcript, posting it if the rate limit allows"""
+        if text:
+            self.pending.append(text)
+        if self.pending and (self.last_post is None or time.monotonic() - self.last_post >= self.interval):
+            self._post(" ".join(self.pending), final=False)
+            self.pending = []
+
+    def finish(self, full_text):
+        """Post whatever has not been posted yet"""
+        if not self.job.conversation_id or not self.job.message_type:
+            return
+        if self.parts_posted == 0:
+            if full_text:
+                self._post(full_text, final=True)
+        elif self.pending:
+            self._post(" ".join(self.pending), final=True)
+        self.pending = []
+
+def run_inference(audio, model=None, **options):
+    """Transcribe decoded audio in the inference pool, or in-process without one"""
+    model = model or current_default_model()
+    if inference_pool is not None:
+        return inference_pool.transcribe(audio, model, **options)
+    return get_model(model).transcribe(samples(audio), **options)
+
+class StreamProgress:
+    """Text reported so far by a streaming transcription and where to resume it"""
+
+    def __init__(self):
+        self.texts = []
+        self.offset = 0
+        self.language = None
+        self.windows = 0
+
+def split_window(result, window_samples, last):
+    """(text, samples consumed) of one window, cut on a segment boundary
+
+    Segments ending inside the window's last STREAM_OVERLAP_SECONDS are
+    dropped and the next window starts where the last kept segment ends, so
+    they are transcribed again with their full context. The final window,
+    and a window without a usable boundary, is taken whole.
+    """
+    segments = result.get("segments") or []
+    cutoff = window_samples / SAMPLE_RATE - STREAM_OVERLAP_SECONDS
+    kept = []
+    for segment in segments:
+        if segment["end"] > cutoff:
+            break
+        kept.append(segment)
+    consumed = int(kept[-1]["end"] * SAMPLE_RATE) if kept else 0
+    if last or consumed <= 0:
+        return result["text"].strip(), window_samples
+    return "".join(segment["text"] for segment in kept).strip(), min(consumed, window_samples)
+
+def transcribe_streaming(audio, on_partial, model=None, progress=None):
+    """Transcribe decoded audio window by window, reporting each window's text
+
+    Pass the same StreamProgress to a retry (e.g. with another model) to
+    resume after the last reported window instead of starting over.
+    """
+    progress = progress or StreamProgress()
+    while progress.offset < len(audio):
+        chunk_seconds = STREAM_FIRST_CHUNK_SECONDS if progress.windows == 0 else STREAM_CHUNK_SECONDS
+        end = min(len(audio), progress.offset + int(chunk_seconds * SAMPLE_RATE))
+        # Condition each window on the tail of the previous text for continuity
+        prompt = " ".join(progress.texts)[-200:] or None
+        chunk = window(audio, progress.offset, end)
+        try:
+            result = run_inference(chunk, model, language=progress.language, initial_prompt=prompt)
+        finally:
+            release(chunk)
+        text, consumed = split_window(result, end - progress.offset, end >= len(audio))
+        progress.language = progress.language or result.get("language")
+        progress.offset += consumed
+        progress.windows += 1
+        if text:
+            progress.texts.append(text)
+            on_partial(text)
+    return {"text": " ".join(progress.texts), "language": progress.language}
+
+def select_model(job, duration):
+    """Model for this job given the current backlog (see app.model_policy)"""
+    metrics.observe('audio.duration_seconds', duration)
+    waited = (job.started_at or job.enqueued_at) - job.enqueued_at
+    return choose_model(
+        duration,
+        location_id=job.location_id,
+        waited=waited,
+        queue_depth=transcription_scheduler.depth(),
+        workers=transcription_scheduler.workers,
+        mean_clip_seconds=metrics.percentile('audio.duration_seconds', 0.5)
+    )
+
+def transcribe_with(model, audio, duration, on_partial=None, progress=None):
+    if on_partial is not None and duration > STREAMING_MIN_SECONDS:
+        return transcribe_streaming(audio, on_partial, model, progress)
+    return run_inference(audio, model)
+
+def reuse_transcription(job, existing, digest, download_ms):
+    """Store an earlier transcript under this job's message too, returns its text
+
+    Without a row of its own the message would look untranscribed to a
+    backfill and be downloaded again on every run.
+    """
+    if job.message_id is None or job.message_id == existing.message_id:
+        return existing.text
+    job.commit()
+    job.stage = 'saving'
+    try:
+        save_transcription(
+            location_id=job.location_id,
+            contact_id=job.contact_id,
+            conversation_id=job.conversation_id,
+            message_id=job.message_id,
+            attachment_url=job.url,
+            audio_hash=digest,
+            text=existing.text,
+            language=existing.language,
+            duration_seconds=existing.duration_seconds,
+            model=existing.model,
+            download_ms=download_ms,
+            transcribe_ms=0
+        )
+    except Exception as e:
+        print(f"Error saving reused transcription: {str(e)}")
+    return existing.text
+
+def transcribe_job(job, on_partial=None):
+    """Download and transcribe one attachment, returns the transcription text"""
+    # Download the file
+    job.stage = 'downloading'
+    print(f"\nDownloading file from: {job.url}")
+    download_start = time.perf_counter()
+    try:
+        content, audio_format = attachment_client.download(job.url)
+    except DownloadError as e:
+        print(f"Error downloading file: {str(e)}")
+        return None
+    download_ms = int((time.perf_counter() - download_start) * 1000)
+
+    # Reuse an earlier transcript of the exact same audio
+    digest = audio_hash(content)
+    existing = find_by_audio_hash(job.location_id, digest)
+    if existing:
+        print(f"Reusing stored transcription {existing.id} for identical audio")
+        return reuse_transcription(job, existing, digest, download_ms)
+
+    # Decode once to 16 kHz mono PCM (in-process for Ogg Opus, pooled decoders
+    # otherwise), into a shared audio slot when inference runs in other processes
+    job.stage = 'decoding'
+    decode_start = time.perf_counter()
+    try:
+        audio = decode_shared(content, audio_format)
+    except AudioDecodeError as e:
+        print(f"Error decoding {audio_format} audio: {str(e)}")
+        return None
+    metrics.observe(f'decode.seconds.{audio_format}', time.perf_counter() - decode_start)
+
+    try:
+        return transcribe_decoded(job, audio, digest, download_ms, on_partial)
+    finally:
+        release(audio)
+
+def transcribe_decoded(job, audio, digest, download_ms, on_partial=None):
+    """Transcribe and store decoded audio (an array or SharedAudio)"""
+    duration = len(audio) / SAMPLE_RATE
+
+    # Reuse the transcript of a re-encoded copy of the same voice note
+    fingerprint = None
+    if FINGERPRINT_ENABLED:
+        fingerprint = compute_fingerprint(samples(audio))
+        match = fingerprint_index.lookup(job.location_id, fingerprint, duration)
+        if match:
+            transcription_id, score = match
+            existing = get_transcription(transcription_id)
+            if existing:
+                print(f"Reusing stored transcription {existing.id} for near-duplicate audio ({score:.2f})")
+                return reuse_transcription(job, existing, digest, download_ms)
+
+    job.check_cancelled()
+    model = select_model(job, duration)
+    job.stage, job.model = 'transcribing', model
+    print(f"Transcribing {duration:.1f}s of audio with '{model}'")
+    transcribe_start = time.perf_counter()
+    # Shared by the fallback so partials already posted are not posted again
+    progress = StreamProgress()
+    try:
+        result = transcribe_with(model, audio, duration, on_partial, progress)
+    except ModelStoreError as e:
+        fallback = current_default_model()
+        if model == fallback:
+            raise
+        print(f"Model '{model}' unavailable, using '{fallback}': {str(e)}")
+        model = job.model = fallback
+        result = transcribe_with(model, audio, duration, on_partial, progress)
+    transcribe_seconds = time.perf_counter() - transcribe_start
+    transcribe_ms = int(transcribe_seconds * 1000)
+    record_inference(model, duration, transcribe_seconds)
+
+    transcription = result["text"].strip()
+
+    # From here on the job has visible effects and can no longer be cancelled
+    job.commit()
+    job.stage = 'saving'
+    try:
+        saved = save_transcription(
+            location_id=job.location_id,
+            contact_id=job.contact_id,
+            conversation_id=job.conversation_id,
+            message_id=job.message_id,
+            attachment_url=job.url,
+            audio_hash=digest,
+            text=transcription,
+            language=result.get("language"),
+            duration_seconds=duration,
+            model=model,
+            download_ms=download_ms,
+            transcribe_ms=transcribe_ms
+        )
+        if fingerprint is not None:
+            fingerprint_index.add(job.location_id, saved.id, fingerprint, duration)
+    except Exception as e:
+        print(f"Error saving transcription: {str(e)}")
+
+    return transcription
+
+def process_job(job):
+    """Scheduler handler: transcribe a job and deliver the result"""
+    poster = TranscriptPoster(job)
+    on_partial = poster.add if job.deliver and job.conversation_id and job.message_type else None
+    transcription = transcribe_job(job, on_partial=on_partial)
+    if not transcription:
+        print(f"Failed to transcribe {job.url}")
+        job.error = 'Transcription failed'
+        return
+
+    print(f"URL: {job.url}")
+    print(f"Transcription: {transcription}")
+
+    if not job.deliver:
+        return
+
+    job.commit()
+    job.stage = 'delivering'
+    poster.finish(transcription)
+    if job.contact_id and job.location_id:
+        update_contact_transcription(job.location_id, job.contact_id, transcription)
+
+def default_workers():
+    """TRANSCRIPTION_WORKERS if set, else one scheduler thread per inference worker
+
+    More threads than inference workers would only queue inside the pool,
+    where fair sharing and model selection no longer apply.
+    """
+    if inference_pool is None or os.getenv('TRANSCRIPTION_WORKERS'):
+        return TRANSCRIPTION_WORKERS
+    return inference_pool.workers
+
+transcription_scheduler = JobScheduler(process_job, workers=default_workers())
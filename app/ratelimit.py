@@ -0,0 +1,46 @@
+"""
+Token bucket rate limiting for GoHighLevel API calls.
+"""
+
+import os
+import threading
+import time
+
+# GoHighLevel allows 100 requests per 10 seconds per location
+GHL_RATE_LIMIT = float(os.getenv('GHL_RATE_LIMIT', 100))
+GHL_RATE_PERIOD = float(os.getenv('GHL_RATE_PERIOD', 10))
+
+class RateLimiter:
+    """Blocking token bucket keyed by an arbitrary id (e.g. location)"""
+
+    def __init__(self, rate=GHL_RATE_LIMIT, period=GHL_RATE_PERIOD, burst=None):
+        self.rate = rate / period
+        self.capacity = burst or rate
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _take(self, key, now):
+        """Try to take a token, returns the seconds to wait if none is available"""
+        tokens, updated = self._buckets.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - updated) * self.rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate
+
+    def try_acquire(self, key=None):
+        with self._lock:
+            return self._take(key, time.monotonic()) == 0.0
+
+    def acquire(self, key=None):
+        """Block until a token for key is available"""
+        while True:
+            with self._lock:
+                wait = self._take(key, time.monotonic())
+            if wait == 0.0:
+                return
+            time.sleep(wait)
+
+# Shared limiter for all GoHighLevel calls made by this process
+ghl_rate_limiter = RateLimiter()
@@ -1,33 +1,25 @@
 from flask import redirect, request, session, url_for, render_template, jsonify
 from app import app
-from app.database import save_token, get_valid_token, refresh_token, Token, SessionLocal
+from app.database import save_token, get_valid_token, get_token_location, Token, SessionLocal
 import requests
 import json
 import secrets
-import os
-from datetime import datetime, timezone
 from urllib.parse import urlencode
-import whisper
-import tempfile
-from pydub import AudioSegment
-import io
-import httpx
-import ssl
-
-# GoHighLevel API configuration
-API_BASE_URL = 'https://services.leadconnectorhq.com'
-API_VERSION = '2021-07-28'
-GHL_AUTH_URL = 'https://marketplace.gohighlevel.com/oauth/chooselocation'
-GHL_TOKEN_URL = 'https://services.leadconnectorhq.com/oauth/token'
-
-# Load environment variables
-from dotenv import load_dotenv
-load_dotenv()
-
-# Get environment variables
-GHL_CLIENT_ID = os.getenv('GHL_CLIENT_ID')
-GHL_CLIENT_SECRET = os.getenv('GHL_CLIENT_SECRET')
-GHL_REDIRECT_URI = os.getenv('GHL_REDIRECT_URI')
+from app.model_store import unload_models
+from app.inference_pool import inference_pool
+from app.decoder_pool import audio_ring, decoder_pool
+from app.http_client import attachment_client
+from app.outbound import outbound_sender
+from app.transcripts import search_transcriptions, to_dict
+from app.pipeline import ensure_transcription_field, transcription_scheduler
+from app.events import EventValidationError, InstallEvent, loads, parse_event, parse_events
+from app.webhooks import ingest_events, webhook_batcher
+from app.shutdown import is_draining
+from app.location_cache import location_cache
+from app.ghl import (
+    GHL_AUTH_URL, GHL_TOKEN_URL,
+    GHL_CLIENT_ID, GHL_CLIENT_SECRET, GHL_REDIRECT_URI
+)
 
 # Define required scopes
 SCOPES = [
@@ -47,14 +39,19 @@ SCOPES = [
     'contacts.readonly'
 ]
 
-# Initialize Whisper model
-model = whisper.load_model("base")
-
 def cleanup_resources():
     """Cleanup resources when the application shuts down"""
     try:
-        if hasattr(model, 'cleanup'):
-            model.cleanup()
+        transcription_scheduler.stop(timeout=5)
+        if inference_pool is not None:
+            inference_pool.shutdown(wait=False)
+        if decoder_pool is not None:
+            decoder_pool.shutdown()
+        if audio_ring is not None:
+            audio_ring.close()
+        attachment_client.close()
+        outbound_sender.stop(timeout=5)
+        unload_models()
         print("Resources cleaned up successfully")
     except Exception as e:
         print(f"Error cleaning up resources: {str(e)}")
@@ -63,64 +60,12 @@ def cleanup_resources():
 import atexit
 atexit.register(cleanup_resources)
 
-class MessageHandler:
-    @staticmethod
-    def process_attachments(attachments, conversation_id, message_type):
-        """Process attachments from webhook data"""
-        try:
-            transcriptions = []
-            for attachment in attachments:
-                # Handle both string URLs and dictionary attachments
-                if isinstance(attachment, str):
-                    file_url = attachment
-                else:
-                    file_url = attachment.get('url')
-                
-                if not file_url:
-                    print(f"No URL found in attachment: {attachment}")
-                    continue
-                
-                # Download the file
-                print(f"\nDownloading file from: {file_url}")
-                response = requests.get(file_url)
-                if response.status_code != 200:
-                    print(f"Error downloading file: {response.status_code}")
-                    continue
-                
-                # Save to temporary file
-                with tempfile.NamedTemporaryFile(suffix='.mp3', delete=False) as temp_file:
-                    temp_file.write(response.content)
-                    temp_file_path = temp_file.name
-                
-                try:
-                    # Transcribe the audio
-                    print(f"Transcribing audio file: {temp_file_path}")
-                    result = model.transcribe(temp_file_path)
-                    transcription = result["text"]
-                    
-                    transcriptions.append({
-                        'url': file_url,
-                        'transcription': transcription
-                    })
-                    
-                finally:
-                    # Clean up temporary file
-                    os.unlink(temp_file_path)
-            
-            return transcriptions
-            
-        except Exception as e:
-            print(f"Error processing attachments: {str(e)}")
-            import traceback
-            print(f"Traceback: {traceback.format_exc()}")
-            return []
-
 @app.route('/')
 def index():
     """Render the index page"""
     locations = []
     if 'access_token' in session:
-        locations = get_locations()
+        locations = get_locations(session.get('location_id'))
     return render_template('index.html', locations=locations)
 
 @app.route('/login')
@@ -199,6 +144,9 @@ def callback():
         session['refresh_token'] = token_info.get('refresh_token')
         session['location_id'] = location_id
         
+        # Start loading location details before the dashboard is rendered
+        location_cache.warm(location_id)
+        
         print("\n=== TOKEN SAVED ===")
         print(f"Access Token: {token_info['access_token'][:20]}...")
         print(f"Refresh Token: {token_info.get('refresh_token', '')[:20]}...")
@@ -218,184 +166,64 @@ def logout():
     session.clear()
     return redirect(url_for('index'))
 
-def ensure_transcription_field(location_id, access_token):
-    """Ensure the Transcription custom field exists, create it if it doesn't"""
+def handle_install(location_id):
+    """Attach the newest token to an installed location and prepare it"""
+    print(f"\nReceived installation webhook for location: {location_id}")
+    
+    # Update the token with the location ID
+    db = SessionLocal()
     try:
-        # Get the most recent token from database
-        db = SessionLocal()
-        try:
-            token = db.query(Token).filter(Token.is_active == True).order_by(Token.created_at.desc()).first()
-            if not token:
-                print("No active token found")
-                return None
-                
-            if token.is_expired():
-                print("Token is expired")
-                return None
-                
-            # Use the token from database instead of the passed one
-            access_token = token.access_token
-        finally:
-            db.close()
+        # Get the most recent token
+        token = db.query(Token).order_by(Token.created_at.desc()).first()
+        if token:
+            token.location_id = location_id
+            db.commit()
+            print(f"Updated token with location ID: {location_id}")
+            location_cache.warm(location_id)
             
-        # First, check if the field exists
-        url = f"{API_BASE_URL}/locations/{location_id}/customFields"
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Accept": "application/json",
-            "Version": API_VERSION
-        }
-        
-        print(f"\nChecking custom fields at: {url}")
-        print(f"Using token: {access_token[:20]}...")
-        
-        response = requests.get(url, headers=headers)
-        print(f"Response status: {response.status_code}")
-        print(f"Response body: {response.text}")
-        
-        if response.status_code == 200:
-            fields = response.json().get('customFields', [])
-            # Look for our Transcription field
-            transcription_field = next((field for field in fields if field.get('name') == 'Transcription'), None)
-            
-            if transcription_field:
-                print("Transcription field already exists")
-                return transcription_field.get('id')
-            
-            # If we get here, the field doesn't exist, so let's create it
-            print("Creating Transcription field")
-            create_data = {
-                "name": "Transcription",
-                "dataType": "TEXT",
-                "model": "contact",
-                "placeholder": "Transcription of audio messages"
-            }
-            
-            create_response = requests.post(url, headers=headers, json=create_data)
-            if create_response.status_code == 200:
-                new_field = create_response.json()
-                print("Successfully created Transcription field")
-                return new_field.get('id')
-            else:
-                print(f"Error creating field: {create_response.status_code} - {create_response.text}")
-                return None
+            # Ensure transcription field exists
+            access_token = get_valid_token()
+            if access_token:
+                field_id = ensure_transcription_field(location_id, access_token)
+                if field_id:
+                    print(f"Transcription field is ready with ID: {field_id}")
         else:
-            print(f"Error checking fields: {response.status_code} - {response.text}")
-            return None
-            
+            print("No token found to update with location ID")
     except Exception as e:
-        print(f"Error in ensure_transcription_field: {str(e)}")
-        import traceback
-        print(f"Traceback: {traceback.format_exc()}")
-        return None
+        print(f"Error updating token: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def webhook_response(result):
+    """Flask response for one ingest result"""
+    result = dict(result)
+    status = result.pop('status', 200)
+    return jsonify(result), status
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Handle incoming webhooks from GoHighLevel"""
+    if is_draining():
+        # GoHighLevel redelivers to an instance that is not shutting down
+        return jsonify({'error': 'Shutting down'}), 503
     try:
-        data = request.get_json()
-        print("\n=== WEBHOOK DATA ===")
-        print(json.dumps(data, indent=2))
+        try:
+            event = parse_event(loads(request.get_data()))
+        except EventValidationError as e:
+            print(f"Error: invalid webhook: {str(e)}")
+            return jsonify({'error': str(e)}), 400
         
         # Handle installation webhook
-        if data.get('type') == 'INSTALL':
-            location_id = data.get('locationId')
-            if location_id:
-                print(f"\nReceived installation webhook for location: {location_id}")
-                
-                # Update the token with the location ID
-                db = SessionLocal()
-                try:
-                    # Get the most recent token
-                    token = db.query(Token).order_by(Token.created_at.desc()).first()
-                    if token:
-                        token.location_id = location_id
-                        db.commit()
-                        print(f"Updated token with location ID: {location_id}")
-                        
-                        # Ensure transcription field exists
-                        access_token = get_valid_token()
-                        if access_token:
-                            field_id = ensure_transcription_field(location_id, access_token)
-                            if field_id:
-                                print(f"Transcription field is ready with ID: {field_id}")
-                    else:
-                        print("No token found to update with location ID")
-                except Exception as e:
-                    print(f"Error updating token: {str(e)}")
-                    db.rollback()
-                finally:
-                    db.close()
-                
-                return jsonify({'success': True})
+        if isinstance(event, InstallEvent):
+            handle_install(event.location_id)
+            return jsonify({'success': True})
         
-        # Get the message type from the webhook data
-        message_type = data.get('messageType')
-        print(f"\nMessage Type: {message_type}")
+        print(f"\n=== WEBHOOK {event.message_type} conversation={event.conversation_id} "
+              f"message={event.message_id} attachments={len(event.attachments)} ===")
         
-        if not message_type:
-            print("Error: No messageType in webhook data")
-            return jsonify({'error': 'No messageType provided'}), 400
-        
-        # Get conversation ID
-        conversation_id = data.get('conversationId')
-        print(f"Conversation ID: {conversation_id}")
-        
-        if not conversation_id:
-            print("Error: No conversationId in webhook data")
-            return jsonify({'error': 'No conversationId provided'}), 400
-        
-        # Process attachments if present
-        if 'attachments' in data:
-            print(f"\nFound {len(data['attachments'])} attachments")
-            transcriptions = MessageHandler.process_attachments(
-                data['attachments'], 
-                conversation_id,
-                message_type
-            )
-            if transcriptions:
-                print("\nTranscriptions:")
-                for t in transcriptions:
-                    print(f"URL: {t['url']}")
-                    print(f"Transcription: {t['transcription']}")
-                    print("---")
-                    
-                    # Get location ID from token
-                    access_token = get_valid_token()
-                    if access_token:
-                        db = SessionLocal()
-                        try:
-                            token = db.query(Token).filter(Token.is_active == True).order_by(Token.created_at.desc()).first()
-                            if token and token.location_id:
-                                # Ensure transcription field exists
-                                field_id = ensure_transcription_field(token.location_id, access_token)
-                                if field_id:
-                                    # Update contact with transcription
-                                    contact_id = data.get('contactId')
-                                    if contact_id:
-                                        update_url = f"{API_BASE_URL}/contacts/{contact_id}"
-                                        update_data = {
-                                            "customFields": [
-                                                {
-                                                    "id": field_id,
-                                                    "value": t['transcription']
-                                                }
-                                            ]
-                                        }
-                                        headers = {
-                                            "Authorization": f"Bearer {access_token}",
-                                            "Accept": "application/json",
-                                            "Version": API_VERSION
-                                        }
-                                        update_response = requests.put(update_url, headers=headers, json=update_data)
-                                        if update_response.status_code == 200:
-                                            print(f"Successfully updated contact {contact_id} with transcription")
-                                        else:
-                                            print(f"Error updating contact: {update_response.status_code} - {update_response.text}")
-                        finally:
-                            db.close()
-        
-        return jsonify({'success': True})
+        # Grouped with concurrent events into one dedup pass
+        return webhook_response(webhook_batcher.submit(event))
     except Exception as e:
         print(f"Error processing webhook: {str(e)}")
         print(f"Exception type: {type(e)}")
@@ -403,56 +231,80 @@ def webhook():
         print(f"Traceback: {traceback.format_exc()}")
         return jsonify({'error': str(e)}), 500
 
-def get_locations():
-    """Get list of locations from GoHighLevel"""
+@app.route('/webhook/batch', methods=['POST'])
+def webhook_batch():
+    """Handle an array of webhook events in one request"""
+    if is_draining():
+        return jsonify({'error': 'Shutting down'}), 503
     try:
-        access_token = get_valid_token()
-        if not access_token:
-            print("No valid access token found")
-            return []
-            
-        # Get location ID from the token in database
-        db = SessionLocal()
         try:
-            token = db.query(Token).filter(Token.is_active == True).order_by(Token.created_at.desc()).first()
-            if not token or not token.location_id:
-                print("No location ID found in token")
-                return []
-                
-            location_id = token.location_id
-            print(f"\nUsing location ID: {location_id}")
-            
-            # Use the correct endpoint for getting location details
-            url = f"https://services.leadconnectorhq.com/locations/{location_id}"
-            headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Accept": "application/json",
-                "Version": API_VERSION
-            }
-            
-            print(f"\nFetching location details from: {url}")
-            print(f"Headers: {json.dumps({k: v for k, v in headers.items() if k != 'Authorization'}, indent=2)}")
-            
-            response = requests.get(url, headers=headers)
-            print(f"Response status: {response.status_code}")
-            print(f"Response headers: {json.dumps(dict(response.headers), indent=2)}")
-            print(f"Response body: {response.text}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                if 'location' in data:
-                    return [data['location']]  # Return the location object as a list
-                else:
-                    print("No location data in response")
-                    return []
+            data = loads(request.get_data())
+            events = parse_events(data.get('events') if isinstance(data, dict) else data)
+        except EventValidationError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        results = [None] * len(events)
+        message_indexes = []
+        for index, event in enumerate(events):
+            if isinstance(event, EventValidationError):
+                results[index] = {'error': str(event), 'status': 400}
+            elif isinstance(event, InstallEvent):
+                handle_install(event.location_id)
+                results[index] = {'success': True}
             else:
-                print(f"Error getting location: {response.status_code} - {response.text}")
-                return []
-        finally:
-            db.close()
-            
+                message_indexes.append(index)
+        
+        ingested = ingest_events([events[index] for index in message_indexes])
+        for index, result in zip(message_indexes, ingested):
+            results[index] = result
+        print(f"\n=== WEBHOOK BATCH: {len(events)} event(s), "
+              f"{sum(r.get('queued', 0) for r in results)} job(s) queued ===")
+        return jsonify({'results': results})
+    except Exception as e:
+        print(f"Error processing webhook batch: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/transcriptions')
+def list_transcriptions():
+    """Search stored transcriptions of the logged-in location"""
+    location_id = session.get('location_id')
+    if not location_id:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    try:
+        rows, next_cursor = search_transcriptions(
+            location_id,
+            query=request.args.get('q'),
+            contact_id=request.args.get('contact_id'),
+            conversation_id=request.args.get('conversation_id'),
+            cursor=request.args.get('cursor'),
+            limit=request.args.get('limit', 50)
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'transcriptions': [to_dict(row) for row in rows],
+        'next_cursor': next_cursor
+    })
+
+def get_locations(location_id=None):
+    """Get list of locations from the location cache"""
+    try:
+        # Fall back to the location of the most recent token in database
+        location_id = location_id or get_token_location()
+        if not location_id:
+            print("No location ID found in token")
+            return []
+
+        # Only a cold miss waits on GoHighLevel: stale data is served while refreshing
+        location = location_cache.get(location_id)
+        return [location] if location else []
+
     except Exception as e:
         print(f"Error in get_locations: {str(e)}")
         import traceback
         print(f"Traceback: {traceback.format_exc()}")
-        return [] 
\ No newline at end of file
+        return []
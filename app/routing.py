@@ -0,0 +1,122 @@
+"""
+Pre-download routing of webhook attachments.
+
+Each attachment is checked against its location's rule before a job is
+created, so outbound messages, unwanted channels, images, PDFs and oversized
+files never reach the downloader or Whisper. Rules come from ROUTING_RULES,
+a JSON object keyed by location id with a "default" entry, e.g.
+
+    {"default": {"directions": ["inbound"]},
+     "loc_123": {"message_types": ["TYPE_WHATSAPP"], "max_bytes": 20000000}}
+
+Fields missing from a location's rule are taken from the default rule. An
+attachment whose direction, MIME type or size is unknown is let through;
+the downloader still sniffs the bytes and enforces MAX_ATTACHMENT_BYTES.
+"""
+
+import json
+import mimetypes
+import os
+from fnmatch import fnmatch
+from urllib.parse import urlparse
+
+from app import metrics
+from app.http_client import MAX_ATTACHMENT_BYTES
+
+ROUTING_RULES = json.loads(os.getenv('ROUTING_RULES', '{}'))
+
+DEFAULT_RULE = {
+    'directions': ['inbound'],
+    'message_types': None,
+    'mime_types': ['audio/*', 'video/*', 'application/octet-stream', 'application/ogg'],
+    'max_bytes': MAX_ATTACHMENT_BYTES
+}
+
+class RoutingRule:
+    """Which attachments of a location are worth transcribing"""
+
+    __slots__ = ('directions', 'message_types', 'mime_types', 'max_bytes')
+
+    def __init__(self, directions=None, message_types=None, mime_types=None, max_bytes=None):
+        # None means "any"
+        self.directions = set(directions) if directions else None
+        self.message_types = set(message_types) if message_types else None
+        self.mime_types = tuple(mime_types) if mime_types else None
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_config(cls, config, base=None):
+        merged = dict(base or {})
+        merged.update(config or {})
+        return cls(
+            merged.get('directions'),
+            merged.get('message_types'),
+            merged.get('mime_types'),
+            merged.get('max_bytes')
+        )
+
+    def check_message(self, event):
+        """Reason to skip every attachment of the message, or None"""
+        if self.directions and event.direction and event.direction not in self.directions:
+            return 'direction'
+        if self.message_types and event.message_type not in self.message_types:
+            return 'message_type'
+        return None
+
+    def check_attachment(self, attachment):
+        """Reason to skip one attachment, or None"""
+        if self.mime_types:
+            mime_type = attachment_mime_type(attachment)
+            if mime_type and not any(fnmatch(mime_type, pattern) for pattern in self.mime_types):
+                return 'mime_type'
+        if self.max_bytes and attachment.size and attachment.size > self.max_bytes:
+            return 'size'
+        return None
+
+def attachment_mime_type(attachment):
+    """Declared MIME type, else a guess from the URL's file extension"""
+    if attachment.content_type:
+        return attachment.content_type.split(';')[0].strip().lower()
+    mime_type, _ = mimetypes.guess_type(urlparse(attachment.url).path)
+    return mime_type
+
+_default_rule = RoutingRule.from_config(ROUTING_RULES.get('default'), DEFAULT_RULE)
+_location_rules = {
+    location_id: RoutingRule.from_config(config, {**DEFAULT_RULE, **ROUTING_RULES.get('default', {})})
+    for location_id, config in ROUTING_RULES.items()
+    if location_id != 'default'
+}
+
+def rule_for(location_id):
+    return _location_rules.get(location_id, _default_rule)
+
+def route(event, location_id=None):
+    """Attachments of a message event that should be downloaded and transcribed"""
+    if not event.attachments:
+        return []
+    rule = rule_for(location_id or event.location_id)
+    message_reason = rule.check_message(event)
+    accepted = []
+    for attachment in event.attachments:
+        reason = message_reason or rule.check_attachment(attachment)
+        if reason:
+            metrics.incr(f'routing.skipped.{reason}')
+            metrics.incr('routing.skipped_jobs')
+            if attachment.size:
+                metrics.incr('routing.skipped_bytes', int(attachment.size))
+            continue
+        accepted.append(attachment)
+    metrics.incr('routing.accepted_jobs', len(accepted))
+    return accepted
+
+def stats():
+    """Jobs and declared bytes skipped before download, by reason"""
+    return {
+        'accepted_jobs': metrics.counter('routing.accepted_jobs'),
+        'skipped_jobs': metrics.counter('routing.skipped_jobs'),
+        'skipped_bytes': metrics.counter('routing.skipped_bytes'),
+        'skipped_by_reason': {
+            reason: metrics.counter(f'routing.skipped.{reason}')
+            for reason in ('direction', 'message_type', 'mime_type', 'size')
+        }
+    }
@@ -0,0 +1,146 @@
+"""
+Database-backed Flask sessions.
+
+Session rows live in Postgres so any node can serve any browser. Sessions
+carry OAuth tokens, so they stay server-side rather than in signed cookies.
+A read is one primary-key lookup of a small row; a per-process cache in
+front of it would still have to check the row for writes made on other
+nodes, which costs the same lookup, so there is none. Rows are only written
+when the session was modified or is approaching expiry, so most requests do
+no writes at all.
+"""
+
+import json
+import os
+import secrets
+
+from flask.sessions import SessionInterface, SessionMixin
+from sqlalchemy.dialects.postgresql import insert
+from werkzeug.datastructures import CallbackDict
+
+from app.database import SessionLocal, WebSession, get_utc_now
+
+class DatabaseSession(CallbackDict, SessionMixin):
+    """Session dict that tracks modification and carries its id"""
+
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+
+class DatabaseSessionInterface(SessionInterface):
+    """Flask session interface storing sessions in the database"""
+
+    def _fetch(self, sid):
+        """(data, expires_at) of a stored session, or None"""
+        db = SessionLocal()
+        try:
+            row = db.get(WebSession, sid)
+            if row is None:
+                return None
+            return json.loads(row.data), row.expires_at
+        finally:
+            db.close()
+
+    def _write(self, sid, data, expires_at):
+        """Insert or replace a session"""
+        db = SessionLocal()
+        try:
+            stmt = insert(WebSession).values(sid=sid, data=json.dumps(data), expires_at=expires_at)
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=[WebSession.sid],
+                set_={'data': stmt.excluded.data, 'expires_at': stmt.excluded.expires_at}
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+    def _remove(self, sid):
+        db = SessionLocal()
+        try:
+            db.query(WebSession).filter(WebSession.sid == sid).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _load(self, sid, now):
+        stored = self._fetch(sid)
+        if stored is None or stored[1] <= now:
+            return None
+        return stored
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                loaded = self._load(sid, get_utc_now())
+            except Exception as e:
+                print(f"Error loading session: {str(e)}")
+                loaded = None
+            if loaded is not None:
+                data, expires_at = loaded
+                return DatabaseSession(dict(data), sid=sid, expires_at=expires_at)
+        return DatabaseSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            if session.modified and not session.new:
+                self._remove(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = get_utc_now()
+        lifetime = app.permanent_session_lifetime
+        # Extend expiry only once half of the lifetime has elapsed to avoid a write per request
+        needs_touch = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if not (session.modified or session.new or needs_touch):
+            return
+
+        expires_at = now + lifetime
+        self._write(session.sid, dict(session), expires_at)
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
+
+def sweep_expired_sessions():
+    """Scheduled job: delete expired sessions from the database"""
+    now = get_utc_now()
+    db = SessionLocal()
+    try:
+        deleted = db.query(WebSession).filter(WebSession.expires_at <= now).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        print(f"Error sweeping sessions: {str(e)}")
+        db.rollback()
+        deleted = 0
+    finally:
+        db.close()
+    if deleted:
+        print(f"Swept {deleted} expired session(s)")
+
+def schedule_session_sweep(scheduler):
+    """Register the expired-session sweep on an APScheduler instance"""
+    scheduler.add_job(
+        id='sweep_sessions',
+        func=sweep_expired_sessions,
+        trigger='interval',
+        minutes=int(os.getenv('SESSION_SWEEP_INTERVAL_MINUTES', 15)),
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
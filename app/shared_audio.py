@@ -0,0 +1,255 @@
+"""
+Ring of shared-memory PCM buffers passed between processes by handle.
+
+Without it, decoded audio is pickled through a pipe from the decoder worker
+to the pipeline and again to the inference worker, about 38 MB each way for a
+10-minute clip. With the ring, the decoder worker writes float32 PCM straight
+into a slot (a memory-mapped file under SHARED_AUDIO_DIR, /dev/shm by
+default). The inference worker maps the same file and reads the samples in
+place from an AudioHandle (path, offset, length), which pickles to a few
+bytes.
+
+Slots are leased and reference-counted. The pipeline holds one reference for
+the clip, each streaming window takes another, and the slot goes back to the
+ring when the last reference is released. Slot files are fully allocated
+when first used, so a full tmpfs makes the ring fall back to pickling instead
+of crashing a writer with SIGBUS. It also falls back for clips longer than
+SHARED_AUDIO_SLOT_SECONDS and when every slot stays busy for
+SHARED_AUDIO_WAIT.
+"""
+
+import mmap
+import os
+import tempfile
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+from app import metrics
+from app.audio import SAMPLE_RATE
+
+# 'auto' enables the ring when decoding or inference runs in worker processes
+SHARED_AUDIO = os.getenv('SHARED_AUDIO', 'auto').lower()
+SHARED_AUDIO_SLOTS = int(os.getenv('SHARED_AUDIO_SLOTS', 4))
+SHARED_AUDIO_SLOT_SECONDS = float(os.getenv('SHARED_AUDIO_SLOT_SECONDS', 600))
+SHARED_AUDIO_WAIT = float(os.getenv('SHARED_AUDIO_WAIT', 0.5))
+SHARED_AUDIO_DIR = os.getenv(
+    'SHARED_AUDIO_DIR', '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+)
+FILE_PREFIX = 'iaoff-pcm-'
+ITEM_SIZE = np.dtype(np.float32).itemsize
+
+class AudioHandle(namedtuple('AudioHandle', 'path offset length')):
+    """Picklable reference to float32 samples in a slot file (offset and length in samples)"""
+    __slots__ = ()
+
+# Slot files mapped by this process, by path
+_mapped = {}
+_mapped_lock = threading.Lock()
+
+def _map(path):
+    with _mapped_lock:
+        mapped = _mapped.get(path)
+        if mapped is None:
+            fd = os.open(path, os.O_RDWR)
+            try:
+                mapped = _mapped[path] = mmap.mmap(fd, 0)
+            finally:
+                os.close(fd)
+        return mapped
+
+def attach(handle):
+    """Float32 view of a handle's samples, without copying; works in any process"""
+    return np.frombuffer(_map(handle.path), dtype=np.float32, count=handle.length,
+                         offset=handle.offset * ITEM_SIZE)
+
+class SharedAudio:
+    """One reference to a window of a leased slot"""
+
+    __slots__ = ('ring', 'slot', 'handle', '_released')
+
+    def __init__(self, ring, slot, handle):
+        self.ring = ring
+        self.slot = slot
+        self.handle = handle
+        self._released = False
+
+    @property
+    def array(self):
+        return attach(self.handle)
+
+    def __len__(self):
+        return self.handle.length
+
+    def truncate(self, length):
+        """Shrink to the samples actually written"""
+        self.handle = self.handle._replace(length=min(int(length), self.handle.length))
+
+    def window(self, start, stop):
+        """A new reference to samples [start, stop) of this window"""
+        start = max(0, min(int(start), len(self)))
+        stop = max(start, min(int(stop), len(self)))
+        self.ring._retain(self.slot)
+        return SharedAudio(self.ring, self.slot, self.handle._replace(
+            offset=self.handle.offset + start, length=stop - start
+        ))
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.ring._release(self.slot)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AudioRing:
+    """Fixed number of slot files, each leased to one clip at a time"""
+
+    def __init__(self, slots=SHARED_AUDIO_SLOTS, slot_seconds=SHARED_AUDIO_SLOT_SECONDS,
+                 directory=SHARED_AUDIO_DIR):
+        self.slots = slots
+        self.slot_samples = int(slot_seconds * SAMPLE_RATE)
+        self.directory = directory
+        self._paths = [None] * slots
+        self._refs = [0] * slots
+        self._free = list(range(slots))
+        self._cond = threading.Condition()
+        self._closed = False
+        remove_stale_files(directory)
+
+    def _allocate(self, slot):
+        """Path of a slot's file, created and allocated on first use; None if there is no room"""
+        if self._paths[slot] is not None:
+            return self._paths[slot]
+        path = os.path.join(self.directory, f"{FILE_PREFIX}{os.getpid()}-{slot}")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, self.slot_samples * ITEM_SIZE)
+            else:
+                os.ftruncate(fd, self.slot_samples * ITEM_SIZE)
+        except OSError as e:
+            os.close(fd)
+            os.unlink(path)
+            print(f"Could not allocate shared audio slot in {self.directory}: {str(e)}")
+            return None
+        os.close(fd)
+        self._paths[slot] = path
+        return path
+
+    def _fallback(self, reason):
+        metrics.incr(f'shared_audio.fallback.{reason}')
+        return None
+
+    def lease(self, length=None, timeout=SHARED_AUDIO_WAIT):
+        """Slot for up to length samples (default: a whole slot), or None to fall back to pickling"""
+        if length is not None and length > self.slot_samples:
+            return self._fallback('too_long')
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._free or self._closed, timeout) or self._closed:
+                return self._fallback('busy')
+            slot = self._free.pop()
+            self._refs[slot] = 1
+        # The slot is ours alone, so its file can be set up outside the lock
+        path = self._allocate(slot)
+        if path is None:
+            self._release(slot)
+            return self._fallback('no_space')
+        metrics.incr('shared_audio.leases')
+        return SharedAudio(self, slot, AudioHandle(path, 0, self.slot_samples if length is None else length))
+
+    def put(self, audio):
+        """Copy an array into a new lease, or None when no slot can take it"""
+        shared = self.lease(len(audio))
+        if shared is not None:
+            shared.array[:] = audio
+        return shared
+
+    def _retain(self, slot):
+        with self._cond:
+            self._refs[slot] += 1
+
+    def _release(self, slot):
+        with self._cond:
+            self._refs[slot] -= 1
+            if self._refs[slot] == 0:
+                self._free.append(slot)
+                self._cond.notify()
+
+    def close(self):
+        """Remove the slot files; workers keep their existing mappings"""
+        with self._cond:
+            self._closed = True
+            paths, self._paths = self._paths, [None] * self.slots
+            self._cond.notify_all()
+        for path in paths:
+            if path is not None:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'slot_seconds': self.slot_samples / SAMPLE_RATE,
+                'allocated': sum(path is not None for path in self._paths),
+                'in_use': self.slots - len(self._free),
+                'leases': metrics.counter('shared_audio.leases'),
+                'fallbacks': {
+                    reason: metrics.counter(f'shared_audio.fallback.{reason}')
+                    for reason in ('too_long', 'busy', 'no_space')
+                }
+            }
+
+def remove_stale_files(directory):
+    """Delete slot files left behind by processes that no longer exist"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith(FILE_PREFIX):
+            continue
+        try:
+            pid = int(name[len(FILE_PREFIX):].split('-')[0])
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+        except (ValueError, PermissionError):
+            continue
+
+def samples(audio):
+    """The float32 array behind audio that may be shared"""
+    return audio.array if isinstance(audio, SharedAudio) else audio
+
+def window(audio, start, stop):
+    """Samples [start, stop); a shared window is a new reference to release"""
+    if isinstance(audio, SharedAudio):
+        return audio.window(start, stop)
+    return audio[start:stop]
+
+def release(audio):
+    if isinstance(audio, SharedAudio):
+        audio.release()
+
+def to_payload(audio):
+    """What to send to another process: the handle of shared audio, else the array"""
+    return audio.handle if isinstance(audio, SharedAudio) else audio
+
+def from_payload(payload):
+    return attach(payload) if isinstance(payload, AudioHandle) else payload
+
+def create_default_ring(process_pools):
+    """Ring configured from the environment, or None to pass arrays"""
+    if SHARED_AUDIO in ('', '0', 'false', 'no') or (SHARED_AUDIO == 'auto' and not process_pools):
+        return None
+    return AudioRing()
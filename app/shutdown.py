@@ -0,0 +1,80 @@
+"""
+Graceful shutdown: drain in-flight work before the process exits.
+
+On SIGTERM the process stops taking new work (webhooks answer 503 so
+GoHighLevel redelivers them to another instance, and the queue worker stops
+claiming), lets running transcriptions finish until DRAIN_TIMEOUT, and hands
+the rest back to the durable job queue, where the next process to start picks
+it up: everything still queued, and running jobs that are cancelled before
+they saved or posted anything. A running job that already started delivering
+is never checkpointed, so no transcript is posted twice. Due GoHighLevel
+updates are delivered in the remaining time (anything left stays in
+outbound_updates) and a final metrics snapshot is written.
+
+Signal handlers should only request a shutdown; the main thread then calls
+drain() and returns normally.
+"""
+
+import json
+import os
+import threading
+import time
+
+from app import metrics
+from app.job_queue import checkpoint_jobs
+from app.outbound import outbound_sender
+from app.pipeline import transcription_scheduler
+from app.webhooks import WEBHOOK_BATCH_TIMEOUT, webhook_batcher
+
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', 60))
+# Part of DRAIN_TIMEOUT kept for checkpointing and outbound updates
+DRAIN_FLUSH_SECONDS = float(os.getenv('DRAIN_FLUSH_SECONDS', 10))
+METRICS_SNAPSHOT_PATH = os.getenv('METRICS_SNAPSHOT_PATH')
+
+_draining = threading.Event()
+_drain_lock = threading.Lock()
+
+def is_draining():
+    return _draining.is_set()
+
+def flush_metrics(path=METRICS_SNAPSHOT_PATH):
+    """Write the final metrics snapshot to path, if configured"""
+    if not path:
+        return
+    try:
+        with open(path, 'w') as f:
+            json.dump(metrics.snapshot(), f, indent=2, default=str)
+        print(f"Metrics snapshot written to {path}")
+    except OSError as e:
+        print(f"Error writing metrics snapshot: {str(e)}")
+
+def drain(queue_worker=None, timeout=DRAIN_TIMEOUT):
+    """Stop accepting work, finish or checkpoint jobs, flush updates and metrics"""
+    with _drain_lock:
+        if _draining.is_set():
+            return
+        _draining.set()
+
+    start = time.monotonic()
+    deadline = start + timeout
+    print(f"Draining: waiting up to {timeout:.0f}s for in-flight transcriptions")
+
+    if queue_worker is not None:
+        queue_worker.stop(timeout=max(0.0, deadline - time.monotonic()))
+    webhook_batcher.stop(timeout=WEBHOOK_BATCH_TIMEOUT)
+
+    undone = transcription_scheduler.drain(max(0.0, deadline - DRAIN_FLUSH_SECONDS - time.monotonic()))
+    if queue_worker is not None:
+        queue_worker.finish()
+    if undone:
+        try:
+            checkpointed = checkpoint_jobs(undone)
+            print(f"Checkpointed {checkpointed} of {len(undone)} unfinished job(s) to the job queue")
+        except Exception as e:
+            print(f"Error checkpointing {len(undone)} unfinished job(s): {str(e)}")
+
+    outbound_sender.stop(timeout=max(1.0, deadline - time.monotonic()), flush=True)
+
+    metrics.observe('shutdown.drain_seconds', time.monotonic() - start)
+    flush_metrics()
+    print(f"Drain finished in {time.monotonic() - start:.1f}s")
@@ -0,0 +1,242 @@
+"""
+Proactive OAuth token refresh.
+
+Every node runs the same scheduled job, but each location's refresh is guarded
+by a lease row in token_refresh_leases so exactly one node performs the
+exchange. The lease is taken and released in short transactions: no database
+connection is held across the HTTP exchange, and the new token is committed
+as soon as GoHighLevel returns it, because the old refresh token is already
+spent by then. Tokens are refreshed ahead of Token.needs_refresh() with a
+per-token jitter so a fleet of locations installed together does not refresh
+in lockstep.
+Due locations are refreshed concurrently, at most TOKEN_REFRESH_CONCURRENCY at
+a time, over the pooled GoHighLevel session; transient exchange failures are
+retried. A location whose token has already expired can also be refreshed on
+demand with get_fresh_token.
+"""
+
+import os
+import random
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from sqlalchemy.dialects.postgresql import insert
+
+from app import metrics
+from app.database import (
+    SessionLocal, Token, TokenRefreshLease, get_location_token, get_utc_now, get_valid_token, store_refreshed_token
+)
+from app.ghl import exchange_refresh_token
+
+# Refresh scheduler configuration
+REFRESH_INTERVAL_SECONDS = int(os.getenv('TOKEN_REFRESH_INTERVAL', 300))
+REFRESH_AHEAD_SECONDS = int(os.getenv('TOKEN_REFRESH_AHEAD', 3600))
+REFRESH_JITTER_SECONDS = int(os.getenv('TOKEN_REFRESH_JITTER', 900))
+REFRESH_CONCURRENCY = int(os.getenv('TOKEN_REFRESH_CONCURRENCY', 8))
+REFRESH_RETRIES = int(os.getenv('TOKEN_REFRESH_RETRIES', 2))
+# Must outlast every exchange attempt (REFRESH_RETRIES + 1 requests and backoff)
+REFRESH_LEASE_SECONDS = int(os.getenv('TOKEN_REFRESH_LEASE', 300))
+# Attempts to commit a token GoHighLevel has already issued
+STORE_RETRIES = int(os.getenv('TOKEN_STORE_RETRIES', 3))
+
+def acquire_lease(location_id):
+    """Take a location's refresh lease; returns the holder id, or None while another holds it"""
+    holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    now = get_utc_now()
+    stmt = insert(TokenRefreshLease).values(
+        location_id=location_id, holder=holder, expires_at=now + timedelta(seconds=REFRESH_LEASE_SECONDS)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TokenRefreshLease.location_id],
+        set_={'holder': stmt.excluded.holder, 'expires_at': stmt.excluded.expires_at},
+        where=TokenRefreshLease.expires_at < now
+    ).returning(TokenRefreshLease.holder)
+    db = SessionLocal()
+    try:
+        taken = db.execute(stmt).scalar()
+        db.commit()
+    finally:
+        db.close()
+    return holder if taken == holder else None
+
+def release_lease(location_id, holder):
+    db = SessionLocal()
+    try:
+        db.query(TokenRefreshLease).filter(
+            TokenRefreshLease.location_id == location_id, TokenRefreshLease.holder == holder
+        ).delete(synchronize_session=False)
+        db.commit()
+    except Exception as e:
+        # It expires on its own
+        print(f"Error releasing token refresh lease for {location_id}: {str(e)}")
+        db.rollback()
+    finally:
+        db.close()
+
+def read_location_token(location_id):
+    """Latest active token of a location, detached from its session"""
+    db = SessionLocal()
+    try:
+        token = get_location_token(db, location_id)
+        if token is not None:
+            db.expunge(token)
+        return token
+    finally:
+        db.close()
+
+def store_token(location_id, token_info):
+    """Commit a newly issued token, retrying: it cannot be obtained again"""
+    for attempt in range(STORE_RETRIES):
+        db = SessionLocal()
+        try:
+            token = store_refreshed_token(db, token_info, location_id)
+            db.commit()
+            db.refresh(token)
+            db.expunge(token)
+            return token
+        except Exception as e:
+            db.rollback()
+            if attempt == STORE_RETRIES - 1:
+                print(f"❌ Could not store the refreshed token for {location_id}, the location must reconnect: {str(e)}")
+                raise
+            metrics.incr('token_refresh.store_retried')
+            time.sleep(2 ** attempt)
+        finally:
+            db.close()
+
+def refresh_deadline(token):
+    """Time after which a token should be refreshed, including its jitter"""
+    # Seeded by token id so every node computes the same deadline
+    jitter = random.Random(token.id).uniform(0, REFRESH_JITTER_SECONDS)
+    return token.expires_at - timedelta(seconds=REFRESH_AHEAD_SECONDS + jitter)
+
+def is_due(token, now=None):
+    """Check whether a token is inside its refresh window"""
+    if not token.expires_at:
+        return True
+    return (now or get_utc_now()) >= refresh_deadline(token)
+
+def find_due_locations():
+    """Return location ids whose latest active token is due, in one query"""
+    horizon = get_utc_now() + timedelta(seconds=REFRESH_AHEAD_SECONDS + REFRESH_JITTER_SECONDS)
+    db = SessionLocal()
+    try:
+        latest = (
+            db.query(Token)
+            .filter(Token.is_active == True, Token.location_id.isnot(None))
+            .order_by(Token.location_id, Token.created_at.desc())
+            .distinct(Token.location_id)
+            .subquery()
+        )
+        tokens = (
+            db.query(Token)
+            .join(latest, Token.id == latest.c.id)
+            .filter((Token.expires_at == None) | (Token.expires_at <= horizon))
+            .all()
+        )
+        now = get_utc_now()
+        return [token.location_id for token in tokens if is_due(token, now)]
+    finally:
+        db.close()
+
+def _is_transient(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and (response.status_code == 429 or response.status_code >= 500)
+
+def exchange_with_retry(refresh_token):
+    """Refresh grant with retries for network errors, 429 and 5xx"""
+    for attempt in range(REFRESH_RETRIES + 1):
+        start = time.perf_counter()
+        try:
+            token_info = exchange_refresh_token(refresh_token)
+            metrics.observe('token_refresh.exchange_seconds', time.perf_counter() - start)
+            return token_info
+        except requests.RequestException as e:
+            metrics.observe('token_refresh.exchange_seconds', time.perf_counter() - start)
+            if attempt == REFRESH_RETRIES or not _is_transient(e):
+                raise
+            metrics.incr('token_refresh.retried')
+            time.sleep(2 ** attempt)
+
+def refresh_location(location_id):
+    """Refresh one location's token if this node wins its lease
+
+    Returns the new Token, or None when skipped or failed.
+    """
+    holder = None
+    try:
+        holder = acquire_lease(location_id)
+        if holder is None:
+            print(f"Token refresh for {location_id} is held by another node, skipping")
+            metrics.incr('token_refresh.skipped')
+            return None
+
+        # Read under the lease: another node may have just refreshed it
+        token = read_location_token(location_id)
+        if not token or not token.refresh_token:
+            print(f"No refreshable token for location {location_id}")
+            return None
+        if not is_due(token):
+            return None
+
+        start = time.perf_counter()
+        token_info = exchange_with_retry(token.refresh_token)
+        # Old tokens are retired and the new one added in the same transaction
+        new_token = store_token(location_id, token_info)
+        metrics.incr('token_refresh.ok')
+        metrics.observe('token_refresh.seconds', time.perf_counter() - start)
+        print(f"✅ Refreshed token for location {location_id}, expires at {new_token.expires_at.isoformat()}")
+        return new_token
+    except Exception as e:
+        metrics.incr('token_refresh.failed')
+        print(f"❌ Error refreshing token for location {location_id}: {str(e)}")
+        return None
+    finally:
+        if holder is not None:
+            release_lease(location_id, holder)
+
+def refresh_due_tokens():
+    """Scheduled job: refresh every location whose token is due"""
+    print("\n=== TOKEN REFRESH STARTED ===")
+    try:
+        due = find_due_locations()
+        print(f"{len(due)} location(s) due for token refresh")
+        if due:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=min(REFRESH_CONCURRENCY, len(due)), thread_name_prefix='token-refresh') as executor:
+                refreshed = sum(1 for token in executor.map(refresh_location, due) if token)
+            metrics.observe('token_refresh.cycle_seconds', time.perf_counter() - start)
+            print(f"Refreshed {refreshed}/{len(due)} token(s) in {time.perf_counter() - start:.1f}s")
+    except Exception as e:
+        print(f"❌ Token refresh error: {str(e)}")
+        import traceback
+        print(f"Traceback: {traceback.format_exc()}")
+    print("=== TOKEN REFRESH COMPLETED ===\n")
+
+def get_fresh_token(location_id):
+    """Valid access token for a location, refreshing it now if it has expired"""
+    access_token = get_valid_token(location_id)
+    if access_token or not location_id:
+        return access_token
+    metrics.incr('token_refresh.on_demand')
+    token = refresh_location(location_id)
+    return token.access_token if token else get_valid_token(location_id)
+
+def schedule_token_refresh(scheduler):
+    """Register the refresh job on an APScheduler instance"""
+    scheduler.add_job(
+        id='refresh_tokens',
+        func=refresh_due_tokens,
+        trigger='interval',
+        seconds=REFRESH_INTERVAL_SECONDS,
+        jitter=max(1, REFRESH_INTERVAL_SECONDS // 10),
+        max_instances=1,
+        coalesce=True,
+        replace_existing=True
+    )
@@ -0,0 +1,126 @@
+"""
+Transcription store and keyset-paginated search.
+"""
+
+import base64
+import hashlib
+from datetime import datetime
+
+from sqlalchemy import func, tuple_
+
+from app.database import SessionLocal, Transcription
+
+MAX_PAGE_SIZE = 200
+
+def audio_hash(content):
+    """SHA256 of the raw audio bytes, used to avoid re-transcribing"""
+    return hashlib.sha256(content).hexdigest()
+
+def to_dict(transcription):
+    """Serialize a Transcription for API responses"""
+    return {
+        'id': transcription.id,
+        'location_id': transcription.location_id,
+        'contact_id': transcription.contact_id,
+        'conversation_id': transcription.conversation_id,
+        'message_id': transcription.message_id,
+        'attachment_url': transcription.attachment_url,
+        'audio_hash': transcription.audio_hash,
+        'text': transcription.text,
+        'language': transcription.language,
+        'duration_seconds': transcription.duration_seconds,
+        'model': transcription.model,
+        'download_ms': transcription.download_ms,
+        'transcribe_ms': transcription.transcribe_ms,
+        'created_at': transcription.created_at.isoformat() if transcription.created_at else None
+    }
+
+def save_transcription(**fields):
+    """Insert a transcription row and return it"""
+    db = SessionLocal()
+    try:
+        transcription = Transcription(**fields)
+        db.add(transcription)
+        db.commit()
+        db.refresh(transcription)
+        return transcription
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def find_by_audio_hash(location_id, digest):
+    """Most recent transcription of identical audio in a location, or None"""
+    db = SessionLocal()
+    try:
+        return (
+            db.query(Transcription)
+            .filter(Transcription.location_id == location_id, Transcription.audio_hash == digest)
+            .order_by(Transcription.created_at.desc())
+            .first()
+        )
+    finally:
+        db.close()
+
+def get_transcription(transcription_id):
+    """Transcription by id, or None"""
+    db = SessionLocal()
+    try:
+        return db.get(Transcription, transcription_id)
+    finally:
+        db.close()
+
+def transcribed_message_ids(location_id, message_ids):
+    """Subset of message ids that already have a stored transcription"""
+    if not message_ids:
+        return set()
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(Transcription.message_id)
+            .filter(Transcription.location_id == location_id, Transcription.message_id.in_(list(message_ids)))
+            .distinct()
+            .all()
+        )
+        return {row[0] for row in rows}
+    finally:
+        db.close()
+
+def encode_cursor(transcription):
+    raw = f"{transcription.created_at.isoformat()}|{transcription.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    """Decode an opaque page cursor, raising ValueError if malformed"""
+    try:
+        created_at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def search_transcriptions(location_id, query=None, contact_id=None, conversation_id=None, cursor=None, limit=50):
+    """Page through a location's transcriptions, newest first
+
+    Uses keyset pagination on (created_at, id) so every page costs the same
+    regardless of depth. Returns (rows, next_cursor).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    db = SessionLocal()
+    try:
+        q = db.query(Transcription).filter(Transcription.location_id == location_id)
+        if contact_id:
+            q = q.filter(Transcription.contact_id == contact_id)
+        if conversation_id:
+            q = q.filter(Transcription.conversation_id == conversation_id)
+        if query:
+            q = q.filter(Transcription.search_vector.op('@@')(func.websearch_to_tsquery('simple', query)))
+        if cursor:
+            created_at, row_id = decode_cursor(cursor)
+            q = q.filter(tuple_(Transcription.created_at, Transcription.id) < tuple_(created_at, row_id))
+
+        rows = q.order_by(Transcription.created_at.desc(), Transcription.id.desc()).limit(limit + 1).all()
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+    finally:
+        db.close()
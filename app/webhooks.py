@@ -0,0 +1,169 @@
+"""
+Batched webhook ingestion.
+
+Validated message events (see app.events) are turned into transcription jobs
+and deduplicated against redeliveries with a single INSERT ... ON CONFLICT DO
+NOTHING RETURNING for the whole batch, so per-event cost is a fraction of a
+database round trip. Events posted to /webhook/batch arrive already grouped;
+single /webhook events are grouped by WebhookBatcher over a window of a few
+milliseconds before being ingested the same way. Deduplication goes through
+the durable queue in app.job_queue, so a job is only accepted once its row is
+committed. On web nodes (PROCESS_ROLE=web) the rows are left for worker nodes.
+Otherwise they are inserted as running on this process and handed to the
+in-process scheduler, and if the process dies before finishing them the rows'
+leases expire and they are run again.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+from app import metrics
+from app.database import get_token_location
+from app.job_queue import PROCESS_ROLE, QueueWorker, dedup_key, enqueue_jobs
+from app.pipeline import build_jobs, transcription_scheduler
+from app.routing import route
+
+WEBHOOK_BATCH_WINDOW_MS = float(os.getenv('WEBHOOK_BATCH_WINDOW_MS', 5))
+WEBHOOK_BATCH_MAX = int(os.getenv('WEBHOOK_BATCH_MAX', 500))
+WEBHOOK_BATCH_TIMEOUT = float(os.getenv('WEBHOOK_BATCH_TIMEOUT', 10))
+
+# Completes jobs accepted by this process and, in run.py, resumes jobs left
+# in the durable queue by a previous process
+queue_worker = QueueWorker(transcription_scheduler)
+
+def claim_jobs(jobs):
+    """Keep only jobs not seen before, recording them durably in one round trip
+
+    Jobs are inserted into the durable queue as running on this process
+    before they are accepted, so a crash cannot lose an accepted job. If the
+    database is unavailable every job is kept, without durability:
+    transcribing a redelivered attachment twice is better than dropping a
+    new one.
+    """
+    keyed = {}
+    for job in jobs:
+        keyed.setdefault(dedup_key(job), job)
+    if not keyed:
+        return []
+    try:
+        claimed = enqueue_jobs(list(keyed.values()), claim=True)
+    except Exception as e:
+        print(f"Error deduplicating webhook batch, accepting all {len(keyed)} job(s): {str(e)}")
+        return list(keyed.values())
+    queue_worker.adopt(claimed)
+    return claimed
+
+def ingest_events(events):
+    """Deduplicate and enqueue validated MessageEvents; one result per event"""
+    jobs_by_event = []
+    skipped_by_event = []
+    fallback_location = None
+
+    for event in events:
+        location_id = event.location_id
+        if not location_id and event.attachments:
+            # Looked up once per batch rather than once per event
+            if fallback_location is None:
+                fallback_location = get_token_location() or ''
+            location_id = fallback_location or None
+        # Drop outbound messages, unwanted channels and non-audio before any download
+        attachments = route(event, location_id)
+        skipped_by_event.append(len(event.attachments) - len(attachments))
+        jobs_by_event.append(build_jobs(
+            attachments,
+            event.conversation_id,
+            event.message_type,
+            location_id=location_id,
+            contact_id=event.contact_id,
+            message_id=event.message_id
+        ))
+
+    all_jobs = [job for jobs in jobs_by_event for job in jobs]
+    if PROCESS_ROLE == 'web':
+        # Durable queue: dedup and enqueue are the same statement, workers run the jobs
+        claimed = set(map(id, enqueue_jobs(all_jobs)))
+    else:
+        claimed = set(map(id, claim_jobs(all_jobs)))
+    results = []
+    for jobs, skipped in zip(jobs_by_event, skipped_by_event):
+        queued = 0
+        for job in jobs:
+            if id(job) in claimed:
+                if PROCESS_ROLE != 'web':
+                    transcription_scheduler.submit(job)
+                queued += 1
+        results.append({'success': True, 'queued': queued, 'duplicates': len(jobs) - queued, 'skipped': skipped})
+
+    metrics.incr('webhook.events', len(events))
+    metrics.incr('webhook.jobs_queued', len(claimed))
+    metrics.incr('webhook.duplicates', len(all_jobs) - len(claimed))
+    metrics.observe('webhook.batch_size', len(events))
+    return results
+
+class WebhookBatcher:
+    """Groups single webhook events over a short window into one ingest call"""
+
+    def __init__(self, window_ms=WEBHOOK_BATCH_WINDOW_MS, max_size=WEBHOOK_BATCH_MAX):
+        self.window = window_ms / 1000.0
+        self.max_size = max_size
+        self._pending = []
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def submit(self, event, timeout=WEBHOOK_BATCH_TIMEOUT):
+        """Ingest one MessageEvent as part of the next batch and return its result"""
+        with self._cond:
+            stopping = self._stopping
+            if not stopping:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='webhook-batcher', daemon=True)
+                    self._thread.start()
+                future = Future()
+                self._pending.append((event, future))
+                self._cond.notify()
+        if stopping:
+            return ingest_events([event])[0]
+        return future.result(timeout=timeout)
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._pending:
+                if self._stopping:
+                    return None
+                self._cond.wait()
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_size]
+            self._pending = self._pending[self.max_size:]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                results = ingest_events([event for event, _ in batch])
+            except Exception as e:
+                print(f"Error ingesting webhook batch: {str(e)}")
+                results = [{'error': str(e), 'status': 500}] * len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stop(self, timeout=None):
+        """Ingest events already submitted, then stop; later events are ingested inline"""
+        with self._cond:
+            self._stopping = True
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+
+webhook_batcher = WebhookBatcher()
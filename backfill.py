@@ -0,0 +1,29 @@
+import argparse
+import sys
+from app.backfill import BACKFILL_MAX_PENDING, Backfill, BackfillError
+
+def main():
+    """Transcribe historical voice notes of a location's conversations"""
+    parser = argparse.ArgumentParser(description="Backfill transcriptions for past conversations")
+    parser.add_argument('location_ids', nargs='+', help="GoHighLevel location ids to backfill")
+    parser.add_argument('--max-pending', type=int, default=BACKFILL_MAX_PENDING,
+                        help="Maximum transcription jobs outstanding at once")
+    parser.add_argument('--reset', action='store_true', help="Ignore any checkpoint and start over")
+    args = parser.parse_args()
+
+    failed = 0
+    try:
+        for location_id in args.location_ids:
+            try:
+                Backfill(location_id, max_pending=args.max_pending).run(reset=args.reset)
+            except BackfillError as e:
+                # Checkpointed up to the failing conversation; rerun to retry it
+                print(f"Backfill for {location_id} paused: {str(e)}")
+                failed += 1
+    except KeyboardInterrupt:
+        print("\nBackfill interrupted, progress is checkpointed")
+        return 130
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+"""
+Compare per-clip decode latency of the native Opus path against ffmpeg.
+
+Usage:
+    python benchmarks/bench_decode.py voice_note.ogg [more.ogg ...] --runs 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.audio import SAMPLE_RATE, decode_opus, decode_with_ffmpeg, opuslib, sniff_audio_format  # noqa: E402
+
+def measure(decode, content, runs):
+    timings = []
+    samples = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        samples = decode(content)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return samples, timings
+
+def summarize(name, timings):
+    p95 = timings[min(len(timings) - 1, int(0.95 * len(timings)))]
+    print(f"  {name:<8} median {statistics.median(timings) * 1000:8.2f} ms   p95 {p95 * 1000:8.2f} ms")
+    return statistics.median(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="Ogg Opus files (e.g. WhatsApp voice notes)")
+    parser.add_argument('--runs', type=int, default=20, help="Decodes per file and decoder")
+    args = parser.parse_args()
+
+    if opuslib is None:
+        print("opuslib/libopus is not available: only the ffmpeg path can be measured")
+
+    for path in args.files:
+        with open(path, 'rb') as f:
+            content = f.read()
+        audio_format = sniff_audio_format(content[:64])
+        print(f"{path}: {audio_format}, {len(content)} bytes")
+
+        ffmpeg_samples, ffmpeg_timings = measure(lambda c: decode_with_ffmpeg(c, audio_format), content, args.runs)
+        print(f"  duration {len(ffmpeg_samples) / SAMPLE_RATE:.2f}s")
+        ffmpeg_median = summarize('ffmpeg', ffmpeg_timings)
+
+        if opuslib is not None and audio_format == 'opus':
+            native_samples, native_timings = measure(decode_opus, content, args.runs)
+            native_median = summarize('native', native_timings)
+            drift = abs(len(native_samples) - len(ffmpeg_samples)) / SAMPLE_RATE
+            print(f"  speedup {ffmpeg_median / native_median:.1f}x, length difference {drift * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
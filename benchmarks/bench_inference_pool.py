@@ -0,0 +1,95 @@
+"""
+Find the best workers x threads split of the inference pool for this host.
+
+Usage:
+    python benchmarks/bench_inference_pool.py --audio sample.ogg --clips 16
+    python benchmarks/bench_inference_pool.py --seconds 20 --splits 1x8,2x4,4x2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.inference_pool import InferencePool, physical_cores  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+def load_audio(path, seconds):
+    if path:
+        import whisper
+        return whisper.load_audio(path)
+    # Synthetic speech-band signal: a few tones plus noise
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = 0.1 * np.sin(2 * np.pi * 220 * t) + 0.05 * np.sin(2 * np.pi * 440 * t)
+    return (signal + 0.01 * np.random.randn(len(t))).astype(np.float32)
+
+def candidate_splits(cores):
+    splits = []
+    for workers in range(1, cores + 1):
+        if cores % workers == 0:
+            splits.append((workers, cores // workers))
+    return splits
+
+def run_split(workers, threads, audio, clips, model):
+    pool = InferencePool(workers, threads)
+    try:
+        # Warm up: every worker loads its model before timing starts
+        for future in [pool.submit(audio[:SAMPLE_RATE], model) for _ in range(workers)]:
+            future.result()
+
+        start = time.perf_counter()
+        submitted = []
+        for _ in range(clips):
+            submitted.append((time.perf_counter(), pool.submit(audio, model)))
+        latencies = []
+        for submitted_at, future in submitted:
+            future.result()
+            latencies.append(time.perf_counter() - submitted_at)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.shutdown()
+
+    latencies.sort()
+    return {
+        'throughput': clips / elapsed,
+        'p50': latencies[len(latencies) // 2],
+        'p95': latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+        'audio_x_realtime': clips * len(audio) / SAMPLE_RATE / elapsed
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--audio', help="Audio file to transcribe (default: synthetic signal)")
+    parser.add_argument('--seconds', type=float, default=15, help="Length of the synthetic signal")
+    parser.add_argument('--clips', type=int, default=12, help="Clips transcribed per split")
+    parser.add_argument('--model', default=os.getenv('WHISPER_MODEL', 'base'))
+    parser.add_argument('--splits', help="Comma separated WxT list, e.g. 1x8,2x4")
+    args = parser.parse_args()
+
+    cores = len(physical_cores())
+    audio = load_audio(args.audio, args.seconds)
+    if args.splits:
+        splits = [tuple(int(x) for x in item.split('x')) for item in args.splits.split(',')]
+    else:
+        splits = candidate_splits(cores)
+
+    print(f"Physical cores: {cores} | clip: {len(audio) / SAMPLE_RATE:.1f}s | clips per split: {args.clips}")
+    print(f"{'split':>8} {'clips/s':>9} {'x realtime':>11} {'p50 s':>8} {'p95 s':>8}")
+    results = []
+    for workers, threads in splits:
+        stats = run_split(workers, threads, audio, args.clips, args.model)
+        results.append(((workers, threads), stats))
+        print(f"{workers:>3}x{threads:<4} {stats['throughput']:>9.2f} {stats['audio_x_realtime']:>11.1f}"
+              f" {stats['p50']:>8.2f} {stats['p95']:>8.2f}")
+
+    best, stats = max(results, key=lambda item: item[1]['throughput'])
+    print(f"\nBest throughput: INFERENCE_WORKERS={best[0]} INFERENCE_THREADS={best[1]}"
+          f" ({stats['throughput']:.2f} clips/s, p95 {stats['p95']:.2f}s)")
+
+if __name__ == '__main__':
+    main()
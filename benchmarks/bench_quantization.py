@@ -0,0 +1,108 @@
+"""
+Compare fp32 and int8 dynamically quantized Whisper on CPU.
+
+Reports load time, serialized weight size, resident memory growth,
+transcription speed and, with a reference set, the WER delta. Build the
+int8 cache first (manage_models.py quantize) so its load time is measured
+from disk rather than from quantization.
+
+Usage:
+    python benchmarks/bench_quantization.py --model base --reference refs/
+    python benchmarks/bench_quantization.py --model small --seconds 30 --runs 5
+"""
+
+import argparse
+import gc
+import io
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.accuracy import evaluate, load_reference_set  # noqa: E402
+from app.model_store import load_model, load_quantized_model  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+def rss_bytes():
+    """Resident set size of this process"""
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+def serialized_size(model):
+    import torch
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell()
+
+def synthetic_audio(seconds):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    signal = 0.1 * np.sin(2 * np.pi * 220 * t) + 0.05 * np.sin(2 * np.pi * 440 * t)
+    return (signal + 0.01 * np.random.randn(len(t))).astype(np.float32)
+
+def measure(label, loader, references, clip, runs):
+    gc.collect()
+    before = rss_bytes()
+    start = time.perf_counter()
+    model = loader()
+    load_seconds = time.perf_counter() - start
+    rss = rss_bytes() - before
+
+    if references:
+        result = evaluate(model, references)
+        per_clip = result['seconds'] / len(references)
+        wer = result['wer']
+    else:
+        model.transcribe(clip[:SAMPLE_RATE], fp16=False)  # warm up
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            model.transcribe(clip, fp16=False, language='en')
+            timings.append(time.perf_counter() - start)
+        per_clip = statistics.median(timings)
+        wer = None
+
+    stats = {
+        'load_seconds': load_seconds,
+        'size_mb': serialized_size(model) / 1e6,
+        'rss_mb': rss / 1e6,
+        'seconds_per_clip': per_clip,
+        'wer': wer
+    }
+    print(f"  {label:<5} load {stats['load_seconds']:6.2f}s  weights {stats['size_mb']:7.1f} MB"
+          f"  rss +{stats['rss_mb']:7.1f} MB  {stats['seconds_per_clip']:6.2f} s/clip"
+          + (f"  WER {wer:.3f}" if wer is not None else ""))
+    del model
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default=os.getenv('WHISPER_MODEL', 'base'))
+    parser.add_argument('--reference', help="Directory of audio files with .txt transcripts")
+    parser.add_argument('--seconds', type=float, default=20, help="Synthetic clip length without a reference set")
+    parser.add_argument('--runs', type=int, default=5, help="Timed runs per model without a reference set")
+    args = parser.parse_args()
+
+    import torch
+    torch.set_num_threads(int(os.getenv('INFERENCE_THREADS', 0)) or torch.get_num_threads())
+
+    references = load_reference_set(args.reference) if args.reference else None
+    clip = None if references else synthetic_audio(args.seconds)
+    print(f"Model '{args.model}', {torch.get_num_threads()} thread(s), "
+          + (f"{len(references)} reference clip(s)" if references else f"{args.seconds:.0f}s synthetic clip"))
+
+    fp32 = measure('fp32', lambda: load_model(args.model), references, clip, args.runs)
+    int8 = measure('int8', lambda: load_quantized_model(args.model), references, clip, args.runs)
+
+    print(f"\nSpeedup {fp32['seconds_per_clip'] / int8['seconds_per_clip']:.2f}x, "
+          f"weights {1 - int8['size_mb'] / fp32['size_mb']:.0%} smaller, "
+          f"rss {fp32['rss_mb'] - int8['rss_mb']:+.1f} MB saved")
+    if references:
+        print(f"WER delta {int8['wer'] - fp32['wer']:+.3f} ({fp32['wer']:.3f} -> {int8['wer']:.3f})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Cost of handing decoded PCM to another process: pickling vs the shared ring.
+
+A spawned child stands in for an inference worker. For each clip length the
+parent sends the float32 array through a pipe (what the inference pool does without the ring)
+or writes it into a ring slot and sends only the AudioHandle; the child
+reads every sample and answers. Reported per transfer: parent-side copy
+time, round trip, and the bytes that crossed the pipe.
+
+Usage:
+    python benchmarks/bench_shared_audio.py
+    python benchmarks/bench_shared_audio.py --seconds 10,60,600 --runs 20
+"""
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.shared_audio import AudioRing, from_payload, to_payload  # noqa: E402
+
+SAMPLE_RATE = 16000
+
+def child_main(conn):
+    """Read every sample of each payload, like an inference worker would"""
+    while True:
+        try:
+            payload = conn.recv()
+        except EOFError:
+            return
+        conn.send(float(from_payload(payload).sum()))
+
+def measure(conn, make_payload, audio, runs):
+    """Median (copy seconds, round-trip seconds, pickled bytes) over runs"""
+    copies, trips = [], []
+    pickled = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        payload, release = make_payload(audio)
+        copied = time.perf_counter()
+        pickled = len(pickle.dumps(to_payload(payload), protocol=pickle.HIGHEST_PROTOCOL))
+        sent = time.perf_counter()
+        conn.send(to_payload(payload))
+        conn.recv()
+        done = time.perf_counter()
+        release()
+        copies.append(copied - start)
+        # Exclude the size measurement from the round trip
+        trips.append(done - sent + (copied - start))
+    return statistics.median(copies), statistics.median(trips), pickled
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', default='10,60,300,600', help='Comma-separated clip lengths')
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    lengths = [float(s) for s in args.seconds.split(',')]
+    ring = AudioRing(slots=2, slot_seconds=max(lengths))
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    child = context.Process(target=child_main, args=(child_conn,), daemon=True)
+    child.start()
+    child_conn.close()
+
+    def pickled_payload(audio):
+        return audio, lambda: None
+
+    def shared_payload(audio):
+        shared = ring.put(audio)
+        return shared, shared.release
+
+    try:
+        # Warm up both paths (process start, first mapping of the slot files)
+        warmup = np.zeros(SAMPLE_RATE, dtype=np.float32)
+        measure(conn, pickled_payload, warmup, 2)
+        measure(conn, shared_payload, warmup, 2)
+
+        print(f"{'clip':>8} {'MB':>7} {'path':>7} {'copy ms':>9} {'round trip ms':>14} {'pipe bytes':>11}")
+        for seconds in lengths:
+            audio = np.random.uniform(-0.5, 0.5, int(seconds * SAMPLE_RATE)).astype(np.float32)
+            megabytes = audio.nbytes / 1e6
+            results = {}
+            for label, make_payload in (('pickle', pickled_payload), ('shared', shared_payload)):
+                copy, trip, pickled = measure(conn, make_payload, audio, args.runs)
+                results[label] = trip
+                print(f"{seconds:>7.0f}s {megabytes:>7.1f} {label:>7} {copy * 1000:>9.2f} "
+                      f"{trip * 1000:>14.2f} {pickled:>11}")
+            print(f"{'':>8} {'':>7} speedup {results['pickle'] / results['shared']:.1f}x")
+    finally:
+        conn.close()
+        child.join(5)
+        ring.close()
+
+if __name__ == '__main__':
+    main()
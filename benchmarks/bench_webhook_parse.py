@@ -0,0 +1,88 @@
+"""
+Measure parse + validate cost per webhook event.
+
+Compares the former handling (json.loads, ad-hoc .get() checks and per-item
+attachment shape checks) with app.events (orjson when installed, __slots__
+event models, attachments normalized once).
+
+Usage:
+    python benchmarks/bench_webhook_parse.py --events 50000 --attachments 2
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.events import loads, orjson, parse_event  # noqa: E402
+
+def sample_body(attachments):
+    payload = {
+        'type': 'InboundMessage',
+        'locationId': 'loc_0123456789',
+        'conversationId': 'conv_0123456789',
+        'contactId': 'contact_0123456789',
+        'messageId': 'msg_0123456789',
+        'messageType': 'WhatsApp',
+        'direction': 'inbound',
+        'body': '',
+        'dateAdded': '2024-01-01T00:00:00.000Z',
+        'attachments': [
+            {'url': f'https://storage.example.com/voice/{i}.ogg', 'contentType': 'audio/ogg', 'size': 48213}
+            if i % 2 else f'https://storage.example.com/voice/{i}.ogg'
+            for i in range(attachments)
+        ]
+    }
+    return json.dumps(payload).encode()
+
+def legacy_parse(body):
+    data = json.loads(body)
+    if data.get('type') == 'INSTALL' and data.get('locationId'):
+        return data
+    if not data.get('messageType') or not data.get('conversationId'):
+        raise ValueError('invalid')
+    urls = []
+    for attachment in data.get('attachments', []):
+        if isinstance(attachment, str):
+            file_url, size, duration = attachment, None, None
+        else:
+            file_url = attachment.get('url')
+            size = attachment.get('size') or attachment.get('contentLength')
+            duration = attachment.get('duration')
+        if file_url:
+            urls.append((file_url, size, duration))
+    return data, urls
+
+def typed_parse(body):
+    return parse_event(loads(body))
+
+def measure(parse, body, events):
+    start = time.perf_counter()
+    for _ in range(events):
+        parse(body)
+    return (time.perf_counter() - start) / events
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=50000, help="Events parsed per variant")
+    parser.add_argument('--attachments', type=int, default=2, help="Attachments per event")
+    args = parser.parse_args()
+
+    body = sample_body(args.attachments)
+    print(f"Event: {len(body)} bytes, {args.attachments} attachment(s), parser: {'orjson' if orjson else 'json'}")
+
+    # Warm up both paths before timing
+    measure(legacy_parse, body, 1000)
+    measure(typed_parse, body, 1000)
+
+    legacy = measure(legacy_parse, body, args.events)
+    typed = measure(typed_parse, body, args.events)
+    print(f"  legacy  {legacy * 1e6:8.2f} us/event   {1 / legacy:>10,.0f} events/s")
+    print(f"  typed   {typed * 1e6:8.2f} us/event   {1 / typed:>10,.0f} events/s")
+    print(f"  speedup {legacy / typed:.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import os
+import sys
+from app.model_store import (
+    MODEL_DIR, ModelStoreError, available_models, build_fp32_checkpoint, build_quantized_model, model_path,
+    prefetch_model, quantization_report, quantized_path, verify_model
+)
+
+def main():
+    """Prefetch and verify Whisper model artifacts in the local store"""
+    parser = argparse.ArgumentParser(description="Manage Whisper model artifacts")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    prefetch = subparsers.add_parser('prefetch', help="Download and verify models into the store")
+    prefetch.add_argument('models', nargs='+', help="Model names, e.g. base small")
+    prefetch.add_argument('--force', action='store_true', help="Re-download even if already verified")
+
+    verify = subparsers.add_parser('verify', help="Verify checksums of stored models")
+    verify.add_argument('models', nargs='*', help="Model names (default: all known models)")
+
+    subparsers.add_parser('list', help="List known models and their store status")
+
+    quantize = subparsers.add_parser('quantize', help="Build int8 models and check their accuracy")
+    quantize.add_argument('models', nargs='+', help="Model names, e.g. base small")
+    quantize.add_argument('--reference', default=os.getenv('WHISPER_REFERENCE_DIR'),
+                          help="Directory of audio files with .txt transcripts")
+    quantize.add_argument('--max-wer-delta', type=float, default=0.02,
+                          help="Largest acceptable WER increase over fp32")
+
+    args = parser.parse_args()
+    print(f"Model store: {MODEL_DIR}")
+
+    try:
+        if args.command == 'prefetch':
+            for name in args.models:
+                prefetch_model(name, force=args.force)
+                # CPU serving maps the fp32 copy; build it now rather than on first load
+                build_fp32_checkpoint(name)
+            return 0
+
+        if args.command == 'verify':
+            failed = False
+            for name in args.models or available_models():
+                ok = verify_model(name, full=True)
+                if args.models or ok:
+                    print(f"{name}: {'OK' if ok else 'MISSING OR CORRUPT'}")
+                failed = failed or not ok
+            return 1 if failed and args.models else 0
+
+        if args.command == 'quantize':
+            from app.accuracy import check_quantized
+            failed = False
+            for name in args.models:
+                build_quantized_model(name)
+                if not args.reference:
+                    print(f"{name}: no reference set given, int8 model is cached but not verified")
+                    failed = True
+                    continue
+                report = check_quantized(name, args.reference, args.max_wer_delta)
+                print(f"{name}: WER fp32 {report['wer_fp32']:.3f} int8 {report['wer_int8']:.3f} "
+                      f"(delta {report['wer_delta']:+.3f}), speedup {report['speedup']:.2f}x: "
+                      f"{'PASSED' if report['passed'] else 'FAILED'}")
+                failed = failed or not report['passed']
+            return 1 if failed else 0
+
+        for name in available_models():
+            status = 'present' if os.path.isfile(model_path(name)) else 'missing'
+            report = quantization_report(name)
+            if os.path.isfile(quantized_path(name)):
+                status += ', int8 ' + ('verified' if report and report.get('passed') else 'unverified')
+            print(f"{name:<12} {status:<10} {model_path(name)}")
+        return 0
+
+    except (ModelStoreError, ValueError) as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,22 @@
 import os
-import sys
-from app import app
+import threading
+from app import app, scheduler
+from app.outbound import outbound_sender
+from app.shutdown import drain, is_draining
+from app.webhooks import queue_worker
 from init_db import init_db
 import signal
 
+# Set by the signal handler; the main thread drains and exits
+shutdown_requested = threading.Event()
+
 def signal_handler(sig, frame):
     """Handle shutdown signals gracefully"""
+    if shutdown_requested.is_set() or is_draining():
+        print("\nForced shutdown")
+        os._exit(1)
     print("\nShutting down gracefully...")
-    sys.exit(0)
+    shutdown_requested.set()
 
 def main():
     # Set up signal handlers
@@ -20,8 +29,24 @@ def main():
     # Initialize database
     init_db()
     
-    # Start Flask application
-    app.run(debug=True, use_reloader=False)
+    # Start background jobs (token refresh), deliver updates left queued by a previous run,
+    # resume jobs it checkpointed or left unfinished, and complete jobs accepted by webhooks
+    scheduler.start()
+    outbound_sender.start()
+    queue_worker.start()
+    
+    # Serve Flask from a daemon thread so the main thread is free to drain;
+    # webhooks keep getting 503 answers until the process exits
+    server = threading.Thread(
+        target=app.run, kwargs={'debug': True, 'use_reloader': False}, name='flask', daemon=True
+    )
+    server.start()
+    while not shutdown_requested.wait(1.0):
+        if not server.is_alive():
+            print("Flask server stopped")
+            break
+
+    drain(queue_worker)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -10,4 +10,154 @@ CREATE TABLE IF NOT EXISTS iaoff.tokens (
     expires_at TIMESTAMP WITH TIME ZONE,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
     is_active BOOLEAN DEFAULT true
-); 
\ No newline at end of file
+);
+
+-- Create token refresh leases table (one refreshing node per location)
+CREATE TABLE IF NOT EXISTS iaoff.token_refresh_leases (
+    location_id VARCHAR PRIMARY KEY,
+    holder VARCHAR NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+-- Create sessions table
+CREATE TABLE IF NOT EXISTS iaoff.sessions (
+    sid VARCHAR PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+ALTER TABLE iaoff.sessions DROP COLUMN IF EXISTS version;
+
+CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON iaoff.sessions (expires_at);
+
+-- Create transcriptions table
+CREATE TABLE IF NOT EXISTS iaoff.transcriptions (
+    id BIGSERIAL PRIMARY KEY,
+    location_id VARCHAR,
+    contact_id VARCHAR,
+    conversation_id VARCHAR,
+    message_id VARCHAR,
+    attachment_url VARCHAR,
+    audio_hash VARCHAR(64),
+    text TEXT NOT NULL,
+    language VARCHAR(16),
+    duration_seconds DOUBLE PRECISION,
+    model VARCHAR(32),
+    download_ms INTEGER,
+    transcribe_ms INTEGER,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', coalesce(text, ''))) STORED
+);
+
+CREATE INDEX IF NOT EXISTS ix_transcriptions_location_created ON iaoff.transcriptions (location_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_transcriptions_location_contact_created ON iaoff.transcriptions (location_id, contact_id, created_at, id);
+CREATE INDEX IF NOT EXISTS ix_transcriptions_audio_hash ON iaoff.transcriptions (location_id, audio_hash);
+CREATE INDEX IF NOT EXISTS ix_transcriptions_message ON iaoff.transcriptions (location_id, message_id);
+CREATE INDEX IF NOT EXISTS ix_transcriptions_search ON iaoff.transcriptions USING GIN (search_vector);
+
+-- Create backfill checkpoints table
+CREATE TABLE IF NOT EXISTS iaoff.backfill_checkpoints (
+    location_id VARCHAR PRIMARY KEY,
+    start_after_date BIGINT,
+    last_conversation_id VARCHAR,
+    conversations_done INTEGER NOT NULL DEFAULT 0,
+    messages_scanned INTEGER NOT NULL DEFAULT 0,
+    jobs_queued INTEGER NOT NULL DEFAULT 0,
+    status VARCHAR(16) NOT NULL DEFAULT 'running',
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create backfill failures table (attachments skipped after their retries)
+CREATE TABLE IF NOT EXISTS iaoff.backfill_failures (
+    location_id VARCHAR NOT NULL,
+    message_id VARCHAR NOT NULL,
+    url TEXT NOT NULL,
+    conversation_id VARCHAR,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (location_id, message_id, url)
+);
+
+-- Redelivered webhooks are deduplicated by transcription_jobs.dedup_key
+DROP TABLE IF EXISTS iaoff.webhook_deliveries;
+
+-- Create durable transcription job queue (web/worker split)
+CREATE TABLE IF NOT EXISTS iaoff.transcription_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    dedup_key VARCHAR(40) UNIQUE,
+    location_id VARCHAR,
+    conversation_id VARCHAR,
+    contact_id VARCHAR,
+    message_id VARCHAR,
+    message_type VARCHAR,
+    url TEXT NOT NULL,
+    estimated_seconds DOUBLE PRECISION,
+    deliver BOOLEAN NOT NULL DEFAULT TRUE,
+    status VARCHAR(16) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker_id VARCHAR,
+    error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP WITH TIME ZONE,
+    heartbeat_at TIMESTAMP WITH TIME ZONE,
+    finished_at TIMESTAMP WITH TIME ZONE
+);
+
+ALTER TABLE iaoff.transcription_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP WITH TIME ZONE;
+
+CREATE INDEX IF NOT EXISTS ix_transcription_jobs_status ON iaoff.transcription_jobs (status, id);
+
+-- Wake LISTENing workers once per inserting statement
+CREATE OR REPLACE FUNCTION iaoff.notify_transcription_jobs() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('transcription_jobs', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS transcription_jobs_notify ON iaoff.transcription_jobs;
+CREATE TRIGGER transcription_jobs_notify
+    AFTER INSERT ON iaoff.transcription_jobs
+    FOR EACH STATEMENT EXECUTE FUNCTION iaoff.notify_transcription_jobs();
+
+-- Create outbound GoHighLevel update queue and its dead letters
+CREATE TABLE IF NOT EXISTS iaoff.outbound_updates (
+    id BIGSERIAL PRIMARY KEY,
+    location_id VARCHAR,
+    kind VARCHAR(32) NOT NULL,
+    payload JSONB NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_until TIMESTAMP WITH TIME ZONE,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_outbound_updates_due ON iaoff.outbound_updates (next_attempt_at, id);
+CREATE INDEX IF NOT EXISTS ix_outbound_updates_location ON iaoff.outbound_updates (location_id, id);
+
+CREATE TABLE IF NOT EXISTS iaoff.outbound_dead_letters (
+    id BIGINT PRIMARY KEY,
+    location_id VARCHAR,
+    kind VARCHAR(32) NOT NULL,
+    payload JSONB NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    failed_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create audio fingerprints table (near-duplicate detection)
+CREATE TABLE IF NOT EXISTS iaoff.audio_fingerprints (
+    transcription_id BIGINT PRIMARY KEY REFERENCES iaoff.transcriptions (id) ON DELETE CASCADE,
+    location_id VARCHAR,
+    duration_seconds DOUBLE PRECISION NOT NULL,
+    fingerprint BYTEA NOT NULL,
+    voiced BYTEA,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE iaoff.audio_fingerprints ADD COLUMN IF NOT EXISTS voiced BYTEA;
+
+CREATE INDEX IF NOT EXISTS ix_audio_fingerprints_location_created ON iaoff.audio_fingerprints (location_id, created_at);
@@ -0,0 +1,14 @@
+"""
+Shared test setup.
+
+Importing any app module imports the app package, which needs its required
+environment variables; nothing here connects to them. Tests that need
+Postgres are skipped unless TEST_DATABASE_URL is set.
+"""
+
+import os
+
+os.environ.setdefault('DATABASE_URL', os.getenv('TEST_DATABASE_URL', 'postgresql://localhost:5432/iaoff_test'))
+os.environ.setdefault('GHL_CLIENT_ID', 'test-client')
+os.environ.setdefault('GHL_CLIENT_SECRET', 'test-secret')
+os.environ.setdefault('GHL_REDIRECT_URI', 'http://localhost/callback')
@@ -0,0 +1,40 @@
+import pytest
+
+from app import admin, app, model_policy
+from app.pipeline import transcription_scheduler
+
+HEADERS = {'Authorization': 'Bearer secret'}
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admin, 'ADMIN_TOKEN', 'secret')
+    saved_workers = transcription_scheduler.workers
+    saved_models = model_policy.settings()
+    yield app.test_client()
+    transcription_scheduler.set_workers(saved_workers)
+    model_policy.configure(
+        adaptive=saved_models['adaptive'], tiers=saved_models['tiers'], default_model=saved_models['default_model'],
+        slo_seconds=saved_models['slo_seconds'], location_slos=saved_models['location_slos']
+    )
+
+def test_invalid_setting_leaves_the_rest_unapplied(client):
+    workers = transcription_scheduler.workers
+    response = client.patch('/admin/settings', headers=HEADERS, json={
+        'transcription_workers': workers + 3,
+        'models': {'default_model': 'no-such-model'}
+    })
+
+    assert response.status_code == 400
+    assert 'Invalid models' in response.get_json()['error']
+    assert transcription_scheduler.workers == workers
+
+def test_unknown_model_setting_is_rejected(client):
+    response = client.patch('/admin/settings', headers=HEADERS, json={'models': {'fastest': True}})
+    assert response.status_code == 400
+
+def test_default_model_change_reaches_the_pipeline(client):
+    response = client.patch('/admin/settings', headers=HEADERS, json={'models': {'default_model': 'tiny'}})
+
+    assert response.status_code == 200
+    assert response.get_json()['models']['default_model'] == 'tiny'
+    assert model_policy.current_default_model() == 'tiny'
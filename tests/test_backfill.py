@@ -0,0 +1,153 @@
+import random
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app import backfill, pipeline
+from app.backfill import Backfill, BackfillError, iter_conversations, retry_after_seconds
+from app.job_scheduler import TranscriptionJob
+
+class FakeScheduler:
+    """Runs nothing; tests finish jobs by hand"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job):
+        self.submitted.append(job)
+        return job
+
+class FakeDb:
+    def commit(self):
+        pass
+
+def finish(job, error=None):
+    job.error = error
+    job.done.set()
+
+def make_backfill(scheduler):
+    run = Backfill('loc', scheduler=scheduler)
+    run._db = FakeDb()
+    run._checkpoint = SimpleNamespace(start_after_date=None, last_conversation_id=None,
+                                      conversations_done=0, messages_scanned=0, jobs_queued=0)
+    return run
+
+def queue(run, conversation_id, date, n_jobs=1):
+    jobs = [run.scheduler.submit(TranscriptionJob(f'{conversation_id}-{i}', location_id='loc',
+                                                  conversation_id=conversation_id, message_id=f'{conversation_id}-m{i}'))
+            for i in range(n_jobs)]
+    run.window.append(({'id': conversation_id, 'lastMessageDate': date}, jobs, n_jobs))
+    return jobs
+
+def test_failed_job_is_retried_before_checkpointing():
+    scheduler = FakeScheduler()
+    run = make_backfill(scheduler)
+    (first,) = queue(run, 'c1', 100)
+    (second,) = queue(run, 'c2', 200)
+    finish(first, error='Transcription failed')
+    finish(second)
+
+    run._advance()
+    assert run._checkpoint.last_conversation_id is None
+    retry = scheduler.submitted[-1]
+    assert retry is not first and retry.message_id == first.message_id
+
+    finish(retry)
+    run._advance()
+    assert (run._checkpoint.start_after_date, run._checkpoint.last_conversation_id) == (200, 'c2')
+    assert run._checkpoint.conversations_done == 2
+
+def test_exhausted_retries_are_recorded_and_skipped(monkeypatch):
+    monkeypatch.setattr(backfill, 'BACKFILL_JOB_RETRIES', 1)
+    recorded = []
+    monkeypatch.setattr(backfill, 'record_failure', lambda db, job, attempts: recorded.append((job.message_id, attempts)))
+    scheduler = FakeScheduler()
+    run = make_backfill(scheduler)
+    (done,) = queue(run, 'c1', 100)
+    failing, slow = queue(run, 'c2', 200, n_jobs=2)
+    finish(done)
+    finish(failing, error='boom')
+    run._advance()
+    assert run._checkpoint.last_conversation_id == 'c1'
+    finish(scheduler.submitted[-1], error='boom again')
+    run._advance()
+    assert recorded == [('c2-m0', 2)]
+
+    # Given up once: later passes neither retry nor record it again
+    run._advance()
+    assert recorded == [('c2-m0', 2)]
+    assert len(scheduler.submitted) == 4
+    assert run._checkpoint.last_conversation_id == 'c1'
+    finish(slow)
+    run._advance()
+    assert run._checkpoint.last_conversation_id == 'c2'
+    assert run.jobs_failed == 1
+
+def test_cancelled_job_pauses_without_checkpointing():
+    run = make_backfill(FakeScheduler())
+    (job,) = queue(run, 'c1', 100)
+    job.cancel()
+    job.done.set()
+    with pytest.raises(BackfillError):
+        run._advance()
+    assert run._checkpoint.last_conversation_id is None
+
+def test_retry_after_accepts_seconds_and_http_dates():
+    assert retry_after_seconds('7') == 7.0
+    assert retry_after_seconds(None) == backfill.DEFAULT_RETRY_AFTER
+    assert retry_after_seconds('soon') == backfill.DEFAULT_RETRY_AFTER
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 <= retry_after_seconds(format_datetime(later, usegmt=True)) <= 30
+    assert retry_after_seconds('Mon, 01 Jan 2001 00:00:00 GMT') == 0.0
+
+def fake_search(conversations, page_size):
+    """/conversations/search stand-in: strictly after startAfterDate, ties in arbitrary order"""
+    def ghl_get(location_id, path, params):
+        start = params.get('startAfterDate')
+        matching = [c for c in conversations if start is None or c['lastMessageDate'] > start]
+        matching.sort(key=lambda c: (c['lastMessageDate'], -int(c['id'][1:])))
+        return {'conversations': matching[:page_size], 'total': len(conversations)}
+    return ghl_get
+
+def test_conversations_sharing_a_date_are_not_skipped(monkeypatch):
+    dates = [1, 2, 2, 2, 2, 3, 3, 4, 5, 5, 5, 6]
+    conversations = [{'id': f'c{i}', 'lastMessageDate': date} for i, date in enumerate(dates)]
+    monkeypatch.setattr(backfill, 'BACKFILL_PAGE_SIZE', 4)
+    monkeypatch.setattr(backfill, 'ghl_get', fake_search(conversations, 4))
+
+    seen = [c['id'] for c, _ in iter_conversations('loc')]
+    assert sorted(seen) == sorted(c['id'] for c in conversations)
+    assert len(seen) == len(set(seen))
+
+    # Resuming from the middle of a date yields exactly the rest
+    resumed = [c['id'] for c, _ in iter_conversations('loc', after=(2, 'c2'))]
+    assert sorted(resumed) == sorted(c['id'] for c in conversations
+                                     if (c['lastMessageDate'], c['id']) > (2, 'c2'))
+
+def test_random_date_layouts_are_covered_exactly_once(monkeypatch):
+    rng = random.Random(7)
+    monkeypatch.setattr(backfill, 'BACKFILL_PAGE_SIZE', 5)
+    for _ in range(50):
+        # Groups smaller than a page, so nothing may be skipped
+        dates = sorted(d for d in range(1, 15) for _ in range(rng.randint(0, 4)))
+        conversations = [{'id': f'c{i}', 'lastMessageDate': date} for i, date in enumerate(dates)]
+        monkeypatch.setattr(backfill, 'ghl_get', fake_search(conversations, 5))
+        seen = [c['id'] for c, _ in iter_conversations('loc')]
+        assert sorted(seen) == sorted(c['id'] for c in conversations)
+        assert len(seen) == len(set(seen))
+
+def test_reused_transcript_is_stored_under_the_new_message(monkeypatch):
+    saved = []
+    monkeypatch.setattr(pipeline, 'save_transcription', lambda **fields: saved.append(fields))
+    existing = SimpleNamespace(id=7, message_id='m1', text='hola', language='es', duration_seconds=3.0, model='base')
+    job = TranscriptionJob('u2', location_id='loc', conversation_id='c2', message_id='m2')
+
+    assert pipeline.reuse_transcription(job, existing, 'digest', 12) == 'hola'
+    assert [(f['message_id'], f['text'], f['audio_hash']) for f in saved] == [('m2', 'hola', 'digest')]
+
+    # The message that owns the transcript is not stored twice
+    job = TranscriptionJob('u1', location_id='loc', conversation_id='c1', message_id='m1')
+    assert pipeline.reuse_transcription(job, existing, 'digest', 12) == 'hola'
+    assert len(saved) == 1
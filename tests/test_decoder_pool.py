@@ -0,0 +1,100 @@
+import io
+import os
+import subprocess
+import sys
+import threading
+import wave
+
+import numpy as np
+import pytest
+
+from app.audio import AudioDecodeError
+from app.decoder_pool import WORKER_SCRIPT, DecoderPool, DecoderWorker
+from app.decoder_worker import av
+
+class FakeWorker:
+    """Decodes instantly, or breaks like a dead worker process"""
+
+    def __init__(self, pool_events):
+        self.jobs = 0
+        self.closed = False
+        pool_events.append(self)
+
+    def decode(self, content, audio_format, target=None):
+        self.jobs += 1
+        if content == b'crash':
+            raise BrokenPipeError("worker died")
+        return np.zeros(4, dtype=np.float32)
+
+    def ping(self):
+        return not self.closed
+
+    def close(self):
+        self.closed = True
+
+def make_pool(size=1):
+    created = []
+    return DecoderPool(size, worker_factory=lambda: FakeWorker(created)), created
+
+def test_discarded_worker_wakes_waiter():
+    pool, created = make_pool(size=1)
+    busy = pool._checkout()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(pool.decode(b'ok')))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+
+    # The busy worker turns out unhealthy and is discarded, not returned
+    pool._discard(busy)
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert len(results) == 1
+    assert len(created) == 2
+
+def test_failed_decode_replaces_worker_for_waiters():
+    pool, created = make_pool(size=1)
+    with pytest.raises(AudioDecodeError):
+        pool.decode(b'crash')
+    assert created[0].closed
+    assert len(pool.decode(b'ok')) == 4
+    assert pool.stats()['workers'] == 1
+    assert pool.stats()['replaced'] == 1
+
+def test_growing_pool_wakes_waiters():
+    pool, _ = make_pool(size=1)
+    pool._checkout()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(pool.decode(b'ok')))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    pool.resize(2)
+    waiter.join(5)
+    assert results
+
+def test_worker_script_does_not_import_app_package():
+    code = (
+        f"import runpy, sys; sys.argv = [{WORKER_SCRIPT!r}, '-1']; sys.path.insert(0, {os.path.dirname(WORKER_SCRIPT)!r}); "
+        f"runpy.run_path({WORKER_SCRIPT!r}, run_name='decoder_worker'); "
+        "print(sorted(m for m in ('app', 'flask', 'torch', 'whisper', 'sqlalchemy') if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip() == '[]'
+
+@pytest.mark.skipif(av is None, reason="PyAV is not installed")
+def test_real_worker_decodes_wav():
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes((np.sin(np.arange(16000) / 10) * 8000).astype(np.int16).tobytes())
+
+    worker = DecoderWorker()
+    try:
+        assert worker.ping()
+        pcm = worker.decode(buffer.getvalue(), 'wav')
+        assert abs(len(pcm) - 16000) < 100
+    finally:
+        worker.close()
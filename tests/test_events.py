@@ -0,0 +1,19 @@
+import pytest
+
+from app.events import EventValidationError, InboundMessageEvent, MessageEvent, parse_event, parse_events
+
+MESSAGE = {'conversationId': 'c1', 'messageType': 'SMS', 'locationId': 'loc'}
+
+@pytest.mark.parametrize('event_type', [['InboundMessage'], {'a': 1}, 3])
+def test_non_string_type_is_a_validation_error(event_type):
+    with pytest.raises(EventValidationError):
+        parse_event(dict(MESSAGE, type=event_type))
+
+def test_known_and_unknown_types():
+    assert isinstance(parse_event(dict(MESSAGE, type='InboundMessage')), InboundMessageEvent)
+    assert type(parse_event(dict(MESSAGE, type='Custom'))) is MessageEvent
+
+def test_batch_keeps_valid_events_next_to_invalid_ones():
+    parsed = parse_events([dict(MESSAGE, type=['x']), dict(MESSAGE, type='InboundMessage')])
+    assert isinstance(parsed[0], EventValidationError)
+    assert isinstance(parsed[1], InboundMessageEvent)
@@ -0,0 +1,133 @@
+import numpy as np
+
+from app import fingerprint
+from app.audio import SAMPLE_RATE
+from app.fingerprint import (
+    FINGERPRINT_THRESHOLD, HOP_SIZE, Fingerprint, compute_fingerprint, similarity
+)
+
+def noise(rng, seconds, level=0.1):
+    return rng.normal(0, level, int(seconds * SAMPLE_RATE)).astype(np.float32)
+
+def burst_clip(rng, at):
+    clip = np.zeros(5 * SAMPLE_RATE, dtype=np.float32)
+    start = int(at * SAMPLE_RATE)
+    clip[start:start + int(0.3 * SAMPLE_RATE)] = noise(rng, 0.3, level=0.3)
+    return clip
+
+def test_mostly_silent_clips_do_not_match():
+    rng = np.random.default_rng(1)
+    a = compute_fingerprint(burst_clip(rng, 1))
+    b = compute_fingerprint(burst_clip(rng, 3))
+    assert similarity(a, b) < FINGERPRINT_THRESHOLD
+
+def test_unrelated_audio_does_not_match():
+    rng = np.random.default_rng(2)
+    score = similarity(compute_fingerprint(noise(rng, 5)), compute_fingerprint(noise(rng, 5)))
+    assert 0.4 < score < 0.6
+
+def test_reencoded_copy_matches():
+    rng = np.random.default_rng(3)
+    original = noise(rng, 5)
+    # Quieter, padded by two hops, slightly smoothed and with added hiss
+    copy = np.concatenate([np.zeros(2 * HOP_SIZE, dtype=np.float32), 0.5 * original])
+    copy = np.convolve(copy + noise(rng, len(copy) / SAMPLE_RATE, level=0.002), np.ones(3) / 3, 'same')
+    assert similarity(compute_fingerprint(original), compute_fingerprint(copy.astype(np.float32))) >= FINGERPRINT_THRESHOLD
+
+def test_clip_sharing_only_its_opening_does_not_match():
+    rng = np.random.default_rng(4)
+    original = noise(rng, 5)
+    truncated = original.copy()
+    truncated[SAMPLE_RATE:] = 0
+    assert similarity(compute_fingerprint(original), compute_fingerprint(truncated)) < FINGERPRINT_THRESHOLD
+
+def test_blockwise_fingerprint_equals_whole_clip(monkeypatch):
+    audio = noise(np.random.default_rng(5), 20)
+    whole = compute_fingerprint(audio)
+    monkeypatch.setattr(fingerprint, 'FINGERPRINT_BLOCK_FRAMES', 7)
+    blocked = compute_fingerprint(audio)
+    assert np.array_equal(whole.bits, blocked.bits)
+    assert np.array_equal(whole.voiced, blocked.voiced)
+
+def test_stored_form_round_trips():
+    rng = np.random.default_rng(6)
+    clip = np.concatenate([np.zeros(SAMPLE_RATE, dtype=np.float32), noise(rng, 3)])
+    computed = compute_fingerprint(clip)
+    stored = Fingerprint.from_bytes(computed.bits.astype('<u4').tobytes(), computed.pack_voiced())
+    assert np.array_equal(stored.bits, computed.bits)
+    assert np.array_equal(stored.voiced, computed.voiced)
+    assert not stored.voiced[:10].any() and stored.voiced[-10:].all()
+
+class FakeTable:
+    """audio_fingerprints stand-in: every session sees committed rows"""
+
+    def __init__(self):
+        self.rows = []
+        self.loads = []
+
+    def session(self):
+        table = self
+
+        class Session:
+            def query(self, model):
+                return self
+
+            def filter(self, condition):
+                self.location_id = condition.right.value
+                return self
+
+            def order_by(self, *args):
+                return self
+
+            def limit(self, n):
+                return self
+
+            def all(self):
+                table.loads.append(self.location_id)
+                return [row for row in reversed(table.rows) if row.location_id == self.location_id]
+
+            def add(self, row):
+                table.rows.append(row)
+
+            def commit(self):
+                pass
+
+            def rollback(self):
+                pass
+
+            def close(self):
+                pass
+
+        return Session()
+
+def indexed(index, location_id):
+    return [transcription_id for transcription_id, _, _ in index._location_entries(location_id)]
+
+def test_added_fingerprint_is_indexed_once(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(fingerprint, 'SessionLocal', table.session)
+    clip = compute_fingerprint(noise(np.random.default_rng(7), 3))
+    index = fingerprint.FingerprintIndex()
+
+    # First use of the location is the add itself
+    index.add('loc', 1, clip, 3.0)
+    index.add('loc', 2, clip, 3.0)
+    assert indexed(index, 'loc') == [1, 2]
+    assert table.loads == ['loc']
+
+def test_index_keeps_only_recent_locations(monkeypatch):
+    table = FakeTable()
+    monkeypatch.setattr(fingerprint, 'SessionLocal', table.session)
+    clip = compute_fingerprint(noise(np.random.default_rng(8), 3))
+    index = fingerprint.FingerprintIndex(locations=2)
+
+    index.add('a', 1, clip, 3.0)
+    index.add('b', 2, clip, 3.0)
+    index.lookup('a', clip, 3.0)
+    index.add('c', 3, clip, 3.0)
+    assert list(index._entries) == ['a', 'c']
+    assert index.stats()['locations'] == 2
+
+    # An evicted location is reloaded from the table, with nothing lost
+    assert indexed(index, 'b') == [2]
+    assert table.loads == ['a', 'b', 'c', 'b']
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from app import inference_pool as pool_module
+from app.inference_pool import WORKER_SCRIPT, InferenceError, InferencePool, InferenceWorker
+from app.model_store import ModelStoreError
+
+class FakeWorker:
+    """Answers by model name: 'hang' times out, 'crash' dies, 'missing' has no model"""
+
+    def __init__(self, created, threads, cpus, pin=True):
+        self.cpus = cpus
+        self.jobs = 0
+        self.closed = False
+        created.append(self)
+
+    def transcribe(self, audio, model_name, options, timeout):
+        self.jobs += 1
+        if model_name == 'hang':
+            raise TimeoutError(f"Inference worker did not answer within {timeout:.0f}s")
+        if model_name == 'crash':
+            raise EOFError()
+        if model_name == 'missing':
+            raise ModelStoreError("no such model")
+        return {'text': f"{len(audio)} samples", 'language': 'es', 'segments': []}
+
+    def close(self):
+        self.closed = True
+
+def make_pool():
+    created = []
+    pool = InferencePool(1, 1, timeout=10,
+                         worker_factory=lambda *args: FakeWorker(created, *args))
+    return pool, created
+
+def test_hung_worker_is_killed_and_replaced_on_its_cpus():
+    pool, created = make_pool()
+    with pytest.raises(InferenceError):
+        pool.transcribe(np.zeros(16000, dtype=np.float32), 'hang')
+    assert created[0].closed
+    assert len(created) == 1
+
+    assert pool.transcribe(np.zeros(8, dtype=np.float32), 'base')['text'] == '8 samples'
+    assert len(created) == 2
+    assert created[1].cpus == created[0].cpus
+    assert pool.stats()['timeouts'] == 1
+    assert pool.stats()['running'] == 1
+
+def test_timeout_grows_with_clip_length():
+    pool, _ = make_pool()
+    assert pool.clip_timeout(np.zeros(16000 * 60, dtype=np.float32)) == 10 + 60 * pool_module.INFERENCE_TIMEOUT_RATIO
+
+def test_dead_worker_is_replaced_and_clip_retried(monkeypatch):
+    monkeypatch.setattr(pool_module, 'INFERENCE_RETRIES', 1)
+    pool, created = make_pool()
+    with pytest.raises(InferenceError):
+        pool.transcribe(np.zeros(4, dtype=np.float32), 'crash')
+    assert len(created) == 2
+    assert all(worker.closed for worker in created)
+    assert pool.stats()['replaced'] == 2
+    assert pool.stats()['busy'] == 0
+
+def test_model_errors_keep_the_worker():
+    pool, created = make_pool()
+    with pytest.raises(ModelStoreError):
+        pool.transcribe(np.zeros(4, dtype=np.float32), 'missing')
+    pool.transcribe(np.zeros(4, dtype=np.float32), 'base')
+    assert len(created) == 1
+    assert not created[0].closed
+
+def test_replaced_worker_wakes_waiter():
+    pool, created = make_pool()
+    busy = pool._checkout()
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(pool.transcribe(np.zeros(4, dtype=np.float32), 'base')))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+
+    pool._discard(busy)
+    waiter.join(5)
+    assert not waiter.is_alive()
+    assert results and len(created) == 2
+
+def test_shutdown_closes_idle_and_returning_workers():
+    pool, created = make_pool()
+    pool.transcribe(np.zeros(4, dtype=np.float32), 'base')
+    pool.shutdown()
+    assert created[0].closed
+
+    pool, created = make_pool()
+    busy = pool._checkout()
+    pool.shutdown()
+    assert not busy.closed
+    pool._checkin(busy)
+    assert busy.closed
+    with pytest.raises(InferenceError):
+        pool.transcribe(np.zeros(4, dtype=np.float32), 'base')
+
+def test_worker_script_does_not_import_app_package():
+    code = (
+        f"import runpy, sys; sys.path.insert(0, {os.path.dirname(WORKER_SCRIPT)!r}); "
+        f"runpy.run_path({WORKER_SCRIPT!r}, run_name='inference_worker'); "
+        "print(sorted(m for m in ('app', 'flask', 'sqlalchemy', 'flask_apscheduler') if m in sys.modules))"
+    )
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    assert output.strip().splitlines()[-1] == '[]'
+
+def test_real_worker_answers_ping():
+    worker = InferenceWorker(1, [], pin=False)
+    try:
+        assert worker.ping(timeout=120)
+    finally:
+        worker.close()
@@ -0,0 +1,144 @@
+import threading
+import time
+
+import pytest
+
+from app.job_scheduler import (
+    LONG_LANE, LONG_LANE_MAX_SHARE, LONG_LANE_MAX_WAIT, SHORT_CLIP_SECONDS, FairQueue, JobCancelled, JobScheduler,
+    TranscriptionJob
+)
+
+def blocking_handler(started, release, commit_first=False):
+    def handler(job):
+        if commit_first:
+            job.commit()
+        started.release()
+        release.wait(5)
+        job.commit()
+        job.delivered = True
+    return handler
+
+def test_drain_returns_queued_jobs_without_running_them():
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    scheduler = JobScheduler(blocking_handler(started, release), workers=1, location_concurrency=1)
+    running = scheduler.submit(TranscriptionJob('a', location_id='loc'))
+    assert started.acquire(timeout=5)
+    queued = scheduler.submit(TranscriptionJob('b', location_id='loc'))
+
+    undone = scheduler.drain(timeout=0.1)
+    release.set()
+    assert running.done.wait(5)
+    assert queued in undone
+    assert queued.stage == 'queued'
+
+def test_drain_cancels_running_job_that_has_not_delivered():
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    scheduler = JobScheduler(blocking_handler(started, release), workers=1)
+    job = scheduler.submit(TranscriptionJob('a', location_id='loc'))
+    assert started.acquire(timeout=5)
+
+    undone = scheduler.drain(timeout=0.1)
+    assert undone == [job]
+    # The worker wakes up after the drain; it must not deliver the checkpointed job
+    release.set()
+    assert job.done.wait(5)
+    assert job.cancelled
+    assert not getattr(job, 'delivered', False)
+
+def test_drain_leaves_delivering_job_running():
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    scheduler = JobScheduler(blocking_handler(started, release, commit_first=True), workers=1)
+    job = scheduler.submit(TranscriptionJob('a', location_id='loc'))
+    assert started.acquire(timeout=5)
+
+    undone = scheduler.drain(timeout=0.1)
+    assert undone == []
+    release.set()
+    assert job.done.wait(5)
+    assert job.delivered
+
+def test_cancel_and_commit_are_exclusive():
+    job = TranscriptionJob('a')
+    assert job.cancel()
+    with pytest.raises(JobCancelled):
+        job.commit()
+
+    job = TranscriptionJob('b')
+    job.commit()
+    assert not job.cancel()
+    job.check_cancelled()
+
+def job(location_id, seconds=10):
+    return TranscriptionJob(f'https://cdn/{location_id}', location_id=location_id, estimated_seconds=seconds)
+
+def pop_order(queue, count):
+    order = []
+    for _ in range(count):
+        picked = queue.peek(lambda location_id: True)
+        queue.remove(picked)
+        order.append(picked.location_id)
+    return order
+
+def test_fair_queue_shares_by_weight():
+    queue = FairQueue()
+    for _ in range(8):
+        queue.push(job('heavy'), weight=3.0)
+        queue.push(job('light'), weight=1.0)
+    assert pop_order(queue, 8).count('heavy') == 6
+
+def test_bulk_location_does_not_starve_a_newcomer():
+    queue = FairQueue()
+    for _ in range(20):
+        queue.push(job('bulk'), weight=1.0)
+    pop_order(queue, 5)
+    queue.push(job('newcomer'), weight=1.0)
+    assert 'newcomer' in pop_order(queue, 2)
+
+def idle_scheduler(workers=4):
+    # Never started: jobs are picked by calling _next_job directly
+    return JobScheduler(lambda job: None, workers=workers, location_concurrency=1)
+
+def push(scheduler, *jobs):
+    for queued in jobs:
+        scheduler.lanes[queued.lane].push(queued, scheduler.weights.get(queued.location_id, 1.0))
+
+def test_short_clips_go_before_long_recordings():
+    scheduler = idle_scheduler()
+    long_job, short_job = job('a', seconds=SHORT_CLIP_SECONDS * 10), job('b', seconds=5)
+    push(scheduler, long_job, short_job)
+    assert scheduler._next_job() is short_job
+    assert scheduler._next_job() is long_job
+
+def test_long_lane_is_capped_to_its_share_of_workers():
+    scheduler = idle_scheduler(workers=4)
+    push(scheduler, *[job(f'loc{i}', seconds=SHORT_CLIP_SECONDS * 10) for i in range(4)])
+    limit = max(1, int(4 * LONG_LANE_MAX_SHARE))
+    for _ in range(limit):
+        assert scheduler._next_job().lane == LONG_LANE
+    assert scheduler._pick() is None
+
+    short_job = job('short', seconds=5)
+    push(scheduler, short_job)
+    assert scheduler._pick() is short_job
+
+def test_long_recording_is_promoted_after_waiting():
+    scheduler = idle_scheduler()
+    long_job = job('a', seconds=SHORT_CLIP_SECONDS * 10)
+    long_job.enqueued_at = time.monotonic() - LONG_LANE_MAX_WAIT - 1
+    short_job = job('b', seconds=5)
+    push(scheduler, long_job, short_job)
+    assert scheduler._next_job() is long_job
+
+def test_location_quota_lets_other_locations_through():
+    scheduler = idle_scheduler()
+    first, second, other = job('busy'), job('busy'), job('quiet')
+    push(scheduler, first, second, other)
+    assert scheduler._next_job() is first
+    # busy is at its quota of one until first finishes
+    assert scheduler._next_job() is other
+    assert scheduler._pick() is None
+    scheduler._release(first)
+    assert scheduler._next_job() is second
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from app import model_policy, pipeline
+
+@pytest.fixture
+def restore_policy():
+    saved = model_policy.settings()
+    yield
+    model_policy.configure(
+        adaptive=saved['adaptive'], tiers=saved['tiers'], default_model=saved['default_model'],
+        slo_seconds=saved['slo_seconds'], location_slos=saved['location_slos']
+    )
+
+def test_configured_default_model_reaches_inference(monkeypatch, restore_policy):
+    used = []
+
+    class FakeModel:
+        def transcribe(self, audio, **options):
+            return {'text': 'hello'}
+
+    monkeypatch.setattr(pipeline, 'inference_pool', None)
+    monkeypatch.setattr(pipeline, 'get_model', lambda name: used.append(name) or FakeModel())
+    model_policy.configure(default_model='tiny')
+
+    assert pipeline.run_inference(np.zeros(16000, dtype=np.float32)) == {'text': 'hello'}
+    assert used == ['tiny']
+
+def test_rejected_configuration_changes_nothing(restore_policy):
+    before = model_policy.settings()
+    with pytest.raises(ValueError):
+        model_policy.configure(default_model='tiny', slo_seconds=-1)
+    assert model_policy.settings() == before
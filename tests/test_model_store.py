@@ -0,0 +1,89 @@
+import os
+from dataclasses import asdict
+
+import pytest
+import torch
+from whisper.model import ModelDimensions, Whisper
+
+from app import model_store
+
+DIMS = ModelDimensions(
+    n_mels=80, n_audio_ctx=16, n_audio_state=32, n_audio_head=2, n_audio_layer=1,
+    n_vocab=100, n_text_ctx=8, n_text_state=32, n_text_head=2, n_text_layer=1
+)
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    built = []
+
+    def load_model(name):
+        # Checkpoints are fp16; quantization must still get fp32 weights
+        torch.manual_seed(0)
+        model = Whisper(DIMS)
+        # Left uninitialized by whisper, since checkpoints always provide it
+        torch.nn.init.normal_(model.decoder.positional_embedding)
+        model = model.half()
+        built.append(model)
+        return model
+
+    monkeypatch.setattr(model_store, 'MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(model_store, 'expected_sha256', lambda name: 'sha')
+    monkeypatch.setattr(model_store, 'load_model', load_model)
+    return built
+
+# 'toy' has no upstream alignment heads to apply to the small DIMS
+def test_quantized_cache_round_trips_as_a_state_dict(store, monkeypatch):
+    built = model_store.build_quantized_model('toy')
+    # A cached load fills a skeleton instead of quantizing random weights
+    monkeypatch.setattr(model_store, 'quantize_model', None)
+    loaded = model_store.load_quantized_model('toy')
+
+    assert len(store) == 1  # served from the cache, not rebuilt
+    assert loaded is not built
+    mel = torch.randn(1, 80, 32)
+    assert torch.allclose(built.encoder(mel), loaded.encoder(mel))
+    assert loaded.encoder.blocks[0].mlp[0].weight().dtype == torch.qint8
+    tokens = torch.tensor([[1, 2, 3]])
+    assert torch.equal(built(mel, tokens), loaded(mel, tokens))
+    assert torch.equal(built.decoder.mask, loaded.decoder.mask)
+
+class Exploit:
+    ran = False
+
+    def __reduce__(self):
+        return (setattr, (Exploit, 'ran', True))
+
+def test_cache_is_never_fully_unpickled(store):
+    torch.save({'source_sha256': 'sha', 'torch_version': torch.__version__, 'model': Exploit()},
+               model_store.quantized_path('toy'))
+    model_store.load_quantized_model('toy')
+
+    assert not Exploit.ran
+    assert len(store) == 1  # rejected and rebuilt
+
+@pytest.fixture
+def fp16_checkpoint(monkeypatch, tmp_path):
+    path = tmp_path / 'toy.pt'
+    torch.save({'dims': asdict(DIMS), 'model_state_dict': Whisper(DIMS).half().state_dict()}, path)
+    monkeypatch.setattr(model_store, 'MODEL_DIR', str(tmp_path))
+    monkeypatch.setattr(model_store, 'model_path', lambda name: str(path))
+    monkeypatch.setattr(model_store, 'verify_model', lambda name: True)
+    monkeypatch.setattr(model_store, 'expected_sha256', lambda name: 'sha')
+    return path
+
+def test_cpu_load_maps_a_stored_fp32_copy(fp16_checkpoint):
+    model = model_store.load_model('toy')
+    copy = model_store.fp32_path('toy')
+    built_at = os.stat(copy).st_mtime_ns
+
+    again = model_store.load_model('toy')
+    assert os.stat(copy).st_mtime_ns == built_at  # reused, not rebuilt
+    assert all(p.dtype == torch.float32 for p in again.parameters())
+    mel = torch.randn(1, 80, 32)
+    assert torch.allclose(model.encoder(mel), again.encoder(mel))
+
+def test_stale_fp32_copy_is_rebuilt(fp16_checkpoint, monkeypatch):
+    model_store.load_model('toy')
+    monkeypatch.setattr(model_store, 'expected_sha256', lambda name: 'new-sha')
+    model_store.load_model('toy')
+    assert torch.load(model_store.fp32_path('toy'), weights_only=True)['source_sha256'] == 'new-sha'
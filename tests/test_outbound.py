@@ -0,0 +1,167 @@
+import os
+import threading
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import outbound
+from app.database import OutboundUpdate, SessionLocal, get_utc_now
+
+needs_postgres = pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason="TEST_DATABASE_URL is not set")
+
+def make_items(location_id, count, kind='test', lease_seconds=outbound.OUTBOUND_LEASE_SECONDS):
+    locked_until = get_utc_now() + timedelta(seconds=lease_seconds)
+    return [
+        SimpleNamespace(id=i, location_id=location_id, kind=kind, payload={'n': i}, attempts=0,
+                        created_at=get_utc_now(), locked_until=locked_until)
+        for i in range(count)
+    ]
+
+@pytest.fixture
+def settled(monkeypatch):
+    calls = []
+    monkeypatch.setattr(outbound.ghl_rate_limiter, 'try_acquire', lambda location_id: True)
+    monkeypatch.setattr(outbound.OutboundSender, '_settle', lambda self, *args: calls.append(args))
+    return calls
+
+def test_failed_update_holds_back_the_rest_of_its_location(settled, monkeypatch):
+    delivered = []
+
+    def handler(location_id, payload):
+        if payload['n'] == 1:
+            raise outbound.DeliveryError("HTTP 503", retryable=True)
+        delivered.append(payload['n'])
+
+    monkeypatch.setitem(outbound._handlers, 'test', handler)
+    items = make_items('loc', 4)
+    outbound.OutboundSender()._send_group(items)
+
+    sent, retries, dead, deferred, deferred_until = settled[0]
+    assert delivered == [0]
+    assert sent == items[:1]
+    assert [item for item, _, _, _ in retries] == [items[1]]
+    assert dead == []
+    # Later updates wait for the failed one's retry instead of overtaking it
+    assert deferred == items[2:]
+    assert deferred_until == retries[0][2]
+
+def test_rate_limited_location_defers_everything_in_order(settled, monkeypatch):
+    allowed = iter([True, False])
+    monkeypatch.setattr(outbound.ghl_rate_limiter, 'try_acquire', lambda location_id: next(allowed))
+    monkeypatch.setitem(outbound._handlers, 'test', lambda location_id, payload: None)
+    items = make_items('loc', 3)
+    outbound.OutboundSender()._send_group(items)
+
+    sent, retries, dead, deferred, _ = settled[0]
+    assert sent == items[:1]
+    assert deferred == items[1:]
+
+def test_group_renews_its_lease_before_it_runs_out(settled, monkeypatch):
+    renewals = []
+
+    def renew(items, locked_until):
+        renewals.append([item.id for item in items])
+        return get_utc_now() + timedelta(seconds=outbound.OUTBOUND_LEASE_SECONDS)
+
+    monkeypatch.setattr(outbound, 'renew_lease', renew)
+    monkeypatch.setitem(outbound._handlers, 'test', lambda location_id, payload: None)
+    items = make_items('loc', 3, lease_seconds=outbound.OUTBOUND_SEND_SECONDS - 1)
+    outbound.OutboundSender()._send_group(items)
+
+    # Renewed once, for everything still to send; then the lease is long enough
+    assert renewals == [[0, 1, 2]]
+    assert settled[0][0] == items
+
+def test_group_stops_when_its_lease_is_lost(settled, monkeypatch):
+    delivered = []
+    leases = iter([get_utc_now() + timedelta(seconds=1), None])
+    monkeypatch.setattr(outbound, 'renew_lease', lambda items, locked_until: next(leases))
+    monkeypatch.setitem(outbound._handlers, 'test', lambda location_id, payload: delivered.append(payload['n']))
+    items = make_items('loc', 3, lease_seconds=1)
+    outbound.OutboundSender()._send_group(items)
+
+    sent, retries, dead, deferred, _ = settled[0]
+    assert delivered == [0]
+    assert sent == items[:1]
+    # Not deferred either: another node may already hold them
+    assert deferred == []
+
+def test_stop_timeout_does_not_strand_the_flushing_thread(monkeypatch, capsys):
+    claiming = threading.Event()
+    release = threading.Event()
+
+    def claim(limit):
+        if release.is_set():
+            return []
+        claiming.set()
+        release.wait(5)
+        return make_items('loc', 1)
+
+    monkeypatch.setattr(outbound, 'claim_updates', claim)
+    sender = outbound.OutboundSender(workers=1)
+    sender.start()
+    thread = sender._thread
+    assert claiming.wait(5)
+    sender.stop(timeout=0.05, flush=True)
+    release.set()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    # The late batch fails on the shut-down executor, not on a missing one
+    assert 'NoneType' not in capsys.readouterr().out
+
+@pytest.fixture
+def outbound_rows():
+    location_ids = [f'test-{uuid.uuid4().hex}' for _ in range(2)]
+    db = SessionLocal()
+    OutboundUpdate.__table__.create(db.get_bind(), checkfirst=True)
+
+    def add(location_id, **values):
+        item = OutboundUpdate(location_id=location_id, kind='test', payload={}, **values)
+        db.add(item)
+        db.commit()
+        return item.id
+
+    yield location_ids, add
+    db.query(OutboundUpdate).filter(OutboundUpdate.location_id.in_(location_ids)).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+
+@needs_postgres
+def test_lease_renewal_fails_once_another_node_holds_it(outbound_rows):
+    (location_id, _), add = outbound_rows
+    add(location_id)
+    items = [item for item in outbound.claim_updates() if item.location_id == location_id]
+    renewed = outbound.renew_lease(items, items[0].locked_until)
+    assert renewed is not None
+    assert outbound.renew_lease(items, items[0].locked_until) is None
+
+@needs_postgres
+def test_claim_skips_updates_behind_a_backed_off_one(outbound_rows):
+    (blocked, free), add = outbound_rows
+    add(blocked, next_attempt_at=get_utc_now() + timedelta(minutes=5))
+    add(blocked)
+    free_id = add(free)
+
+    claimed = [item for item in outbound.claim_updates() if item.location_id in (blocked, free)]
+    assert [item.id for item in claimed] == [free_id]
+
+@needs_postgres
+def test_claim_skips_updates_behind_one_leased_by_another_node(outbound_rows):
+    (leased, _), add = outbound_rows
+    add(leased, locked_until=get_utc_now() + timedelta(minutes=5))
+    add(leased)
+
+    assert not [item for item in outbound.claim_updates() if item.location_id == leased]
+
+@needs_postgres
+def test_second_claim_does_not_split_a_location(outbound_rows):
+    (location_id, _), add = outbound_rows
+    ids = [add(location_id) for _ in range(3)]
+
+    first = [item.id for item in outbound.claim_updates() if item.location_id == location_id]
+    second = [item.id for item in outbound.claim_updates() if item.location_id == location_id]
+    assert first == ids
+    assert second == []
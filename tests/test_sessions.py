@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+from flask import Flask
+
+from app.database import get_utc_now
+from app.sessions import DatabaseSession, DatabaseSessionInterface
+
+class SharedStore(DatabaseSessionInterface):
+    """Stands in for the sessions table shared by every node"""
+
+    def __init__(self):
+        self.rows = {}
+        self.writes = 0
+
+    def _fetch(self, sid):
+        row = self.rows.get(sid)
+        return None if row is None else (dict(row[0]), row[1])
+
+    def _write(self, sid, data, expires_at):
+        self.writes += 1
+        self.rows[sid] = (dict(data), expires_at)
+
+    def _remove(self, sid):
+        self.rows.pop(sid, None)
+
+def make_app():
+    app = Flask(__name__)
+    app.permanent_session_lifetime = timedelta(hours=1)
+    return app
+
+def test_write_on_another_node_is_read_immediately():
+    store = SharedStore()
+    now = get_utc_now()
+    store._write('sid', {'oauth_state': 'old'}, now + timedelta(hours=1))
+    assert store._load('sid', now)[0] == {'oauth_state': 'old'}
+
+    # /login on node A, /callback on node B
+    store._write('sid', {'oauth_state': 'new'}, now + timedelta(hours=1))
+    assert store._load('sid', now)[0] == {'oauth_state': 'new'}
+
+def test_expired_session_is_not_loaded():
+    store = SharedStore()
+    now = get_utc_now()
+    store.rows['sid'] = ({'user': 1}, now - timedelta(seconds=1))
+    assert store._load('sid', now) is None
+
+def test_unchanged_session_is_not_rewritten_every_request():
+    store = SharedStore()
+    app = make_app()
+    session = DatabaseSession({'user': 1}, sid='sid', expires_at=get_utc_now() + timedelta(minutes=50))
+    with app.test_request_context():
+        store.save_session(app, session, app.response_class())
+    assert store.writes == 0
+
+def test_session_near_expiry_is_extended():
+    store = SharedStore()
+    app = make_app()
+    session = DatabaseSession({'user': 1}, sid='sid', expires_at=get_utc_now() + timedelta(minutes=10))
+    with app.test_request_context():
+        store.save_session(app, session, app.response_class())
+    assert store.writes == 1
+    assert store.rows['sid'][1] - get_utc_now() > timedelta(minutes=55)
+
+def test_cleared_session_is_deleted():
+    store = SharedStore()
+    app = make_app()
+    store.rows['sid'] = ({'user': 1}, get_utc_now() + timedelta(hours=1))
+    session = DatabaseSession({'user': 1}, sid='sid', expires_at=store.rows['sid'][1])
+    session.clear()
+    with app.test_request_context():
+        store.save_session(app, session, app.response_class())
+    assert 'sid' not in store.rows
@@ -0,0 +1,115 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+
+from app import metrics
+from app.audio import SAMPLE_RATE
+from app.shared_audio import (
+    FILE_PREFIX, AudioHandle, AudioRing, SharedAudio, attach, from_payload, release, remove_stale_files,
+    samples, to_payload, window
+)
+
+@pytest.fixture
+def ring(tmp_path):
+    ring = AudioRing(slots=1, slot_seconds=1, directory=str(tmp_path))
+    yield ring
+    ring.close()
+
+def test_slot_returns_to_the_ring_after_the_last_reference(ring):
+    shared = ring.lease()
+    part = shared.window(100, 200)
+    shared.release()
+    assert ring.stats()['in_use'] == 1
+
+    # Released twice by mistake: still one reference
+    shared.release()
+    assert ring.lease(timeout=0) is None
+    part.release()
+    assert ring.stats()['in_use'] == 0
+
+    again = ring.lease()
+    assert again.handle.path == shared.handle.path
+    assert ring.stats()['allocated'] == 1
+    again.release()
+
+def test_window_is_a_view_of_the_same_samples(ring):
+    audio = np.arange(SAMPLE_RATE // 2, dtype=np.float32)
+    shared = ring.put(audio)
+    with shared.window(10, 20) as part:
+        assert part.handle.offset == 10 and len(part) == 10
+        assert np.array_equal(part.array, audio[10:20])
+        part.array[0] = -1
+    assert shared.array[10] == -1
+    # Bounds are clamped to the window
+    with shared.window(-5, 10 ** 9) as whole:
+        assert len(whole) == len(audio)
+    shared.release()
+
+def test_truncate_shrinks_to_written_samples(ring):
+    shared = ring.lease()
+    assert len(shared) == ring.slot_samples
+    shared.truncate(123)
+    assert len(shared) == 123
+    shared.truncate(10 ** 9)
+    assert len(shared) == 123
+    shared.release()
+
+def test_busy_ring_falls_back(ring):
+    before = metrics.counter('shared_audio.fallback.busy')
+    held = ring.lease()
+    assert ring.lease(timeout=0.01) is None
+    assert ring.put(np.zeros(10, dtype=np.float32)) is None
+    assert metrics.counter('shared_audio.fallback.busy') == before + 2
+    held.release()
+    assert ring.lease(timeout=0.01) is not None
+
+def test_clip_longer_than_a_slot_falls_back(ring):
+    before = metrics.counter('shared_audio.fallback.too_long')
+    assert ring.put(np.zeros(ring.slot_samples + 1, dtype=np.float32)) is None
+    assert metrics.counter('shared_audio.fallback.too_long') == before + 1
+    assert ring.stats()['in_use'] == 0
+
+def test_attach_reads_a_pickled_handle(ring):
+    audio = np.linspace(-1, 1, 1000, dtype=np.float32)
+    shared = ring.put(audio)
+    payload = pickle.loads(pickle.dumps(to_payload(shared)))
+    assert isinstance(payload, AudioHandle)
+    assert len(pickle.dumps(payload)) < 200
+    assert np.array_equal(from_payload(payload), audio)
+    assert np.array_equal(attach(payload._replace(offset=500, length=10)), audio[500:510])
+    shared.release()
+
+def test_helpers_accept_plain_arrays(ring):
+    audio = np.ones(50, dtype=np.float32)
+    assert samples(audio) is audio
+    assert np.array_equal(window(audio, 10, 20), audio[10:20])
+    assert from_payload(to_payload(audio)) is audio
+    release(audio)
+
+    shared = ring.put(audio)
+    part = window(shared, 10, 20)
+    assert isinstance(part, SharedAudio)
+    release(shared)
+    release(part)
+    assert ring.stats()['in_use'] == 0
+
+def test_close_removes_slot_files_and_stops_leasing(tmp_path):
+    ring = AudioRing(slots=2, slot_seconds=1, directory=str(tmp_path))
+    ring.lease().release()
+    assert any(name.startswith(FILE_PREFIX) for name in os.listdir(tmp_path))
+    ring.close()
+    assert not os.listdir(tmp_path)
+    assert ring.lease(timeout=0.01) is None
+
+def test_stale_files_of_dead_processes_are_removed(tmp_path):
+    dead_pid = 2 ** 22 + 12345
+    stale = tmp_path / f"{FILE_PREFIX}{dead_pid}-0"
+    live = tmp_path / f"{FILE_PREFIX}{os.getpid()}-0"
+    other = tmp_path / "unrelated"
+    for path in (stale, live, other):
+        path.write_bytes(b'')
+    remove_stale_files(str(tmp_path))
+    assert not stale.exists()
+    assert live.exists() and other.exists()
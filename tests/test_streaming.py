@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from app import pipeline
+from app.audio import SAMPLE_RATE
+from app.model_store import ModelStoreError
+from app.pipeline import StreamProgress, split_window, transcribe_streaming
+
+def fake_inference(fail_at=None):
+    """run_inference stand-in emitting one 1 s segment per second of audio
+
+    Each word is named after its absolute second, read from the offset the
+    window was cut at, so repeated or skipped audio shows up in the text.
+    """
+    calls = []
+
+    def run(chunk, model=None, **options):
+        calls.append(model)
+        if fail_at is not None and len(calls) == fail_at:
+            raise ModelStoreError("model unavailable")
+        start = int(chunk[0])
+        seconds = len(chunk) // SAMPLE_RATE
+        segments = [
+            {'start': float(i), 'end': float(i + 1), 'text': f" w{start + i}"}
+            for i in range(seconds)
+        ]
+        return {'text': "".join(s['text'] for s in segments), 'language': 'es', 'segments': segments}
+    return run, calls
+
+def clip(seconds):
+    # Each sample holds its second, so a window knows where it starts
+    return np.repeat(np.arange(seconds, dtype=np.float32), SAMPLE_RATE)
+
+def words(text):
+    return text.split()
+
+def test_split_window_drops_segments_in_overlap():
+    result = {'text': 'a b c', 'segments': [
+        {'start': 0.0, 'end': 4.0, 'text': ' a'},
+        {'start': 4.0, 'end': 9.0, 'text': ' b'},
+        {'start': 9.0, 'end': 15.0, 'text': ' c'}
+    ]}
+    text, consumed = split_window(result, 15 * SAMPLE_RATE, last=False)
+    assert text == 'a b'
+    assert consumed == 9 * SAMPLE_RATE
+
+    text, consumed = split_window(result, 15 * SAMPLE_RATE, last=True)
+    assert text == 'a b c'
+    assert consumed == 15 * SAMPLE_RATE
+
+def test_split_window_without_boundary_takes_whole_window():
+    result = {'text': 'long', 'segments': [{'start': 0.0, 'end': 15.0, 'text': ' long'}]}
+    assert split_window(result, 15 * SAMPLE_RATE, last=False) == ('long', 15 * SAMPLE_RATE)
+
+def test_streaming_covers_every_second_once(monkeypatch):
+    run, _ = fake_inference()
+    monkeypatch.setattr(pipeline, 'run_inference', run)
+    partials = []
+    result = transcribe_streaming(clip(100), partials.append)
+    assert words(result['text']) == [f"w{i}" for i in range(100)]
+    assert words(" ".join(partials)) == words(result['text'])
+
+def test_fallback_resumes_after_reported_windows(monkeypatch):
+    run, calls = fake_inference(fail_at=3)
+    monkeypatch.setattr(pipeline, 'run_inference', run)
+    partials = []
+    progress = StreamProgress()
+    with pytest.raises(ModelStoreError):
+        transcribe_streaming(clip(100), partials.append, 'large', progress)
+    result = transcribe_streaming(clip(100), partials.append, 'base', progress)
+
+    assert words(result['text']) == [f"w{i}" for i in range(100)]
+    # Nothing reported before the failure is reported again
+    assert words(" ".join(partials)) == words(result['text'])
+    assert calls[:3] == ['large'] * 3 and set(calls[3:]) == {'base'}
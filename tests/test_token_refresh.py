@@ -0,0 +1,83 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from app import token_refresh
+from app.database import get_utc_now
+
+class CountingSessions:
+    """SessionLocal stand-in that tracks how many sessions are open"""
+
+    def __init__(self):
+        self.open = 0
+        self.fail_commits = 0
+
+    def __call__(self):
+        self.open += 1
+        sessions = self
+
+        class Session:
+            def commit(self):
+                if sessions.fail_commits:
+                    sessions.fail_commits -= 1
+                    raise RuntimeError("connection lost")
+
+            def rollback(self):
+                pass
+
+            def refresh(self, token):
+                pass
+
+            def expunge(self, token):
+                pass
+
+            def close(self):
+                sessions.open -= 1
+
+        return Session()
+
+@pytest.fixture
+def sessions(monkeypatch):
+    sessions = CountingSessions()
+    released = []
+    due = SimpleNamespace(id=1, refresh_token='old', expires_at=get_utc_now() - timedelta(minutes=1))
+    monkeypatch.setattr(token_refresh, 'SessionLocal', sessions)
+    monkeypatch.setattr(token_refresh, 'acquire_lease', lambda location_id: 'holder')
+    monkeypatch.setattr(token_refresh, 'release_lease', lambda location_id, holder: released.append(holder))
+    monkeypatch.setattr(token_refresh, 'read_location_token', lambda location_id: due)
+    monkeypatch.setattr(token_refresh, 'store_refreshed_token', lambda db, info, location_id: SimpleNamespace(
+        access_token=info['access_token'], expires_at=get_utc_now() + timedelta(hours=1)
+    ))
+    monkeypatch.setattr(token_refresh.time, 'sleep', lambda seconds: None)
+    sessions.released = released
+    return sessions
+
+def test_exchange_runs_without_a_database_connection(sessions, monkeypatch):
+    def exchange(refresh_token):
+        assert sessions.open == 0
+        return {'access_token': 'new', 'refresh_token': 'next'}
+
+    monkeypatch.setattr(token_refresh, 'exchange_with_retry', exchange)
+    token = token_refresh.refresh_location('loc')
+
+    assert token.access_token == 'new'
+    assert sessions.released == ['holder']
+
+def test_issued_token_is_stored_despite_a_failed_commit(sessions, monkeypatch):
+    exchanges = []
+    monkeypatch.setattr(token_refresh, 'exchange_with_retry', lambda refresh_token: exchanges.append(1) or {
+        'access_token': 'new', 'refresh_token': 'next'
+    })
+    sessions.fail_commits = 1
+    token = token_refresh.refresh_location('loc')
+
+    assert token.access_token == 'new'
+    # The spent refresh token is not exchanged again
+    assert exchanges == [1]
+
+def test_held_lease_skips_the_location(sessions, monkeypatch):
+    monkeypatch.setattr(token_refresh, 'acquire_lease', lambda location_id: None)
+    monkeypatch.setattr(token_refresh, 'exchange_with_retry', lambda refresh_token: pytest.fail("exchanged"))
+    assert token_refresh.refresh_location('loc') is None
+    assert sessions.released == []
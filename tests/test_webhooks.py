@@ -0,0 +1,121 @@
+import os
+import uuid
+from datetime import timedelta
+
+import pytest
+
+from app import job_queue, webhooks
+from app.database import QueuedJob, SessionLocal, get_utc_now
+from app.job_scheduler import TranscriptionJob
+
+needs_postgres = pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason="TEST_DATABASE_URL is not set")
+
+def make_jobs():
+    return [TranscriptionJob(f'https://cdn/{i}.ogg', location_id='loc', message_id=f'm{i}') for i in range(3)]
+
+def test_jobs_are_accepted_only_after_durable_insert(monkeypatch):
+    calls = []
+
+    def enqueue(jobs, claim=False):
+        calls.append(claim)
+        # The second job was delivered before
+        return [job for job in jobs if job.message_id != 'm1']
+
+    adopted = []
+    monkeypatch.setattr(webhooks, 'enqueue_jobs', enqueue)
+    monkeypatch.setattr(webhooks.queue_worker, 'adopt', adopted.extend)
+    jobs = make_jobs()
+    claimed = webhooks.claim_jobs(jobs)
+
+    assert calls == [True]
+    assert [job.message_id for job in claimed] == ['m0', 'm2']
+    assert adopted == claimed
+
+def test_database_outage_accepts_everything_without_adopting(monkeypatch):
+    def enqueue(jobs, claim=False):
+        raise RuntimeError("database down")
+
+    adopted = []
+    monkeypatch.setattr(webhooks, 'enqueue_jobs', enqueue)
+    monkeypatch.setattr(webhooks.queue_worker, 'adopt', adopted.extend)
+    jobs = make_jobs()
+    assert webhooks.claim_jobs(jobs) == jobs
+    assert adopted == []
+
+def test_queue_worker_completes_adopted_jobs_but_not_cancelled_ones(monkeypatch):
+    completed = []
+    monkeypatch.setattr(job_queue, 'complete_jobs', completed.extend)
+    worker = job_queue.QueueWorker(scheduler=None)
+    finished, cancelled, running = make_jobs()
+    worker.adopt([finished, cancelled, running])
+    finished.done.set()
+    cancelled.cancel()
+    cancelled.done.set()
+
+    worker.finish()
+    assert completed == [finished]
+    assert worker.outstanding == [running]
+
+def test_queue_worker_heartbeats_running_jobs_and_cancels_lost_ones(monkeypatch):
+    renewed = []
+
+    def renew(jobs):
+        renewed.append([job.queue_id for job in jobs])
+        # Job 2 was claimed again by another worker
+        return {1}
+
+    monkeypatch.setattr(job_queue, 'JOB_HEARTBEAT_SECONDS', 0)
+    monkeypatch.setattr(job_queue, 'renew_leases', renew)
+    worker = job_queue.QueueWorker(scheduler=None)
+    running, lost, finished = make_jobs()
+    for queue_id, job in enumerate((running, lost, finished), start=1):
+        job.queue_id = queue_id
+    finished.done.set()
+    worker.adopt([running, lost, finished])
+
+    worker._heartbeat()
+    assert renewed == [[1, 2]]
+    assert lost.cancelled and not running.cancelled
+
+def test_queue_worker_keeps_jobs_when_heartbeat_fails(monkeypatch):
+    monkeypatch.setattr(job_queue, 'JOB_HEARTBEAT_SECONDS', 0)
+    monkeypatch.setattr(job_queue, 'renew_leases', lambda jobs: None)
+    worker = job_queue.QueueWorker(scheduler=None)
+    jobs = make_jobs()
+    for queue_id, job in enumerate(jobs, start=1):
+        job.queue_id = queue_id
+    worker.adopt(jobs)
+
+    worker._heartbeat()
+    assert not any(job.cancelled for job in jobs)
+
+@pytest.fixture
+def queued_rows():
+    """Insert running jobs held by another worker; removed afterwards"""
+    db = SessionLocal()
+    QueuedJob.__table__.create(db.get_bind(), checkfirst=True)
+    ids = []
+
+    def add(**values):
+        row = QueuedJob(dedup_key=uuid.uuid4().hex, location_id='test', url='https://cdn/a.ogg',
+                        status='running', worker_id='test-gone', attempts=1, **values)
+        db.add(row)
+        db.commit()
+        ids.append(row.id)
+        return row.id
+
+    yield add
+    db.query(QueuedJob).filter(QueuedJob.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+
+@needs_postgres
+def test_only_jobs_with_a_stale_heartbeat_are_claimed_again(queued_rows):
+    now = get_utc_now()
+    long_running = queued_rows(started_at=now - timedelta(hours=2), heartbeat_at=now)
+    abandoned = queued_rows(started_at=now - timedelta(hours=2),
+                            heartbeat_at=now - timedelta(seconds=job_queue.JOB_LEASE_SECONDS + 60))
+
+    claimed = {job.queue_id for job in job_queue.claim_jobs(100, worker_id='test-other')}
+    assert abandoned in claimed
+    assert long_running not in claimed
@@ -0,0 +1,15 @@
+"""
+Web role: validate webhooks and enqueue them in Postgres.
+
+Transcription runs on worker nodes (worker.py). Serve with any WSGI server,
+e.g. `gunicorn -w 4 web:app`, or run directly for development.
+"""
+
+import os
+
+os.environ.setdefault('PROCESS_ROLE', 'web')
+
+from app import app  # noqa: E402
+
+if __name__ == '__main__':
+    app.run(host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', 5000)))
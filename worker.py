@@ -0,0 +1,41 @@
+"""
+Worker role: claim queued transcription jobs from Postgres and run them.
+
+Start one per node (each uses TRANSCRIPTION_WORKERS threads, one per
+inference worker by default when the inference pool is on, and, if
+configured, the decoder pool); web nodes run web.py.
+"""
+
+import os
+import signal
+
+os.environ.setdefault('PROCESS_ROLE', 'worker')
+
+from app import scheduler  # noqa: E402
+from app.job_queue import QueueWorker  # noqa: E402
+from app.outbound import outbound_sender  # noqa: E402
+from app.pipeline import transcription_scheduler  # noqa: E402
+from app.shutdown import drain, is_draining  # noqa: E402
+
+def main():
+    worker = QueueWorker(transcription_scheduler)
+
+    def signal_handler(sig, frame):
+        if is_draining():
+            print("\nForced shutdown")
+            os._exit(1)
+        print("\nStopping queue worker...")
+        worker.stop()
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    # Token refresh and sweeps run on workers so web nodes stay stateless
+    scheduler.start()
+    outbound_sender.start()
+    worker.run()
+    # Finish or checkpoint claimed jobs and flush updates before exiting
+    drain(worker)
+
+if __name__ == '__main__':
+    main()